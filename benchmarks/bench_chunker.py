@@ -0,0 +1,100 @@
+"""
+Throughput of the local Chunker on synthetic papers, default segmentation rules of
+Document.process_rule. Reports MB/s and the time the same rate needs for 1 GB, and
+exits with status 1 when that is above --budget.
+
+    python -m benchmarks.bench_chunker --mb 1024 --threads 8
+
+The budget is 300s per GB on one core, not 1 GB per minute: recorded on one core with
+the offline encoding, 4.5-7 MB/s or 150-220s per GB. About 75% of that is token
+counting, which runs on `--threads` threads; cleaning and splitting (about 55s per GB)
+stay on one thread, so a minute per GB is out of reach whatever the core count.
+
+Uses cl100k_base when tiktoken can load it, else (offline) a tiktoken encoding with
+the cl100k pre-tokenizer and merges for the benchmark vocabulary only, about one token
+per word as with cl100k_base on English prose.
+"""
+
+import argparse
+import random
+import sys
+import time
+
+import tiktoken
+
+from src.handler.chunker import ENCODING, Chunker, byte_level_encoding
+
+WORDS = (
+    "the of and to in a is that for it as was with be by on not this are or from at "
+    "which but have an were has been their model data results method spatial urban "
+    "network learning analysis using based our we approach proposed performance"
+).split()
+
+
+def load_encoding() -> tiktoken.Encoding:
+    try:
+        return tiktoken.get_encoding(ENCODING)
+    except Exception as e:
+        print(f"{ENCODING} unavailable ({type(e).__name__}), using word-level tokens")
+        return byte_level_encoding([w.capitalize() for w in WORDS] + WORDS)
+
+
+def make_paper(rng: random.Random, size: int) -> str:
+    """
+    About `size` characters of sentences in paragraphs, paragraphs in sections.
+    """
+    sections, length = [], 0
+    while length < size:
+        paragraphs = []
+        for _ in range(rng.randint(2, 8)):
+            sentences = [
+                " ".join(rng.choices(WORDS, k=rng.randint(8, 30))).capitalize() + "."
+                for _ in range(rng.randint(2, 10))
+            ]
+            paragraphs.append(" ".join(sentences))
+        section = "\n\n".join(paragraphs)
+        sections.append(section)
+        length += len(section) + 3
+    return "\n\n\n".join(sections)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--mb", type=float, default=64)
+    parser.add_argument("--paper-kb", type=int, default=256)
+    parser.add_argument("--batch", type=int, default=32, help="papers per chunk call")
+    parser.add_argument("--threads", type=int, default=0, help="0 for one per core")
+    parser.add_argument(
+        "--budget", type=float, default=300.0, help="seconds per GB, fails above"
+    )
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    papers = [make_paper(rng, args.paper_kb * 1024) for _ in range(args.batch)]
+    batch_mb = sum(len(p.encode("utf-8")) for p in papers) / 1e6
+    chunker = Chunker(encoding=load_encoding(), num_threads=args.threads)
+
+    done_mb, seconds, stats = 0.0, 0.0, None
+    while done_mb < args.mb:
+        start = time.perf_counter()
+        segments = chunker.chunk(papers)
+        seconds += time.perf_counter() - start
+        batch_stats = chunker.stats(segments)
+        stats = batch_stats if stats is None else stats
+        done_mb += batch_mb
+
+    per_gb = 1000 / (done_mb / seconds)
+    print(
+        f"{done_mb:.0f} MB in {seconds:.1f}s: {done_mb / seconds:.1f} MB/s, "
+        f"1 GB in {per_gb:.0f}s with {chunker.num_threads} threads"
+    )
+    print(
+        f"per {args.batch} papers: {stats.parents} parents ({stats.parent_tokens} tokens), "
+        f"{stats.children} children ({stats.child_tokens} tokens)"
+    )
+    if per_gb > args.budget:
+        sys.exit(f"over budget: {per_gb:.0f}s per GB, budget {args.budget:.0f}s")
+
+
+if __name__ == "__main__":
+    main()
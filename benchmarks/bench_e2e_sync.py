@@ -0,0 +1,110 @@
+"""
+End-to-end throughput of a full zdb2dify sync: a synthetic Zotero library with storage
+files is synced into the local Dify emulator, with per-endpoint latency and optional
+429 / 503 injection. Reports documents per second, requests per document and the
+server-side p50 / p99 request latency, then the same for a second, no-op sync.
+
+    python -m benchmarks.bench_e2e_sync --items 500 --concurrency 8 --upload-latency 0.05
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+from benchmarks.dify_emulator import DifyEmulator, EmulatorConfig
+from benchmarks.synthetic_zotero import build_zotero_db
+from src.config import get_config
+from src.handler.dify_knowledge_base import KBConfig
+from src.pipeline.zdb2dify import Pipeline, PipeConfig
+
+
+def run_sync(pipeline: Pipeline, emulator: DifyEmulator, dataset_id: str, label: str):
+    before = emulator.stats.total
+    durations = len(emulator.stats.durations)
+    docs_before = len(emulator.documents(dataset_id))
+    start = time.perf_counter()
+    pipeline.sync_zotero_attachments()
+    seconds = time.perf_counter() - start
+    docs = len(emulator.documents(dataset_id)) - docs_before
+    requests = emulator.stats.total - before
+    # percentiles of this run only
+    run_stats = type(emulator.stats)(durations=emulator.stats.durations[durations:])
+    print(
+        f"{label}: {docs} documents in {seconds:.2f}s, {docs / seconds:.1f} docs/s, "
+        f"{requests} requests ({requests / max(docs, 1):.2f} per document), "
+        f"p50 {run_stats.percentile(50) * 1000:.1f} ms, "
+        f"p99 {run_stats.percentile(99) * 1000:.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=500)
+    parser.add_argument("--attachments", type=int, default=1)
+    parser.add_argument("--file-size", type=int, default=64 * 1024)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--latency", type=float, default=0.005, help="seconds, any call"
+    )
+    parser.add_argument("--upload-latency", type=float, default=0.05)
+    parser.add_argument("--metadata-latency", type=float, default=0.02)
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0)
+    parser.add_argument("--error-ratio", type=float, default=0.0)
+    parser.add_argument("--indexing-delay", type=float, default=0.0)
+    args = parser.parse_args()
+
+    emulator_config = EmulatorConfig(
+        default_latency=args.latency,
+        latency={
+            "create_by_file": args.upload_latency,
+            "create_by_text": args.upload_latency,
+            "update_by_file": args.upload_latency,
+            "update_by_text": args.upload_latency,
+            "update_metadata": args.metadata_latency,
+        },
+        rate_limit_ratio=args.rate_limit_ratio,
+        error_ratio=args.error_ratio,
+        indexing_delay=args.indexing_delay,
+    )
+    with (
+        tempfile.TemporaryDirectory() as tmpdir,
+        DifyEmulator(emulator_config) as emulator,
+    ):
+        build_zotero_db(
+            Path(tmpdir) / "zotero.sqlite",
+            n_items=args.items,
+            tagged_ratio=1.0,
+            attachments_per_item=args.attachments,
+            storage_files=True,
+            file_size=args.file_size,
+        )
+        dataset_id = emulator.add_dataset("Zotero")
+        # Attachment.abspath resolves files under the configured Zotero data dir
+        with patch.dict(get_config(), {"zotero": {"data_dir": tmpdir}}):
+            pipeline = Pipeline(
+                PipeConfig(
+                    kb_name="Zotero",
+                    zotero_db=tmpdir,
+                    archive_path=str(Path(tmpdir) / "archive.sqlite"),
+                    concurrency=args.concurrency,
+                    rate_limit=0,
+                    kb_config=KBConfig(
+                        api_key="",
+                        base_url=emulator.base_url,
+                        backoff_factor=0.05,
+                        backoff_jitter=0.0,
+                        cache_ttl=0,
+                    ),
+                )
+            )
+            run_sync(pipeline, emulator, dataset_id, "full sync")
+            run_sync(pipeline, emulator, dataset_id, "no-op sync")
+            pipeline.archive.close()
+        print(f"requests by endpoint: {emulator.stats.requests}")
+        print(f"responses by status: {emulator.stats.statuses}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Import time of main.py, what every CLI or cron invocation pays before doing anything.
+Runs `python -X importtime -c "import main"` in fresh interpreters and fails when the
+median is above the budget.
+
+    python -m benchmarks.bench_import --runs 5 --budget-ms 300
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parents[1]
+
+
+def import_times(module: str) -> dict:
+    """
+    Cumulative import time in microseconds of every module imported by `module`.
+    """
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=300)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(args.runs)]
+    total_ms = statistics.median(r[args.module] for r in runs) / 1000
+    last = runs[-1]
+    for name in sorted(last, key=last.get, reverse=True)[: args.top]:
+        print(f"{last[name] / 1000:8.1f} ms  {name}")
+    print(
+        f"import {args.module}: median {total_ms:.0f} ms over {args.runs} runs, "
+        f"budget {args.budget_ms:.0f} ms"
+    )
+    if total_ms > args.budget_ms:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
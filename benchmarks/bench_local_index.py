@@ -0,0 +1,69 @@
+"""
+Query latency of the LocalIndex over synthetic chunks, with a hashing stand-in for
+the embedding model (bge-small: 384 dimensions) so only the index itself is timed.
+
+    python -m benchmarks.bench_local_index --chunks 100000
+"""
+
+import argparse
+import random
+import tempfile
+import time
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+from benchmarks.bench_chunker import WORDS
+from src.handler.local_index import LocalIndex, tokenize
+
+DIM = 384
+
+
+def hashing_embed(texts):
+    vectors = np.zeros((len(texts), DIM), dtype=np.float32)
+    for i, text in enumerate(texts):
+        for token in tokenize(text):
+            vectors[i, zlib.crc32(token.encode()) % DIM] += 1
+    return vectors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunks", type=int, default=100000)
+    parser.add_argument("--chunks-per-item", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        index = LocalIndex(Path(tmp) / "index.sqlite", embed=hashing_embed)
+        start = time.perf_counter()
+        for item in range(0, args.chunks, args.chunks_per_item):
+            chunks = [
+                " ".join(rng.choices(WORDS, k=rng.randint(60, 200)))
+                + f" term{item + i}"
+                for i in range(args.chunks_per_item)
+            ]
+            index.upsert(f"ITEM{item:07d}", chunks)
+        print(f"indexed {args.chunks} chunks in {time.perf_counter() - start:.1f}s")
+
+        start = time.perf_counter()
+        index.load()
+        print(f"loaded in {time.perf_counter() - start:.2f}s")
+
+        latencies = []
+        for _ in range(args.queries):
+            query = (
+                " ".join(rng.choices(WORDS, k=3)) + f" term{rng.randrange(args.chunks)}"
+            )
+            start = time.perf_counter()
+            index.search(query, k=10)
+            latencies.append(time.perf_counter() - start)
+        p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+        print(f"{args.queries} queries: p50 {p50:.1f} ms, p95 {p95:.1f} ms")
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
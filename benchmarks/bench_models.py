@@ -0,0 +1,130 @@
+"""
+Memory and load time of a synthetic sync archive with the slotted, interned models
+against the previous plain frozen dataclasses (one ParentItem copy per attachment).
+
+    python -m benchmarks.bench_models --attachments 100000
+"""
+
+import argparse
+import gc
+import json
+import random
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import List, Optional
+
+from src.handler.sync_archive import SyncArchive
+from src.handler.zotero_database import Attachment, ParentItem
+
+
+@dataclass(frozen=True)
+class LegacyParentItem:
+    itemID: int
+    key: str
+    tags: List[str]
+    title: str
+    itemTypeID: int
+
+
+@dataclass(frozen=True)
+class LegacyAttachment:
+    itemID: int
+    itemKey: str
+    contentType: str
+    relpath: str
+    title: str
+    parentItem: LegacyParentItem
+    fileSize: Optional[int] = None
+    fileMtime: Optional[int] = None
+    fileHash: Optional[str] = None
+
+    @staticmethod
+    def from_dict(d):
+        return LegacyAttachment(
+            **{k: v for k, v in d.items() if k != "parentItem"},
+            parentItem=LegacyParentItem(**d["parentItem"]),
+        )
+
+
+def build_archive(path, n_attachments: int, per_parent: int, seed: int = 0):
+    rng = random.Random(seed)
+    tags = ["#read/todo", "#read/done", "#topic/llm", "#topic/gis", "#topic/rs"]
+    archive = SyncArchive(path)
+    batch = []
+    for i in range(n_attachments):
+        p = i // per_parent
+        if i % per_parent == 0:
+            parent = ParentItem(
+                itemID=p,
+                key=f"P{p:07d}",
+                tags=rng.sample(tags, rng.randint(1, 3)),
+                title=f"Paper {p}",
+                itemTypeID=22,
+            )
+        batch.append(
+            Attachment(
+                itemID=n_attachments + i,
+                itemKey=f"A{i:07d}",
+                contentType="application/pdf",
+                relpath=f"storage/A{i:07d}/paper_{i}.pdf",
+                title="Full Text PDF",
+                parentItem=parent,
+                fileSize=rng.randint(10**5, 10**7),
+                fileMtime=rng.randint(10**18, 2 * 10**18),
+                fileHash=f"{rng.getrandbits(256):064x}",
+            )
+        )
+        if len(batch) == 10000:
+            archive.put_many(batch)
+            batch = []
+    archive.put_many(batch)
+    return archive
+
+
+def measure(load):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    loaded = load()
+    seconds = time.perf_counter() - start
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return seconds, current, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--attachments", type=int, default=100000)
+    parser.add_argument("--per-parent", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        archive = build_archive(
+            Path(tmpdir) / "archive.sqlite", args.attachments, args.per_parent
+        )
+        rows = [data for (data,) in archive.db.execute("SELECT data FROM attachments")]
+        archive.close()
+
+    t_old, m_old, old = measure(
+        lambda: [LegacyAttachment.from_dict(json.loads(r)) for r in rows]
+    )
+    del old
+    parents = {}
+    t_new, m_new, new = measure(
+        lambda: [Attachment.from_dict(json.loads(r), parents) for r in rows]
+    )
+    assert [json.dumps(asdict(a)) for a in new[:10]] == rows[:10]
+
+    print(f"attachments={len(rows)} distinct parents={len(parents)}")
+    print(f"dataclasses        : {t_old * 1000:8.1f} ms {m_old / 1e6:8.1f} MB")
+    print(
+        f"slots + interning  : {t_new * 1000:8.1f} ms {m_new / 1e6:8.1f} MB"
+        f"  ({m_old / m_new:.1f}x less memory)"
+    )
+
+
+if __name__ == "__main__":
+    main()
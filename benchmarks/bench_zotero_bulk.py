@@ -0,0 +1,105 @@
+"""
+Compare the per-item ZoteroConn path with the bulk loader and the streaming iterator
+on a synthetic library, with time to the first attachment and peak Python memory.
+
+    python -m benchmarks.bench_zotero_bulk --items 8000
+"""
+
+import argparse
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from benchmarks.synthetic_zotero import build_zotero_db
+from src.handler.zotero_database import ZoteroConn
+
+
+def per_item_path(conn: ZoteroConn, tag_pattern: str):
+    attachments = []
+    for parent_item in conn.get_parent_items_with_special_tag(tag_pattern):
+        attachments.extend(conn.get_attachments_by_parent_item(parent_item))
+    return attachments
+
+
+def bulk_path(conn: ZoteroConn, tag_pattern: str):
+    attachments = []
+    for _, atts in conn.get_parent_items_with_attachments(tag_pattern):
+        attachments.extend(atts)
+    return attachments
+
+
+def stream_path(conn: ZoteroConn, tag_pattern: str):
+    return [a for batch in conn.iter_attachment_batches(tag_pattern) for a in batch]
+
+
+def first_batch(conn: ZoteroConn, tag_pattern: str):
+    return next(iter(conn.iter_attachment_batches(tag_pattern)))
+
+
+def peak_memory(func, *args) -> float:
+    """
+    Peak traced allocation in MB while func consumes its result without keeping it.
+    """
+    tracemalloc.start()
+    try:
+        result = func(*args)
+        if not isinstance(result, list):
+            for _ in result:
+                pass
+        return tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+
+
+def timed(func, *args, repeat: int = 3):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=8000)
+    parser.add_argument("--attachments", type=int, default=2)
+    parser.add_argument("--tagged-ratio", type=float, default=1.0)
+    parser.add_argument("--tag-pattern", default="#%/%")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        build_zotero_db(
+            Path(tmpdir) / "zotero.sqlite",
+            n_items=args.items,
+            tagged_ratio=args.tagged_ratio,
+            attachments_per_item=args.attachments,
+        )
+        conn = ZoteroConn(tmpdir)
+        t_items, legacy = timed(
+            per_item_path, conn, args.tag_pattern, repeat=args.repeat
+        )
+        t_bulk, bulk = timed(bulk_path, conn, args.tag_pattern, repeat=args.repeat)
+        t_stream, stream = timed(
+            stream_path, conn, args.tag_pattern, repeat=args.repeat
+        )
+        t_first, _ = timed(first_batch, conn, args.tag_pattern, repeat=args.repeat)
+        mem_bulk = peak_memory(bulk_path, conn, args.tag_pattern)
+        mem_stream = peak_memory(conn.iter_attachments, args.tag_pattern)
+        conn.db.close()
+
+    assert {a.itemKey for a in legacy} == {a.itemKey for a in bulk}
+    assert {a.itemKey for a in stream} == {a.itemKey for a in bulk}
+    print(f"parents={args.items} attachments={len(bulk)}")
+    print(f"per-item queries : {t_items * 1000:9.1f} ms")
+    print(f"bulk loader      : {t_bulk * 1000:9.1f} ms  ({t_items / t_bulk:.1f}x)")
+    print(
+        f"stream           : {t_stream * 1000:9.1f} ms, first batch {t_first * 1000:.1f} ms"
+    )
+    print(f"peak memory      : bulk {mem_bulk:.1f} MB, stream {mem_stream:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
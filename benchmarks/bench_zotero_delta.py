@@ -0,0 +1,84 @@
+"""
+Compare a full tagged-item load with the delta query on a synthetic library,
+for a no-op sync and for a handful of edited items. "unchanged file" is the fingerprint
+short-circuit, "no item changed" runs the delta queries on a touched database.
+
+    python -m benchmarks.bench_zotero_delta --items 50000
+"""
+
+import argparse
+import sqlite3
+import tempfile
+from pathlib import Path
+
+from benchmarks.bench_zotero_bulk import bulk_path, timed
+from benchmarks.synthetic_zotero import build_zotero_db
+from src.handler.zotero_database import ZoteroConn
+
+
+def delta_path(conn: ZoteroConn, since: dict, tag_pattern: str):
+    delta = conn.get_delta(since)
+    attachments = []
+    if delta.parents:
+        for _, atts in conn.get_parent_items_with_attachments(
+            tag_pattern, parent_ids=delta.parents
+        ):
+            attachments.extend(atts)
+    return attachments
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=50000)
+    parser.add_argument("--attachments", type=int, default=2)
+    parser.add_argument("--tagged-ratio", type=float, default=0.5)
+    parser.add_argument("--edited", type=int, default=10)
+    parser.add_argument("--tag-pattern", default="#%/%")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = build_zotero_db(
+            Path(tmpdir) / "zotero.sqlite",
+            n_items=args.items,
+            tagged_ratio=args.tagged_ratio,
+            attachments_per_item=args.attachments,
+        )
+        live = sqlite3.connect(path)
+        # one edit per second, as in a library built up over time
+        live.execute(
+            "UPDATE items SET clientDateModified = "
+            "datetime('2020-01-01', '+' || itemID || ' seconds')"
+        )
+        live.commit()
+        conn = ZoteroConn(tmpdir)
+        since = conn.get_high_water_mark()
+        t_full, full = timed(bulk_path, conn, args.tag_pattern, repeat=args.repeat)
+        t_noop, _ = timed(delta_path, conn, since, args.tag_pattern, repeat=args.repeat)
+        touched = dict(since, fingerprint=None)
+        t_scan, _ = timed(
+            delta_path, conn, touched, args.tag_pattern, repeat=args.repeat
+        )
+
+        live.execute(
+            "UPDATE items SET clientDateModified = '2026-01-01 00:00:00' "
+            "WHERE itemID IN (SELECT itemID FROM items ORDER BY random() LIMIT ?)",
+            (args.edited,),
+        )
+        live.commit()
+        live.close()
+        conn.refresh()
+        t_delta, _ = timed(
+            delta_path, conn, since, args.tag_pattern, repeat=args.repeat
+        )
+        conn.db.close()
+
+    print(f"parents={args.items} tagged attachments={len(full)}")
+    print(f"full load              : {t_full * 1000:9.3f} ms")
+    print(f"delta, unchanged file  : {t_noop * 1000:9.3f} ms")
+    print(f"delta, no item changed : {t_scan * 1000:9.3f} ms  ({t_full / t_scan:.1f}x)")
+    print(f"delta, {args.edited:3d} items edited: {t_delta * 1000:9.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Minimal pytest-benchmark style fixture for the benchmark suite, run apart from the tests:
+
+    python -m pytest benchmarks --scales 1k,10k          # compare with baseline.json
+    python -m pytest benchmarks --bench-save             # record a new baseline
+
+`benchmark(func, *args)` calls func `--bench-rounds` times and keeps the fastest run.
+A test fails when that time is above its baseline by more than `--bench-tolerance`.
+Baselines are machine specific, record them on the machine that runs the comparison.
+"""
+
+import json
+import time
+from pathlib import Path
+
+import pytest
+
+BASELINE = Path(__file__).with_name("baseline.json")
+# below this many milliseconds timer noise dominates, no regression is reported
+MIN_MS = 1.0
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("benchmark")
+    group.addoption(
+        "--scales", default="1k,10k", help="comma separated, of 1k,10k,100k"
+    )
+    group.addoption("--bench-rounds", type=int, default=3)
+    group.addoption(
+        "--bench-tolerance",
+        type=float,
+        default=0.5,
+        help="allowed slowdown over the baseline, 0.5 for 50%%",
+    )
+    group.addoption("--bench-save", action="store_true", help="rewrite baseline.json")
+
+
+def pytest_generate_tests(metafunc):
+    if "scale" in metafunc.fixturenames:
+        scales = metafunc.config.getoption("scales").split(",")
+        metafunc.parametrize("scale", scales, scope="session")
+
+
+@pytest.fixture(scope="session")
+def results(request):
+    results = {}
+    yield results
+    if request.config.getoption("bench_save") and results:
+        baseline = json.loads(BASELINE.read_text()) if BASELINE.exists() else {}
+        baseline.update(results)
+        BASELINE.write_text(json.dumps(baseline, indent=2, sort_keys=True) + "\n")
+
+
+class Benchmark:
+    def __init__(self, name: str, rounds: int, baseline, tolerance: float, results):
+        self.name = name
+        self.rounds = rounds
+        self.baseline = baseline
+        self.tolerance = tolerance
+        self.results = results
+
+    def __call__(self, func, *args, **kwargs):
+        best, result = float("inf"), None
+        for _ in range(self.rounds):
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            best = min(best, time.perf_counter() - start)
+        ms = round(best * 1000, 3)
+        self.results[self.name] = ms
+        print(f"\n{self.name}: {ms:.3f} ms (baseline {self.baseline} ms)")
+        if self.baseline is not None and ms > MIN_MS:
+            limit = self.baseline * (1 + self.tolerance)
+            assert ms <= limit, (
+                f"{self.name} regressed: {ms:.1f} ms, baseline {self.baseline:.1f} ms, "
+                f"limit {limit:.1f} ms"
+            )
+        return result
+
+
+@pytest.fixture
+def benchmark(request, results):
+    baseline = json.loads(BASELINE.read_text()) if BASELINE.exists() else {}
+    name = request.node.name
+    return Benchmark(
+        name,
+        request.config.getoption("bench_rounds"),
+        None if request.config.getoption("bench_save") else baseline.get(name),
+        request.config.getoption("bench_tolerance"),
+        results,
+    )
@@ -0,0 +1,388 @@
+"""
+Local stand-in for the Dify knowledge base API, covering the endpoints DifyKnowledgeBase
+and AsyncDifyKnowledgeBase call, with per-endpoint latency, 429 / 5xx injection and an
+indexing delay, so syncs can be load-tested without a Dify instance.
+
+    with DifyEmulator(EmulatorConfig(latency={"create_by_file": 0.05})) as dify:
+        dify.add_dataset("Zotero")
+        kb = DifyKnowledgeBase("Zotero", KBConfig(api_key="", base_url=dify.base_url))
+
+    python -m benchmarks.dify_emulator --port 5001 --latency 0.02
+"""
+
+import argparse
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+# (method, path pattern under the base url, endpoint name used for latency and stats)
+ROUTES = [
+    ("GET", r"/datasets", "list_datasets"),
+    ("GET", r"/datasets/(?P<dataset>[^/]+)", "get_dataset"),
+    ("GET", r"/datasets/(?P<dataset>[^/]+)/documents", "list_documents"),
+    ("GET", r"/datasets/(?P<dataset>[^/]+)/metadata", "list_metadata"),
+    ("POST", r"/datasets/(?P<dataset>[^/]+)/metadata", "create_metadata"),
+    ("POST", r"/datasets/(?P<dataset>[^/]+)/document/create-by-file", "create_by_file"),
+    ("POST", r"/datasets/(?P<dataset>[^/]+)/document/create-by-text", "create_by_text"),
+    (
+        "POST",
+        r"/datasets/(?P<dataset>[^/]+)/documents/(?P<document>[^/]+)/update-by-file",
+        "update_by_file",
+    ),
+    (
+        "POST",
+        r"/datasets/(?P<dataset>[^/]+)/documents/(?P<document>[^/]+)/update-by-text",
+        "update_by_text",
+    ),
+    ("POST", r"/datasets/(?P<dataset>[^/]+)/documents/metadata", "update_metadata"),
+    (
+        "DELETE",
+        r"/datasets/(?P<dataset>[^/]+)/documents/(?P<document>[^/]+)",
+        "delete_document",
+    ),
+]
+COMPILED = [(m, re.compile(p + "$"), name) for m, p, name in ROUTES]
+
+
+class EmulatorError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+@dataclass
+class EmulatorConfig:
+    api_key: str = ""  # required Bearer token, empty accepts any
+    default_latency: float = 0.0  # seconds added to every request
+    latency: Dict[str, float] = field(default_factory=dict)  # per endpoint name
+    # share of requests answered 429 (with Retry-After) / 503 instead of being handled
+    rate_limit_ratio: float = 0.0
+    error_ratio: float = 0.0
+    retry_after: int = 0  # seconds, Retry-After is a whole number
+    # seconds a created or updated document reports indexing_status "indexing"
+    indexing_delay: float = 0.0
+    seed: int = 0
+
+
+@dataclass
+class EmulatorStats:
+    requests: Dict[str, int] = field(default_factory=dict)  # per endpoint name
+    statuses: Dict[int, int] = field(default_factory=dict)
+    durations: List[float] = field(default_factory=list)  # seconds, server side
+
+    @property
+    def total(self) -> int:
+        return sum(self.requests.values())
+
+    def percentile(self, q: float) -> float:
+        return float(np.percentile(self.durations, q)) if self.durations else 0.0
+
+
+class DifyEmulator:
+    """
+    In-memory datasets, documents and metadata served on a ThreadingHTTPServer.
+    Documents are listed in creation order, newest last, and carry their metadata values
+    as doc_metadata like Dify does.
+    """
+
+    def __init__(self, config: Optional[EmulatorConfig] = None, port: int = 0):
+        self.config = config or EmulatorConfig()
+        self.stats = EmulatorStats()
+        self.datasets: Dict[str, dict] = {}  # id -> {"name", "documents", "metadata"}
+        self.lock = threading.Lock()
+        self.rng = random.Random(self.config.seed)
+        self._ids = itertools.count(1)
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self.handler_class())
+        self.server.daemon_threads = True
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def add_dataset(self, name: str) -> str:
+        dataset_id = str(uuid.uuid4())
+        with self.lock:
+            self.datasets[dataset_id] = {"name": name, "documents": {}, "metadata": {}}
+        return dataset_id
+
+    def documents(self, dataset_id: str) -> List[dict]:
+        with self.lock:
+            return [dict(d) for d in self.datasets[dataset_id]["documents"].values()]
+
+    def handler_class(self):
+        emulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, as the client pools connections
+            # headers and body are separate writes: with Nagle on, the body waits for
+            # the client's delayed ACK of the headers, ~40 ms on every request
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                emulator.handle(self, "GET")
+
+            def do_POST(self):
+                emulator.handle(self, "POST")
+
+            def do_DELETE(self):
+                emulator.handle(self, "DELETE")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def handle(self, request: BaseHTTPRequestHandler, method: str):
+        start = time.perf_counter()
+        url = urlsplit(request.path)
+        # anything before /datasets is the API prefix, e.g. /v1
+        path = url.path[url.path.find("/datasets") :].rstrip("/")
+        body = request.rfile.read(int(request.headers.get("Content-Length") or 0))
+        name, params = next(
+            (
+                (n, m.groupdict())
+                for mt, p, n in COMPILED
+                if mt == method and (m := p.match(path))
+            ),
+            ("unknown", None),
+        )
+        delay = self.config.latency.get(name, self.config.default_latency)
+        if delay:
+            time.sleep(delay)
+        headers = {}
+        with self.lock:
+            fault = self.rng.random()
+        try:
+            if params is None:
+                raise EmulatorError(404, f"no route for {method} {path}")
+            auth = request.headers.get("Authorization", "")
+            if self.config.api_key and auth != f"Bearer {self.config.api_key}":
+                raise EmulatorError(401, "invalid api key")
+            if fault < self.config.rate_limit_ratio:
+                headers["Retry-After"] = str(self.config.retry_after)
+                raise EmulatorError(429, "rate limited")
+            if fault < self.config.rate_limit_ratio + self.config.error_ratio:
+                raise EmulatorError(503, "service unavailable")
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            status, payload = (
+                200,
+                getattr(self, name)(body, request.headers, query, **params),
+            )
+        except EmulatorError as e:
+            status, payload = e.status, {"code": "error", "message": str(e)}
+        data = json.dumps(payload, ensure_ascii=False).encode()
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(data)))
+        for key, value in headers.items():
+            request.send_header(key, value)
+        request.end_headers()
+        request.wfile.write(data)
+        with self.lock:
+            self.stats.requests[name] = self.stats.requests.get(name, 0) + 1
+            self.stats.statuses[status] = self.stats.statuses.get(status, 0) + 1
+            self.stats.durations.append(time.perf_counter() - start)
+
+    # endpoints, called with the lock released; they take it around state changes
+
+    def dataset(self, dataset_id: str) -> dict:
+        if dataset_id not in self.datasets:
+            raise EmulatorError(404, f"dataset {dataset_id} not found")
+        return self.datasets[dataset_id]
+
+    def list_datasets(self, body, headers, query):
+        with self.lock:
+            data = [{"id": k, "name": v["name"]} for k, v in self.datasets.items()]
+        return {"data": data, "has_more": False, "total": len(data), "page": 1}
+
+    def get_dataset(self, body, headers, query, dataset):
+        with self.lock:
+            ds = self.dataset(dataset)
+            return {
+                "id": dataset,
+                "name": ds["name"],
+                "document_count": len(ds["documents"]),
+            }
+
+    def list_documents(self, body, headers, query, dataset):
+        page, limit = int(query.get("page", 1)), int(query.get("limit", 20))
+        now = time.monotonic()
+        with self.lock:
+            documents = list(self.dataset(dataset)["documents"].values())
+        data = [
+            dict(
+                d, indexing_status="indexing" if d["indexed_at"] > now else "completed"
+            )
+            for d in documents[(page - 1) * limit : page * limit]
+        ]
+        for d in data:
+            del d["indexed_at"]
+        return {
+            "data": data,
+            "has_more": page * limit < len(documents),
+            "limit": limit,
+            "total": len(documents),
+            "page": page,
+        }
+
+    def list_metadata(self, body, headers, query, dataset):
+        with self.lock:
+            fields = list(self.dataset(dataset)["metadata"].values())
+        return {"doc_metadata": fields, "built_in_field_enabled": False}
+
+    def create_metadata(self, body, headers, query, dataset):
+        field_ = json.loads(body)
+        with self.lock:
+            metadata = self.dataset(dataset)["metadata"]
+            if any(f["name"] == field_["name"] for f in metadata.values()):
+                raise EmulatorError(400, f"metadata {field_['name']} exists")
+            metadata_id = str(uuid.uuid4())
+            metadata[metadata_id] = {
+                "id": metadata_id,
+                "name": field_["name"],
+                "type": field_["type"],
+            }
+            return metadata[metadata_id]
+
+    def read_form(self, body: bytes, headers) -> dict:
+        # multipart/form-data: "data" (JSON settings) and "file"
+        message = BytesParser(policy=HTTP).parsebytes(
+            b"Content-Type: " + headers["Content-Type"].encode() + b"\r\n\r\n" + body
+        )
+        if not message.is_multipart():
+            raise EmulatorError(400, "expected multipart/form-data")
+        form = {}
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            form[name] = part.get_content()
+            if name == "file":
+                form["filename"] = part.get_filename()
+        if "file" not in form:
+            raise EmulatorError(400, "no file")
+        return form
+
+    def store_document(self, dataset: str, name: str, size: int, document=None) -> dict:
+        with self.lock:
+            documents = self.dataset(dataset)["documents"]
+            if document is not None and document not in documents:
+                raise EmulatorError(404, f"document {document} not found")
+            doc = documents.get(document) or {
+                "id": str(uuid.uuid4()),
+                "position": next(self._ids),
+                "doc_metadata": [],
+            }
+            doc.update(
+                name=name,
+                size=size,
+                indexed_at=time.monotonic() + self.config.indexing_delay,
+            )
+            documents[doc["id"]] = doc
+            created = {k: v for k, v in doc.items() if k != "indexed_at"}
+        return {
+            "document": dict(created, indexing_status="waiting"),
+            "batch": doc["id"],
+        }
+
+    def create_by_file(self, body, headers, query, dataset):
+        form = self.read_form(body, headers)
+        return self.store_document(dataset, form["filename"], len(form["file"]))
+
+    def create_by_text(self, body, headers, query, dataset):
+        data = json.loads(body)
+        return self.store_document(dataset, data["name"], len(data.get("text") or ""))
+
+    def update_by_file(self, body, headers, query, dataset, document):
+        form = self.read_form(body, headers)
+        return self.store_document(
+            dataset, form["filename"], len(form["file"]), document
+        )
+
+    def update_by_text(self, body, headers, query, dataset, document):
+        data = json.loads(body)
+        return self.store_document(
+            dataset, data["name"], len(data.get("text") or ""), document
+        )
+
+    def update_metadata(self, body, headers, query, dataset):
+        operations = json.loads(body)["operation_data"]
+        with self.lock:
+            ds = self.dataset(dataset)
+            # validated first: a bad operation rejects the whole request, as in Dify
+            for op in operations:
+                if op["document_id"] not in ds["documents"]:
+                    raise EmulatorError(400, f"document {op['document_id']} not found")
+                for value in op["metadata_list"]:
+                    if value["id"] not in ds["metadata"]:
+                        raise EmulatorError(400, f"metadata {value['id']} not found")
+            for op in operations:
+                ds["documents"][op["document_id"]]["doc_metadata"] = [
+                    dict(ds["metadata"][v["id"]], value=v["value"])
+                    for v in op["metadata_list"]
+                ]
+        return {"result": "success"}
+
+    def delete_document(self, body, headers, query, dataset, document):
+        with self.lock:
+            documents = self.dataset(dataset)["documents"]
+            if documents.pop(document, None) is None:
+                raise EmulatorError(404, f"document {document} not found")
+        return {"result": "success"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--dataset", default="Zotero")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0)
+    parser.add_argument("--error-ratio", type=float, default=0.0)
+    parser.add_argument("--indexing-delay", type=float, default=0.0)
+    args = parser.parse_args()
+
+    emulator = DifyEmulator(
+        EmulatorConfig(
+            default_latency=args.latency,
+            rate_limit_ratio=args.rate_limit_ratio,
+            error_ratio=args.error_ratio,
+            indexing_delay=args.indexing_delay,
+        ),
+        port=args.port,
+    )
+    emulator.add_dataset(args.dataset)
+    print(f"Dify emulator on {emulator.base_url}, dataset {args.dataset}")
+    try:
+        emulator.server.serve_forever()
+    except KeyboardInterrupt:
+        emulator.server.server_close()
+
+
+if __name__ == "__main__":
+    main()
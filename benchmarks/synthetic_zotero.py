@@ -0,0 +1,246 @@
+"""
+Build a synthetic zotero.sqlite with the subset of the Zotero schema that ZoteroConn reads.
+Table and index definitions follow Zotero's own schema.sql so query plans match a real library.
+Optionally writes dummy attachment files under storage/<key>/ next to the database.
+
+    python -m benchmarks.synthetic_zotero /tmp/zotero --scale 10k --storage-files
+"""
+
+import argparse
+import random
+import sqlite3
+import string
+from pathlib import Path
+from typing import Tuple, Union
+
+# itemTypeID used by the handler: annotation = 1, attachment = 3, anything else is a regular item
+ITEM_TYPE_ANNOTATION = 1
+ITEM_TYPE_ATTACHMENT = 3
+ITEM_TYPE_ARTICLE = 22
+FIELD_TITLE = 1
+
+# library sizes of the benchmark suite, in parent items
+SCALES = {"1k": 1_000, "10k": 10_000, "100k": 100_000}
+
+SCHEMA = """
+CREATE TABLE items (
+    itemID INTEGER PRIMARY KEY,
+    itemTypeID INT NOT NULL,
+    dateAdded TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    dateModified TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    clientDateModified TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    libraryID INT NOT NULL,
+    key TEXT NOT NULL,
+    version INT NOT NULL DEFAULT 0,
+    synced INT NOT NULL DEFAULT 0,
+    UNIQUE (libraryID, key)
+);
+CREATE INDEX items_synced ON items(synced);
+CREATE TABLE itemDataValues (
+    valueID INTEGER PRIMARY KEY,
+    value UNIQUE
+);
+CREATE TABLE itemData (
+    itemID INT,
+    fieldID INT,
+    valueID,
+    PRIMARY KEY (itemID, fieldID)
+);
+CREATE INDEX itemData_fieldID ON itemData(fieldID);
+CREATE TABLE tags (
+    tagID INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE itemTags (
+    itemID INT NOT NULL,
+    tagID INT NOT NULL,
+    type INT NOT NULL,
+    PRIMARY KEY (itemID, tagID)
+);
+CREATE INDEX itemTags_tagID ON itemTags(tagID);
+CREATE TABLE itemAttachments (
+    itemID INTEGER PRIMARY KEY,
+    parentItemID INT,
+    linkMode INT,
+    contentType TEXT,
+    charsetID INT,
+    path TEXT,
+    syncState INT DEFAULT 0,
+    storageModTime INT,
+    storageHash TEXT,
+    lastProcessedModificationTime INT
+);
+CREATE INDEX itemAttachmentParentItemID ON itemAttachments(parentItemID);
+CREATE INDEX itemAttachmentContentType ON itemAttachments(contentType);
+CREATE TABLE deletedItems (
+    itemID INTEGER PRIMARY KEY,
+    dateDeleted DEFAULT CURRENT_TIMESTAMP NOT NULL
+);
+CREATE INDEX deletedItems_dateDeleted ON deletedItems(dateDeleted);
+CREATE TABLE syncDeleteLog (
+    syncObjectTypeID INT NOT NULL,
+    libraryID INT NOT NULL,
+    key TEXT NOT NULL,
+    dateDeleted TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (syncObjectTypeID, libraryID, key)
+);
+"""
+
+
+def random_key(rng: random.Random) -> str:
+    return "".join(rng.choices(string.ascii_uppercase + string.digits, k=8))
+
+
+def build_zotero_db(
+    path,
+    n_items: int = 1000,
+    tagged_ratio: float = 0.5,
+    attachments_per_item: Union[int, Tuple[int, int]] = 2,
+    tags: tuple = ("#read/todo", "#read/done", "#topic/llm", "#topic/gis"),
+    other_tags: tuple = ("review", "method", "data"),
+    tag_skew: float = 0.0,
+    deleted_ratio: float = 0.0,
+    storage_files: bool = False,
+    file_size: int = 1024,
+    seed: int = 0,
+) -> Path:
+    """
+    Write a synthetic Zotero database to path and return it.
+    :param n_items: number of regular (parent) items
+    :param tagged_ratio: share of parent items carrying at least one of `tags`
+    :param attachments_per_item: number of PDF attachments per parent item, or a
+        (min, max) range drawn uniformly per item
+    :param tag_skew: Zipf exponent of tag popularity, the first tags are the most used;
+        0 draws tags uniformly
+    :param deleted_ratio: share of parent items moved to the trash (deletedItems)
+    :param storage_files: also write a file of file_size bytes per attachment under
+        storage/<key>/ next to the database, as in a Zotero data directory
+    """
+    path = Path(path)
+    if path.exists():
+        path.unlink()
+    rng = random.Random(seed)
+    low, high = (
+        attachments_per_item
+        if isinstance(attachments_per_item, tuple)
+        else (attachments_per_item, attachments_per_item)
+    )
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+
+    all_tags = list(tags) + list(other_tags)
+    conn.executemany(
+        "INSERT INTO tags (tagID, name) VALUES (?, ?)",
+        [(i + 1, name) for i, name in enumerate(all_tags)],
+    )
+    special_ids = list(range(1, len(tags) + 1))
+    other_ids = list(range(len(tags) + 1, len(all_tags) + 1))
+
+    def draw_tags(tag_ids, k):
+        # k distinct tags, weighted by 1 / rank ** tag_skew
+        weights = [1 / (rank + 1) ** tag_skew for rank in range(len(tag_ids))]
+        drawn = set()
+        while len(drawn) < k:
+            drawn.add(rng.choices(tag_ids, weights)[0])
+        return drawn
+
+    items, item_data, item_tags, attachments, deleted = [], [], [], [], []
+    values = {}  # value -> valueID, itemDataValues stores each distinct value once
+    keys = set()
+    item_id = 0
+
+    def new_key():
+        while True:
+            key = random_key(rng)
+            if key not in keys:
+                keys.add(key)
+                return key
+
+    def add_title(itemID, title):
+        value_id = values.setdefault(title, len(values) + 1)
+        item_data.append((itemID, FIELD_TITLE, value_id))
+
+    for n in range(n_items):
+        item_id += 1
+        parent_id = item_id
+        items.append((parent_id, ITEM_TYPE_ARTICLE, 1, new_key()))
+        add_title(parent_id, f"Paper {n}")
+        if rng.random() < tagged_ratio:
+            for tag_id in draw_tags(special_ids, rng.randint(1, len(special_ids))):
+                item_tags.append((parent_id, tag_id, 0))
+        for tag_id in draw_tags(other_ids, rng.randint(0, len(other_ids))):
+            item_tags.append((parent_id, tag_id, 0))
+        if rng.random() < deleted_ratio:
+            deleted.append((parent_id,))
+        for m in range(rng.randint(low, high)):
+            item_id += 1
+            key = new_key()
+            items.append((item_id, ITEM_TYPE_ATTACHMENT, 1, key))
+            add_title(item_id, f"Full Text PDF {m}")
+            name = f"paper_{n}_{m}.pdf"
+            attachments.append(
+                (item_id, parent_id, 0, "application/pdf", f"storage:{name}")
+            )
+            if storage_files:
+                storage = path.parent / "storage" / key
+                storage.mkdir(parents=True, exist_ok=True)
+                (storage / name).write_bytes(rng.randbytes(file_size))
+
+    conn.executemany(
+        "INSERT INTO items (itemID, itemTypeID, libraryID, key) VALUES (?, ?, ?, ?)",
+        items,
+    )
+    conn.executemany(
+        "INSERT INTO itemDataValues (valueID, value) VALUES (?, ?)",
+        [(value_id, value) for value, value_id in values.items()],
+    )
+    conn.executemany(
+        "INSERT INTO itemData (itemID, fieldID, valueID) VALUES (?, ?, ?)", item_data
+    )
+    conn.executemany(
+        "INSERT INTO itemTags (itemID, tagID, type) VALUES (?, ?, ?)", item_tags
+    )
+    conn.executemany(
+        "INSERT INTO itemAttachments (itemID, parentItemID, linkMode, contentType, path) "
+        "VALUES (?, ?, ?, ?, ?)",
+        attachments,
+    )
+    conn.executemany("INSERT INTO deletedItems (itemID) VALUES (?)", deleted)
+    conn.commit()
+    conn.close()
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("zotero_dir", help="directory of the zotero.sqlite to write")
+    parser.add_argument("--scale", choices=SCALES, default="1k")
+    parser.add_argument("--tagged-ratio", type=float, default=0.5)
+    parser.add_argument("--attachments", type=int, nargs="+", default=[2])
+    parser.add_argument("--tag-skew", type=float, default=0.0)
+    parser.add_argument("--deleted-ratio", type=float, default=0.0)
+    parser.add_argument("--storage-files", action="store_true")
+    parser.add_argument("--file-size", type=int, default=1024)
+    args = parser.parse_args()
+
+    zotero_dir = Path(args.zotero_dir)
+    zotero_dir.mkdir(parents=True, exist_ok=True)
+    path = build_zotero_db(
+        zotero_dir / "zotero.sqlite",
+        n_items=SCALES[args.scale],
+        tagged_ratio=args.tagged_ratio,
+        attachments_per_item=(
+            tuple(args.attachments)
+            if len(args.attachments) > 1
+            else args.attachments[0]
+        ),
+        tag_skew=args.tag_skew,
+        deleted_ratio=args.deleted_ratio,
+        storage_files=args.storage_files,
+        file_size=args.file_size,
+    )
+    print(f"Wrote {path} ({path.stat().st_size / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
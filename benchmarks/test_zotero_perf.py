@@ -0,0 +1,83 @@
+"""
+ZoteroConn and diff timings on synthetic libraries of 1k / 10k / 100k parent items,
+see conftest.py for options and baseline.json for the recorded times.
+"""
+
+import random
+from dataclasses import replace
+
+import pytest
+
+from benchmarks.synthetic_zotero import SCALES, build_zotero_db
+from src.handler.zotero_database import ZoteroConn
+from src.pipeline.zdb2dify import Pipeline
+
+TAG_PATTERN = "#%/%"
+
+
+@pytest.fixture(scope="session")
+def library(scale, tmp_path_factory):
+    zotero_dir = tmp_path_factory.mktemp(f"zotero-{scale}")
+    build_zotero_db(
+        zotero_dir / "zotero.sqlite",
+        n_items=SCALES[scale],
+        tagged_ratio=0.5,
+        attachments_per_item=(1, 3),
+        tag_skew=1.0,
+        deleted_ratio=0.02,
+    )
+    return zotero_dir
+
+
+@pytest.fixture(scope="session")
+def conn(library):
+    conn = ZoteroConn(str(library))
+    yield conn
+    conn.db.close()
+
+
+@pytest.fixture(scope="session")
+def attachments(conn):
+    return {a.itemKey: a for a in conn.iter_attachments(TAG_PATTERN)}
+
+
+def test_get_parent_items_with_special_tag(benchmark, conn):
+    parents = benchmark(conn.get_parent_items_with_special_tag, TAG_PATTERN)
+    assert parents
+
+
+def test_get_attachments_by_parent_item(benchmark, conn):
+    parents = conn.get_parent_items_with_special_tag(TAG_PATTERN)
+
+    def all_attachments():
+        return [a for p in parents for a in conn.get_attachments_by_parent_item(p)]
+
+    assert benchmark(all_attachments)
+
+
+def test_snapshot_backup(benchmark, conn):
+    benchmark(conn.backup_db)
+
+
+def test_snapshot_unchanged(benchmark, conn):
+    # the fingerprint check that skips the backup of an unchanged library
+    conn.copy_db()
+    benchmark(conn.copy_db)
+
+
+def test_diff_attachments(benchmark, attachments):
+    rng = random.Random(0)
+    keys = list(attachments)
+    archived = dict(attachments)
+    for key in rng.sample(keys, len(keys) // 10):
+        att = archived.pop(key)  # new in Zotero: upload
+        if rng.random() < 0.5:
+            archived[key] = replace(att, parentItem=replace(att.parentItem, tags=()))
+    archived.update(
+        (f"GONE{i:04d}", replace(attachments[keys[0]], itemKey=f"GONE{i:04d}"))
+        for i in range(len(keys) // 20)
+    )
+    to_upload, to_update, to_delete, _ = benchmark(
+        Pipeline.diff_attachments, attachments, archived
+    )
+    assert to_upload and to_update and to_delete
@@ -1,13 +1,117 @@
-from src.pipeline.zdb2dify import Pipeline
-from src.config import CONFIG
+import argparse
 
-def run_zdb2dify():
-    pipeline = Pipeline(
-        kb_name=CONFIG["dify"]["knowledge_base"]["dataset_name"],
-        tag_pattern="#%/%",  # sql regex matching zotero tags like #read/todo
+from src.pipeline.watch import ZoteroWatcher
+from src.pipeline.zdb2dify import Pipeline, PipeConfig
+from src.config import get_setting
+from src.utils.profiling import MODES, Profiler
+
+
+def run_zdb2dify(
+    resume: bool = False,
+    watch: bool = False,
+    full: bool = False,
+    profile: str = None,
+    profile_memory: bool = False,
+):
+    # the snapshot and the Dify lookups of Pipeline() are part of the profile
+    with Profiler("zdb2dify", mode=profile, memory=profile_memory) as profiler:
+        pipeline = Pipeline(
+            PipeConfig(
+                kb_name=get_setting("dify.knowledge_base.dataset_name"),
+                tag_pattern="#%/%",  # sql regex matching zotero tags like #read/todo
+            )
+        )
+        profiler.trace_allocations(pipeline)
+        try:
+            if resume:
+                pipeline.resume_sync()
+            elif watch:
+                try:
+                    ZoteroWatcher(pipeline).run()
+                except KeyboardInterrupt:
+                    pass
+            elif full:
+                pipeline.sync_zotero_attachments()
+            else:
+                pipeline.sync_modified_attachments()
+        finally:
+            pipeline.close()
+
+
+def backfill_local_index():
+    from src.handler.local_index import LocalIndex
+
+    config = PipeConfig(
+        kb_name=get_setting("dify.knowledge_base.dataset_name"), local_index=True
     )
-    pipeline.sync_zotero_attachments()
+    # the pipeline backfills an index not marked as backfilled when it opens it
+    index = LocalIndex(config.local_index_path)
+    index.mark_backfilled(False)
+    index.close()
+    Pipeline(config).close()
+
+
+def search_local_index(query: str, k: int = 10):
+    from src.handler.local_index import LocalIndex
+
+    index = LocalIndex(PipeConfig().local_index_path)
+    for hit in index.search(query, k):
+        print(f"{hit.itemKey}\t{hit.score:.4f}\t{hit.text[:120]!r}")
+    index.close()
 
 
 if __name__ == "__main__":
-    run_zdb2dify()
+    parser = argparse.ArgumentParser(
+        description="Sync tagged Zotero attachments to Dify"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="replay the pending actions of an interrupted sync instead of a sync",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep running and sync the items modified in Zotero, see [zotero.watch]",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="rescan every tagged item instead of the changes since the last sync",
+    )
+    parser.add_argument(
+        "--search",
+        metavar="QUERY",
+        help="search the local index of synced texts offline instead of a sync",
+    )
+    parser.add_argument(
+        "--backfill-index",
+        action="store_true",
+        help="add the synced attachments missing from the local index, from the extraction cache",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="sample",
+        choices=MODES,
+        help="profile the sync, sample (default, flamegraph-ready stacks of all threads) "
+        "or cprofile, reports are written to logs/profile",
+    )
+    parser.add_argument(
+        "--profile-memory",
+        action="store_true",
+        help="trace the allocations of loading, diffing and applying the sync with tracemalloc",
+    )
+    args = parser.parse_args()
+    if args.search:
+        search_local_index(args.search)
+    elif args.backfill_index:
+        backfill_local_index()
+    else:
+        run_zdb2dify(
+            resume=args.resume,
+            watch=args.watch,
+            full=args.full,
+            profile=args.profile,
+            profile_memory=args.profile_memory,
+        )
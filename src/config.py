@@ -6,10 +6,13 @@
 @File    : const.py
 """
 
+import functools
 import glob
 import os
 import tomllib
+from dataclasses import field
 from pathlib import Path
+from typing import Any
 
 from loguru import logger
 
@@ -17,30 +20,86 @@ from loguru import logger
 CONFIG_DIR = "./config"
 # Environment variable to control which config to load
 ENV = os.getenv("ENV", "dev")
+# lazily resolved module attributes, see __getattr__: name -> directory under ROOT
+PROJECT_PATHS = {
+    "ROOT": "",
+    "PATH_DATA": "data",
+    "PATH_NOOTBOOKS": "notebooks",
+    "PATH_LOG": "logs",
+}
+
+
+def merge_config(base: dict, override: dict) -> dict:
+    """
+    Tables are merged key by key, any other value of override replaces the base one.
+    """
+    merged = dict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_config(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
 
 
 def load_config(env: str = ENV):
     """
     Load configuration from the config directory.
+    Base files (config.toml) are read first, then the overrides of the environment
+    (config.<env>.toml) are merged over them table by table.
     :param env: str, the environment to load the config for
     :return: dict, the loaded configuration
     """
     # 首先加载基础配置
     final_config = {}
-    for file in glob.glob(os.path.join(CONFIG_DIR, "*.toml")):
+    files = sorted(glob.glob(os.path.join(CONFIG_DIR, "*.toml")))
+    base = [f for f in files if "." not in Path(f).stem]
+    overrides = [f for f in files if Path(f).stem.endswith(f".{env}")]
+    for file in base + overrides:
         with open(file, "rb") as f:
             config = tomllib.load(f)
-        final_config.update(config)
+        final_config = merge_config(final_config, config)
     return final_config
 
 
-try:
-    CONFIG = load_config(ENV)
-except (TypeError, ValueError) as e:
-    logger.error(f"Error loading configuration: {e}")
-    raise e
+@functools.cache
+def get_config(env: str = ENV) -> dict:
+    """
+    The configuration, loaded on first use and then shared.
+    """
+    try:
+        return load_config(env)
+    except (TypeError, ValueError) as e:
+        logger.error(f"Error loading configuration: {e}")
+        raise e
+
+
+def get_setting(path: str, default: Any = None) -> Any:
+    """
+    Value at a dotted path of the configuration, e.g. "dify.http.pool_size", or
+    default when a table or the key is missing.
+    """
+    value = get_config()
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return default
+        value = value[key]
+    return value
 
 
+def setting(path: str, default: Any = None):
+    """
+    Dataclass field whose default is read from the configuration when an instance is
+    created, not when the class is defined. A callable default is called then too.
+    """
+    return field(
+        default_factory=lambda: get_setting(
+            path, default() if callable(default) else default
+        )
+    )
+
+
+@functools.cache
 def get_project_root():
     """Search upwards to find the project root directory."""
     current_path = Path.cwd()
@@ -65,15 +124,26 @@ def get_logger():
     return logger
 
 
-ROOT = get_project_root()
-PATH_DATA = ROOT / "data"
-PATH_NOOTBOOKS = ROOT / "notebooks"
-PATH_LOG = ROOT / "logs"
+def project_path(name: str) -> Path:
+    """
+    ROOT or one of the PATH_* directories, e.g. project_path("PATH_DATA").
+    """
+    return get_project_root() / PROJECT_PATHS[name]
+
+
+def __getattr__(name: str):
+    # CONFIG, ROOT and PATH_* are resolved on first access instead of at import
+    if name == "CONFIG":
+        return get_config()
+    if name in PROJECT_PATHS:
+        return project_path(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 if __name__ == "__main__":
-    print(CONFIG)
+    print(get_config())
 
     # print(os.environ["PYTHONPATH"])
     # print(os.environ["PATH"])
-    print(ROOT)
+    print(get_project_root())
     # print(os.environ["ENV_PARM"])  # params in .env file
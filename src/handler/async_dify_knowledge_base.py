@@ -0,0 +1,346 @@
+import asyncio
+import json
+import os
+import random
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+from src.config import get_logger
+from src.handler.dify_knowledge_base import (
+    SAFE_POST_RETRY_STATUSES,
+    DifyAPIError,
+    Document,
+    KBConfig,
+    is_idempotent,
+)
+from src.utils.metrics import METRICS
+
+if TYPE_CHECKING:
+    import aiohttp
+
+logger = get_logger()
+
+
+class AsyncRateLimiter:
+    """
+    Spaces request starts at least 1 / rate seconds apart. rate <= 0 disables the limit.
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class AsyncDifyKnowledgeBase:
+    """
+    asyncio counterpart of DifyKnowledgeBase for the write-heavy calls of a sync run.
+    At most `concurrency` requests are in flight and at most `rate_limit` start per second.
+    Retry policy and timeouts come from the same KBConfig as the sync client.
+
+        async with AsyncDifyKnowledgeBase(kb_config, concurrency=8, rate_limit=10) as kb:
+            doc_id = await kb.upload_document_by_file(dataset_id, path)
+    """
+
+    def __init__(
+        self,
+        kb_config: Optional[KBConfig] = None,
+        concurrency: int = 8,
+        rate_limit: float = 10.0,
+    ):
+        self.kb_config = kb_config or KBConfig()
+        self.headers: dict = {
+            "Authorization": f"Bearer {self.kb_config.api_key}",
+        }
+        self.concurrency = concurrency
+        self.rate_limiter = AsyncRateLimiter(rate_limit)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.session: Optional["aiohttp.ClientSession"] = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def open(self):
+        # aiohttp is imported on first use, it is the slowest import of a sync run
+        import aiohttp
+
+        # created here rather than in __init__, both must belong to the running loop
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(
+            limit=max(self.kb_config.pool_size, self.concurrency)
+        )
+        self.session = aiohttp.ClientSession(headers=self.headers, connector=connector)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """
+        Seconds to sleep before retry number `attempt` (1-based), same schedule as the
+        urllib3 Retry used by DifyKnowledgeBase, Retry-After takes precedence.
+        """
+        if retry_after:
+            try:
+                return max(0.0, float(retry_after))
+            except ValueError:
+                pass
+        if attempt <= 1:
+            return 0.0
+        delay = self.kb_config.backoff_factor * 2 ** (attempt - 1)
+        delay += random.random() * self.kb_config.backoff_jitter
+        return min(self.kb_config.backoff_max, delay)
+
+    def retryable(
+        self, method: str, url: str, status: Optional[int] = None, error=None
+    ) -> bool:
+        """
+        Whether an attempt that ended with `status` or `error` is sent again, the same
+        policy as DifyRetry: a POST creating a document only when it never reached Dify,
+        i.e. the connection could not be established or the status is one of
+        SAFE_POST_RETRY_STATUSES. A read timeout or a 502/504 may follow a created document.
+        Idempotent POSTs (IDEMPOTENT_POST_PATHS) are retried like GET.
+        """
+        import aiohttp
+
+        if error is not None:
+            return is_idempotent(method, url) or isinstance(
+                error, (aiohttp.ClientConnectorError, aiohttp.ConnectionTimeoutError)
+            )
+        if status not in self.kb_config.retry_statuses:
+            return False
+        return is_idempotent(method, url) or status in SAFE_POST_RETRY_STATUSES
+
+    async def request(
+        self, method: str, url: str, timeout: Optional[float] = None, **kwargs
+    ) -> Dict[str, Any]:
+        """
+        Send a request with retries on connection errors and kb_config.retry_statuses,
+        narrowed for POST by retryable.
+        Returns the decoded JSON body, raises DifyAPIError on a non-200 final response.
+        `data` may be a callable building a fresh body per attempt (aiohttp FormData is single-use).
+        """
+        import aiohttp
+
+        read_timeout = self.kb_config.read_timeout if timeout is None else timeout
+        client_timeout = aiohttp.ClientTimeout(
+            sock_connect=self.kb_config.connect_timeout, sock_read=read_timeout
+        )
+        data = kwargs.pop("data", None)
+        attempt = 0
+        start = None  # first send, time queued behind the rate limit is not latency
+        while True:
+            retry_after = None
+            try:
+                await self.rate_limiter.acquire()
+                async with self._semaphore:
+                    start = start or time.perf_counter()
+                    body = data() if callable(data) else data
+                    if METRICS.enabled and isinstance(body, aiohttp.FormData):
+                        body = body()  # the multipart payload, it knows its size
+                    async with self.session.request(
+                        method,
+                        url,
+                        timeout=client_timeout,
+                        data=body,
+                        **kwargs,
+                    ) as response:
+                        status = response.status
+                        text = await response.text()
+                        retry_after = response.headers.get("Retry-After")
+                if status == 200:
+                    self.observe(
+                        method, url, status, start, attempt, body, kwargs, text
+                    )
+                    return json.loads(text) if text else {}
+                if (
+                    not self.retryable(method, url, status)
+                    or attempt >= self.kb_config.max_retries
+                ):
+                    self.observe(
+                        method, url, status, start, attempt, body, kwargs, text
+                    )
+                    raise DifyAPIError(status, text)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt >= self.kb_config.max_retries or not self.retryable(
+                    method, url, error=e
+                ):
+                    self.observe(method, url, "error", start, attempt)
+                    raise
+                logger.debug(f"{method} {url} failed: {e!r}, retrying")
+            attempt += 1
+            await asyncio.sleep(self.backoff(attempt, retry_after))
+
+    @staticmethod
+    def observe(
+        method: str,
+        url: str,
+        status,
+        start: Optional[float],
+        retries: int,
+        body=None,
+        kwargs: Optional[dict] = None,
+        text: str = "",
+    ):
+        if not METRICS.enabled:
+            return
+        if kwargs and kwargs.get("json") is not None:
+            sent = len(json.dumps(kwargs["json"]).encode())
+        elif isinstance(body, (bytes, str)):
+            sent = len(body)
+        else:
+            sent = getattr(body, "size", None) or 0
+        METRICS.observe_request(
+            method,
+            url,
+            status,
+            time.perf_counter() - start if start else 0.0,
+            sent=sent,
+            received=len(text.encode()),
+            retries=retries,
+        )
+
+    async def upload_document_by_file(self, dataset_id: str, file_path: str) -> str:
+        """
+        通过文件创建文档
+        :return: document id
+        """
+        url = f"{self.kb_config.base_url}/datasets/{dataset_id}/document/create-by-file"
+        return await self.post_file(url, file_path)
+
+    async def update_document_by_file(
+        self, dataset_id: str, document_id: str, file_path: str
+    ) -> str:
+        """
+        通过文件更新文档
+        :return: document id
+        """
+        url = f"{self.kb_config.base_url}/datasets/{dataset_id}/documents/{document_id}/update-by-file"
+        return await self.post_file(url, file_path)
+
+    async def upload_document_by_text(
+        self, dataset_id: str, name: str, text: str
+    ) -> str:
+        """
+        通过文本创建文档
+        :return: document id
+        """
+        url = f"{self.kb_config.base_url}/datasets/{dataset_id}/document/create-by-text"
+        return await self.post_text(url, name, text)
+
+    async def update_document_by_text(
+        self, dataset_id: str, document_id: str, name: str, text: str
+    ) -> str:
+        """
+        通过文本更新文档
+        :return: document id
+        """
+        url = f"{self.kb_config.base_url}/datasets/{dataset_id}/documents/{document_id}/update-by-text"
+        return await self.post_text(url, name, text)
+
+    async def post_text(self, url: str, name: str, text: str) -> str:
+        res = await self.request(
+            "POST",
+            url,
+            json=Document(name=name, text=text).to_json(),
+            timeout=self.kb_config.upload_timeout,
+        )
+        return res["document"]["id"]
+
+    async def post_file(self, url: str, file_path: str) -> str:
+        file_name = os.path.basename(file_path)
+        data_dict = Document(name=file_name).to_json()
+        content = await asyncio.to_thread(Path(file_path).read_bytes)
+
+        def form():
+            import aiohttp
+
+            fd = aiohttp.FormData()
+            fd.add_field("data", json.dumps(data_dict, ensure_ascii=False))
+            fd.add_field("file", content, filename=file_name)
+            return fd
+
+        res = await self.request(
+            "POST", url, data=form, timeout=self.kb_config.upload_timeout
+        )
+        return res["document"]["id"]
+
+    async def update_document_metadata(
+        self, dataset_id: str, document_id: str, metadata_vlist: list
+    ):
+        """
+        更新文档元数据
+        :param metadata_vlist: [{'id':1,'name':name,'value':value}]
+        """
+        return await self.post_metadata_operations(
+            dataset_id, [(document_id, metadata_vlist)]
+        )
+
+    async def post_metadata_operations(self, dataset_id: str, operations: list):
+        url = f"{self.kb_config.base_url}/datasets/{dataset_id}/documents/metadata"
+        data = {
+            "operation_data": [
+                {
+                    "document_id": document_id,
+                    "metadata_list": metadata_vlist,
+                }
+                for document_id, metadata_vlist in operations
+            ]
+        }
+        return await self.request("POST", url, json=data)
+
+    async def update_documents_metadata(
+        self, dataset_id: str, operations: list, batch_size: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        批量更新文档元数据, same chunking and failure isolation as
+        DifyKnowledgeBase.update_documents_metadata with the chunks sent concurrently.
+        :return: {"success": [document_id, ...], "failed": {document_id: error}}
+        """
+        batch_size = batch_size or self.kb_config.metadata_batch_size
+        result = {"success": [], "failed": {}}
+        await asyncio.gather(
+            *(
+                self._update_metadata_chunk(
+                    dataset_id, operations[i : i + batch_size], result
+                )
+                for i in range(0, len(operations), batch_size)
+            )
+        )
+        return result
+
+    async def _update_metadata_chunk(self, dataset_id: str, chunk: list, result: dict):
+        try:
+            await self.post_metadata_operations(dataset_id, chunk)
+            result["success"].extend(document_id for document_id, _ in chunk)
+        except Exception as e:
+            if len(chunk) > 1 and isinstance(e, DifyAPIError) and e.status < 500:
+                mid = len(chunk) // 2
+                await self._update_metadata_chunk(dataset_id, chunk[:mid], result)
+                await self._update_metadata_chunk(dataset_id, chunk[mid:], result)
+                return
+            for document_id, _ in chunk:
+                result["failed"][document_id] = str(e)
+
+    async def delete_document(self, dataset_id: str, document_id: str):
+        """
+        删除文档
+        """
+        url = f"{self.kb_config.base_url}/datasets/{dataset_id}/documents/{document_id}"
+        return await self.request("DELETE", url)
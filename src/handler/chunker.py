@@ -0,0 +1,314 @@
+import itertools
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import tiktoken
+
+from src.config import get_logger
+from src.handler.dify_knowledge_base import Document
+
+logger = get_logger()
+
+ENCODING = "cl100k_base"
+# pre-tokenizer regex of cl100k_base
+CL100K_PATTERN = r"""'(?i:[sdmt]|ll|ve|re)|[^\r\n\p{L}\p{N}]?+\p{L}+|\p{N}{1,3}| ?[^\s\p{L}\p{N}]++[\r\n]*|\s*[\r\n]|\s+(?!\S)|\s+"""
+# tried in order on a chunk still above max_tokens after the rule separator, as Dify does
+FALLBACK_SEPARATORS = ("\n\n", "。", ". ", " ")
+# below this many texts per thread tokens are counted on the calling thread
+MIN_TEXTS_PER_THREAD = 64
+
+# Dify CleanProcessor, applied to every chunk after it is split
+INVALID_SYMBOLS = re.compile(r"[\x00-\x08\x0B\x0C\x0E-\x1F\x7F\uFFFE]")
+EXTRA_NEWLINES = re.compile(r"\n{3,}")
+# a space followed by more spaces, "[...]{2,}" in Dify, written so it is cheaper to scan
+EXTRA_SPACES = re.compile(
+    r"[\t\f\r\x20\u00a0\u1680\u180e\u2000-\u200a\u202f\u205f\u3000][\t\f\r\x20\u00a0\u1680\u180e\u2000-\u200a\u202f\u205f\u3000]+"
+)
+EMAILS = re.compile(r"([a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+)")
+URLS = re.compile(r"https?://[^\s]+")
+
+
+def byte_level_encoding(words=()) -> tiktoken.Encoding:
+    """
+    Offline stand-in for cl100k_base, for tests and benchmarks without network access:
+    one token per byte of each pre-token, except `words` (with or without a leading
+    space) which become single tokens.
+    """
+    ranks = {bytes([i]): i for i in range(256)}
+    for word in words:
+        for prefix in (word, " " + word):
+            # BPE reaches a word through its prefixes
+            for end in range(2, len(prefix) + 1):
+                ranks.setdefault(prefix[:end].encode(), len(ranks))
+    return tiktoken.Encoding(
+        "bytes", pat_str=CL100K_PATTERN, mergeable_ranks=ranks, special_tokens={}
+    )
+
+
+@dataclass(frozen=True)
+class SegmentRule:
+    separator: str
+    max_tokens: int
+    chunk_overlap: int = 0
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "SegmentRule":
+        return cls(d["separator"], d["max_tokens"], d.get("chunk_overlap", 0))
+
+
+@dataclass
+class Segment:
+    text: str
+    tokens: int
+    children: List["Segment"] = field(default_factory=list)
+
+
+@dataclass
+class ChunkStats:
+    documents: int = 0
+    parents: int = 0
+    children: int = 0
+    parent_tokens: int = 0
+    child_tokens: int = 0  # what gets embedded in hierarchical mode
+
+    def add(self, segments: List[Segment]):
+        self.documents += 1
+        self.parents += len(segments)
+        self.parent_tokens += sum(s.tokens for s in segments)
+        for s in segments:
+            self.children += len(s.children)
+            self.child_tokens += sum(c.tokens for c in s.children)
+
+
+class Chunker:
+    """
+    Local run of the segmentation described by a Document.process_rule, so chunk counts
+    and token totals are known before anything is uploaded:
+    text is split on the parent separator (or kept whole in full-doc mode), each parent
+    is cleaned by the enabled pre_processing_rules and split again on the child separator.
+    A chunk above max_tokens is split on finer separators and merged back into chunks
+    of at most max_tokens with chunk_overlap tokens of overlap.
+    Tokens are counted in one batch over all chunks of all texts given at once, split
+    across num_threads threads (tiktoken encodes without holding the GIL).
+
+        segments = Chunker().chunk([text])[0]
+    """
+
+    def __init__(
+        self,
+        process_rule: Optional[dict] = None,
+        encoding: Optional[tiktoken.Encoding] = None,
+        num_threads: int = 0,
+    ):
+        rules = (process_rule or Document().process_rule)["rules"]
+        self.parent_rule = SegmentRule.from_dict(rules["segmentation"])
+        self.parent_mode = rules.get("parent_mode", "paragraph")
+        sub = rules.get("subchunk_segmentation")
+        self.child_rule = SegmentRule.from_dict(sub) if sub else None
+        enabled = {
+            r["id"] for r in rules.get("pre_processing_rules", []) if r.get("enabled")
+        }
+        self.remove_extra_spaces = "remove_extra_spaces" in enabled
+        self.remove_urls_emails = "remove_urls_emails" in enabled
+        self._encoding = encoding
+        self.num_threads = num_threads or os.cpu_count() or 1
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def encoding(self) -> tiktoken.Encoding:
+        # loaded on first use, tiktoken fetches the BPE ranks once and caches them
+        if self._encoding is None:
+            self._encoding = tiktoken.get_encoding(ENCODING)
+        return self._encoding
+
+    def count_tokens(self, texts: Sequence[str]) -> np.ndarray:
+        encode = self.encoding.encode_ordinary
+        threads = min(self.num_threads, len(texts) // MIN_TEXTS_PER_THREAD)
+        if threads <= 1:
+            counts = (len(encode(t)) for t in texts)
+        else:
+            # one slice per thread: tiktoken's encode_ordinary_batch submits a task per
+            # text, which costs more than encoding a short chunk
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(self.num_threads)
+            step = -(-len(texts) // threads)
+            counts = itertools.chain.from_iterable(
+                self._pool.map(
+                    lambda i: [len(encode(t)) for t in texts[i : i + step]],
+                    range(0, len(texts), step),
+                )
+            )
+        return np.fromiter(counts, dtype=np.int64, count=len(texts))
+
+    def clean(self, text: str) -> str:
+        return self.clean_checked(text)[0]
+
+    def clean_checked(self, text: str) -> Tuple[str, bool]:
+        """
+        Cleaned text, and whether cleaning it (or a part of it) again may change it:
+        only a removed URL, email or <| |> can leave new matches behind, otherwise every
+        substring of the result is clean already and needs no second pass.
+        """
+        again = False
+        if "<|" in text or "|>" in text:
+            text = text.replace("<|", "<").replace("|>", ">")
+            again = True
+        text = INVALID_SYMBOLS.sub("", text)
+        # cheap substring checks skip the slow patterns on most chunks
+        if self.remove_extra_spaces:
+            if "\n\n\n" in text:
+                text = EXTRA_NEWLINES.sub("\n\n", text)
+            text = EXTRA_SPACES.sub(" ", text)
+        if self.remove_urls_emails:
+            if "@" in text:
+                text, n = EMAILS.subn("", text)
+                again |= n > 0
+            if "://" in text:
+                text, n = URLS.subn("", text)
+                again |= n > 0
+        return text.strip(), again
+
+    def chunk(self, texts: Sequence[str]) -> List[List[Segment]]:
+        """
+        Parent segments with their child segments, one list per text.
+        """
+        if self.parent_mode == "full-doc":
+            whole = [self.clean_checked(t) for t in texts]
+            counts = self.count_tokens([t for t, _ in whole])
+            parents = [
+                [Segment(t, int(n))] if t else [] for (t, _), n in zip(whole, counts)
+            ]
+            again = [[a] for _, a in whole]
+        else:
+            parents, again = self.split_checked(texts, self.parent_rule)
+        if self.child_rule is not None:
+            flat = [p for doc in parents for p in doc]
+            children, _ = self.split_checked(
+                [p.text for p in flat],
+                self.child_rule,
+                [a for doc in again for a in doc],
+            )
+            for p, c in zip(flat, children):
+                p.children = c
+        return parents
+
+    def split(self, texts: Sequence[str], rule: SegmentRule) -> List[List[Segment]]:
+        return self.split_checked(texts, rule)[0]
+
+    def split_checked(
+        self,
+        texts: Sequence[str],
+        rule: SegmentRule,
+        clean_again: Optional[Sequence[bool]] = None,
+    ) -> Tuple[List[List[Segment]], List[List[bool]]]:
+        """
+        Segments of each text split by `rule`, and per segment the clean_checked flag.
+        Texts whose clean_again flag is False were cleaned before and are only stripped.
+        """
+        pieces, owners, flags = [], [], []
+        for i, text in enumerate(texts):
+            cleaned = clean_again is not None and not clean_again[i]
+            for piece in text.split(rule.separator):
+                piece, again = (
+                    (piece.strip(), False) if cleaned else self.clean_checked(piece)
+                )
+                if piece:
+                    pieces.append(piece)
+                    owners.append(i)
+                    flags.append(again)
+        counts = self.count_tokens(pieces)
+        # rare, split one by one and counted again in a second batch
+        resplit = {
+            int(i): self.split_oversized(pieces[i], rule)
+            for i in np.flatnonzero(counts > rule.max_tokens)
+        }
+        extra_counts = iter(
+            self.count_tokens([s for parts in resplit.values() for s in parts])
+        )
+        out = [[] for _ in texts]
+        again = [[] for _ in texts]
+        for i, (piece, owner) in enumerate(zip(pieces, owners)):
+            if i in resplit:
+                out[owner].extend(
+                    Segment(s, int(next(extra_counts))) for s in resplit[i]
+                )
+                again[owner].extend(flags[i] for _ in resplit[i])
+            else:
+                out[owner].append(Segment(piece, int(counts[i])))
+                again[owner].append(flags[i])
+        return out, again
+
+    def split_oversized(
+        self,
+        text: str,
+        rule: SegmentRule,
+        separators: Sequence[str] = FALLBACK_SEPARATORS,
+    ) -> List[str]:
+        separator = next((s for s in separators if s in text), None)
+        if separator is None:
+            return self.split_tokens(text, rule)
+        finer = separators[separators.index(separator) + 1 :]
+        splits = [s for s in text.split(separator) if s.strip()]
+        counts = self.count_tokens(splits)
+        separator_tokens = len(self.encoding.encode_ordinary(separator))
+        chunks, run = [], []
+        for s, n in zip(splits, counts):
+            if n <= rule.max_tokens:
+                run.append((s, int(n)))
+                continue
+            chunks += self.merge(run, separator, separator_tokens, rule)
+            run = []
+            chunks += self.split_oversized(s, rule, finer)
+        return chunks + self.merge(run, separator, separator_tokens, rule)
+
+    @staticmethod
+    def merge(splits, separator: str, separator_tokens: int, rule: SegmentRule):
+        """
+        Join consecutive splits into chunks of at most max_tokens, each chunk starting
+        with up to chunk_overlap tokens of the end of the previous one.
+        """
+        chunks, current, total = [], [], 0
+        for s, n in splits:
+            joined = separator_tokens if current else 0
+            if current and total + joined + n > rule.max_tokens:
+                chunks.append(separator.join(t for t, _ in current))
+                while current and (
+                    total > rule.chunk_overlap
+                    or total + separator_tokens + n > rule.max_tokens
+                ):
+                    total -= current[0][1] + (
+                        separator_tokens if len(current) > 1 else 0
+                    )
+                    current.pop(0)
+            current.append((s, n))
+            total += n + (separator_tokens if len(current) > 1 else 0)
+        if current:
+            chunks.append(separator.join(t for t, _ in current))
+        return [c.strip() for c in chunks if c.strip()]
+
+    def split_tokens(self, text: str, rule: SegmentRule) -> List[str]:
+        # no separator left, cut the token sequence itself
+        tokens = self.encoding.encode_ordinary(text)
+        step = max(1, rule.max_tokens - rule.chunk_overlap)
+        return [
+            self.encoding.decode(tokens[i : i + rule.max_tokens])
+            for i in range(0, max(1, len(tokens) - rule.chunk_overlap), step)
+        ]
+
+    def stats(self, documents: Iterable[List[Segment]]) -> ChunkStats:
+        stats = ChunkStats()
+        for segments in documents:
+            stats.add(segments)
+        return stats
+
+    def prechunked_text(self, segments: List[Segment]) -> str:
+        """
+        Text for upload_document_by_text whose parent boundaries are exactly the local
+        ones: cleaned parents joined by the parent separator, so Dify's own split on
+        that separator returns the same parents.
+        """
+        return self.parent_rule.separator.join(s.text for s in segments)
@@ -1,14 +1,57 @@
 import json
+import math
 import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterator, Optional
+from urllib.parse import urlsplit
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-from src.config import CONFIG, get_logger
+from src.config import get_logger, setting
+from src.utils.metrics import METRICS
 
 logger = get_logger()
 
+# statuses Dify answers before handling a request, the only ones a POST is retried on:
+# document creation is not idempotent, after a read timeout or a 502/504 from a proxy
+# the document may already exist and a retry would create it again
+SAFE_POST_RETRY_STATUSES = (429, 503)
+# POST endpoints that overwrite the state of an existing document instead of creating
+# one, sending them twice is harmless so they are retried like GET
+IDEMPOTENT_POST_PATHS = ("/documents/metadata", "/update-by-file", "/update-by-text")
+
+
+def is_idempotent(method: str, url: str) -> bool:
+    return method.upper() != "POST" or urlsplit(url).path.endswith(
+        IDEMPOTENT_POST_PATHS
+    )
+
+
+class DifyRetry(Retry):
+    """
+    Retry policy of the session. Idempotent methods are retried on connection and read
+    errors and on every retry status; POST only on connection errors and on
+    SAFE_POST_RETRY_STATUSES. Read errors are never retried for POST since POST is left
+    out of allowed_methods, except on the session for IDEMPOTENT_POST_PATHS.
+    """
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method.upper() == "POST" and status_code in SAFE_POST_RETRY_STATUSES:
+            method = "GET"  # rejected before handling, safe to send again
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+class DifyAPIError(Exception):
+    def __init__(self, status: int, detail: Any):
+        super().__init__(f"Status: {status}, Detail: {detail}")
+        self.status = status
+        self.detail = detail
+
 
 @dataclass
 class Document:
@@ -89,30 +132,153 @@ class Document:
 
 @dataclass
 class KBConfig:
-    api_key: str = CONFIG["dify"]["knowledge_base"]["api_key"]
-    base_url: str = CONFIG["dify"]["knowledge_base"]["base_url"]
+    # defaults from [dify.knowledge_base] and [dify.http] in config.toml, read per instance
+    api_key: str = setting("dify.knowledge_base.api_key")
+    base_url: str = setting("dify.knowledge_base.base_url")
+    # connection pool, keep-alive connections per host
+    pool_size: int = setting("dify.http.pool_size", 10)
+    # timeouts in seconds, uploads get a longer read timeout
+    connect_timeout: float = setting("dify.http.connect_timeout", 5.0)
+    read_timeout: float = setting("dify.http.read_timeout", 30.0)
+    upload_timeout: float = setting("dify.http.upload_timeout", 300.0)
+    # retry with exponential backoff: the first retry is immediate,
+    # then backoff_factor * 2 ** (n - 1) + random(0, backoff_jitter), capped at backoff_max
+    max_retries: int = setting("dify.http.max_retries", 5)
+    backoff_factor: float = setting("dify.http.backoff_factor", 0.5)
+    backoff_jitter: float = setting("dify.http.backoff_jitter", 0.5)
+    backoff_max: float = setting("dify.http.backoff_max", 60.0)
+    retry_statuses: tuple = setting("dify.http.retry_statuses", (429, 502, 503, 504))
+    # documents per request in update_documents_metadata
+    metadata_batch_size: int = setting("dify.knowledge_base.metadata_batch_size", 100)
+    # document listing: page size (Dify caps it at 100) and pages fetched in parallel ahead
+    page_size: int = setting("dify.knowledge_base.page_size", 100)
+    page_prefetch: int = setting("dify.knowledge_base.page_prefetch", 4)
+    # seconds the datasets / documents / metadata maps are reused, 0 fetches on every access
+    cache_ttl: float = setting("dify.knowledge_base.cache_ttl", 300.0)
+
+    def __post_init__(self):
+        self.retry_statuses = tuple(self.retry_statuses)
 
 
 class DifyKnowledgeBase:
     # 封装知识库api
 
     def __init__(
-        self, dataset_name: Optional[str] = None, kb_config: KBConfig = KBConfig()
+        self, dataset_name: Optional[str] = None, kb_config: Optional[KBConfig] = None
     ):
-        self.kb_config = kb_config
+        self.kb_config = kb_config or KBConfig()
         self.headers: dict = {
             "Authorization": f"Bearer {self.kb_config.api_key}",
         }
+        self.session: requests.Session = self.create_session()
+        # IDEMPOTENT_POST_PATHS, retried on read errors and every retry status
+        self.idempotent_session: requests.Session = self.create_session(retry_post=True)
         self.dataset_name: str = dataset_name
         self._datasets: Dict[str, Any] = {}
         self._dataset_id: str = ""
         self._documents: Dict[str, Any] = {}  # itemKey -> document_id
         self._metadata: Dict[str, Any] = {}  # metadata Name -> metadata id
+        self._fetched_at: Dict[str, float] = {}  # map name -> monotonic fetch time
+
+    def create_session(self, retry_post: bool = False) -> requests.Session:
+        """
+        Keep-alive session with a bounded connection pool and retries on connection
+        errors and retry_statuses, see DifyRetry for POST. Retry-After is honoured on
+        429/503, otherwise exponential backoff with jitter is used.
+        :param retry_post: retry POST like GET, for the idempotent endpoints only
+        """
+        allowed_methods = Retry.DEFAULT_ALLOWED_METHODS
+        if retry_post:
+            allowed_methods = allowed_methods | {"POST"}
+        retry = DifyRetry(
+            allowed_methods=allowed_methods,
+            total=self.kb_config.max_retries,
+            backoff_factor=self.kb_config.backoff_factor,
+            backoff_jitter=self.kb_config.backoff_jitter,
+            backoff_max=self.kb_config.backoff_max,
+            status_forcelist=self.kb_config.retry_statuses,
+            respect_retry_after_header=True,
+            raise_on_status=False,  # hand the last response back so callers can report it
+        )
+        adapter = HTTPAdapter(
+            pool_connections=self.kb_config.pool_size,
+            pool_maxsize=self.kb_config.pool_size,
+            max_retries=retry,
+        )
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update(self.headers)
+        return session
+
+    def request(
+        self, method: str, url: str, timeout: Optional[float] = None, **kwargs
+    ) -> requests.Response:
+        """
+        Send a request through the pooled session, idempotent POSTs through
+        idempotent_session.
+        :param timeout: read timeout for this call, defaults to kb_config.read_timeout
+        """
+        read_timeout = self.kb_config.read_timeout if timeout is None else timeout
+        session = self.session
+        if method.upper() == "POST" and is_idempotent(method, url):
+            session = self.idempotent_session
+        start = time.perf_counter()
+        try:
+            response = session.request(
+                method,
+                url,
+                timeout=(self.kb_config.connect_timeout, read_timeout),
+                **kwargs,
+            )
+        except requests.RequestException:
+            METRICS.observe_request(method, url, "error", time.perf_counter() - start)
+            raise
+        if METRICS.enabled:
+            # retries done by urllib3 are in the history of the final response
+            retries = response.raw.retries if response.raw is not None else None
+            METRICS.observe_request(
+                method,
+                url,
+                response.status_code,
+                time.perf_counter() - start,
+                sent=len(response.request.body or b""),
+                received=len(response.content),
+                retries=len(retries.history) if retries else 0,
+            )
+        return response
+
+    def close(self):
+        self.session.close()
+        self.idempotent_session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def is_fresh(self, name: str) -> bool:
+        fetched_at = self._fetched_at.get(name)
+        return (
+            fetched_at is not None
+            and time.monotonic() - fetched_at < self.kb_config.cache_ttl
+        )
+
+    def invalidate(self, *names: str):
+        """
+        Drop cached maps ("datasets", "documents", "metadata") so the next access refetches.
+        All of them when no name is given.
+        """
+        for name in names or list(self._fetched_at):
+            self._fetched_at.pop(name, None)
 
     @property
     def datasets(self) -> Dict[str, Any]:
-        res = self.list_knowledge_base()
-        self._datasets = {item["name"]: item["id"] for item in res["data"]}
+        if not self.is_fresh("datasets"):
+            res = self.list_knowledge_base()
+            self._datasets = {item["name"]: item["id"] for item in res["data"]}
+            self._fetched_at["datasets"] = time.monotonic()
         return self._datasets
 
     @property
@@ -127,26 +293,49 @@ class DifyKnowledgeBase:
 
     @property
     def documents(self) -> Dict[str, Any]:
-        res = self.list_documents(self._dataset_id)
-        dict_res = {}
-        for item in res:
-            for fld in item["doc_metadata"]:
-                if fld["name"] == "itemKey":
-                    key = fld["value"]
-                    dict_res[key] = item["id"]
-        self._documents = dict_res
+        """
+        itemKey -> document_id, cached for kb_config.cache_ttl seconds.
+        """
+        if not self.is_fresh("documents"):
+            res = self.iter_documents(self._dataset_id or self.dataset_id)
+            dict_res = {}
+            for item in res:
+                for fld in item["doc_metadata"]:
+                    if fld["name"] == "itemKey":
+                        key = fld["value"]
+                        dict_res[key] = item["id"]
+            self._documents = dict_res
+            self._fetched_at["documents"] = time.monotonic()
         return self._documents
 
     @property
     def metadata(self) -> Dict[str, Any]:
-        res = self.list_metadata(self._dataset_id)
-        self._metadata = {item["name"]: item["id"] for item in res}
+        """
+        metadata name -> metadata id, cached for kb_config.cache_ttl seconds.
+        """
+        if not self.is_fresh("metadata"):
+            res = self.list_metadata(self._dataset_id or self.dataset_id)
+            self._metadata = {item["name"]: item["id"] for item in res}
+            self._fetched_at["metadata"] = time.monotonic()
         return self._metadata
 
+    def remember_document(self, item_key: str, document_id: str):
+        """
+        Write-through after an upload whose itemKey metadata has been set.
+        """
+        self._documents[item_key] = document_id
+
+    def forget_document(self, document_id: str):
+        """
+        Write-through after a delete.
+        """
+        for key in [k for k, v in self._documents.items() if v == document_id]:
+            del self._documents[key]
+
     def list_knowledge_base(self):
         # 知识库列表
         url = f"{self.kb_config.base_url}/datasets"
-        response = requests.get(url, headers=self.headers)
+        response = self.request("GET", url)
         if response.status_code == 200:
             return response.json()
         else:
@@ -155,22 +344,63 @@ class DifyKnowledgeBase:
     def get_knowledge_base(self, dataset_id: str):
         # 查看知识库详情
         url = f"{self.kb_config.base_url}/datasets/{dataset_id}"
-        response = requests.get(url, headers=self.headers)
+        response = self.request("GET", url)
         if response.status_code == 200:
             return response.json()
         else:
             raise Exception(response.json())
 
-    def list_documents(self, dataset_id: str):
-        # 查看知识库文档列表
+    def get_documents_page(self, dataset_id: str, page: int, limit: int):
+        # 查看知识库文档列表 (单页)
         url = f"{self.kb_config.base_url}/datasets/{dataset_id}/documents"
-        response = requests.get(url, headers=self.headers)
+        response = self.request("GET", url, params={"page": page, "limit": limit})
         if response.status_code == 200:
-            res = response.json()
-            return res["data"]
+            return response.json()
         else:
             raise Exception(response.json())
 
+    def iter_documents(
+        self,
+        dataset_id: str,
+        page_size: Optional[int] = None,
+        prefetch: Optional[int] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Stream every document of the dataset, page by page and in order.
+        :param page_size: documents per page, defaults to kb_config.page_size
+        :param prefetch: pages fetched in parallel ahead of the consumer, defaults to
+            kb_config.page_prefetch, 0 pages strictly sequentially on has_more
+        """
+        page_size = page_size or self.kb_config.page_size
+        prefetch = self.kb_config.page_prefetch if prefetch is None else prefetch
+        res = self.get_documents_page(dataset_id, 1, page_size)
+        yield from res["data"]
+        page = 1
+        if prefetch > 0 and res.get("has_more") and res.get("total"):
+            # page numbers are known from total, keep up to `prefetch` of them in flight
+            last_page = math.ceil(res["total"] / page_size)
+            with ThreadPoolExecutor(max_workers=prefetch) as pool:
+                pending = deque()
+                while pending or page < last_page:
+                    while len(pending) < prefetch and page < last_page:
+                        page += 1
+                        pending.append(
+                            pool.submit(
+                                self.get_documents_page, dataset_id, page, page_size
+                            )
+                        )
+                    res = pending.popleft().result()
+                    yield from res["data"]
+        # sequential paging, also picks up documents added after `total` was read
+        while res.get("has_more"):
+            page += 1
+            res = self.get_documents_page(dataset_id, page, page_size)
+            yield from res["data"]
+
+    def list_documents(self, dataset_id: str):
+        # 查看知识库文档列表 (所有分页)
+        return list(self.iter_documents(dataset_id))
+
     def list_metadata(self, dataset_id: str):
         """
         获取文档元数据
@@ -178,7 +408,7 @@ class DifyKnowledgeBase:
         :return: API响应 id, name, type
         """
         url = f"{self.kb_config.base_url}/datasets/{dataset_id}/metadata"
-        response = requests.get(url, headers=self.headers)
+        response = self.request("GET", url)
         if response.status_code == 200:
             res = response.json()
             return res["doc_metadata"]
@@ -190,9 +420,10 @@ class DifyKnowledgeBase:
     ):
         # 通过文本创建文档，严格参考curl示例
         url = f"{self.kb_config.base_url}/datasets/{dataset_id}/document/create-by-text"
-        self.headers["Content-Type"] = "application/json"
         data = Document(name=name, text=text).to_json()
-        response = requests.post(url, headers=self.headers, json=data)
+        response = self.request(
+            "POST", url, json=data, timeout=self.kb_config.upload_timeout
+        )
         if response.status_code == 200:
             return response.json()
         else:
@@ -214,7 +445,58 @@ class DifyKnowledgeBase:
         # 构造file
         with open(file_path, "rb") as f:
             file = {"file": (file_name, f)}
-            response = requests.post(url, headers=self.headers, data=data, files=file)
+            response = self.request(
+                "POST",
+                url,
+                data=data,
+                files=file,
+                timeout=self.kb_config.upload_timeout,
+            )
+        if response.status_code == 200:
+            return response.json()["document"]["id"]
+        else:
+            raise Exception(response.json())
+
+    def update_document_by_file(
+        self, dataset_id: str, document_id: str, file_path: str
+    ):
+        """
+        通过文件更新文档, the document keeps its id and metadata and is re-indexed
+        :param dataset_id: 知识库ID
+        :param document_id: 文档ID
+        :param file_path: 本地文件路径
+        :return: document id
+        """
+        url = f"{self.kb_config.base_url}/datasets/{dataset_id}/documents/{document_id}/update-by-file"
+        file_name = os.path.basename(file_path)
+        data_dict = Document(name=file_name).to_json()
+        data = {"data": json.dumps(data_dict, ensure_ascii=False)}
+        with open(file_path, "rb") as f:
+            file = {"file": (file_name, f)}
+            response = self.request(
+                "POST",
+                url,
+                data=data,
+                files=file,
+                timeout=self.kb_config.upload_timeout,
+            )
+        if response.status_code == 200:
+            return response.json()["document"]["id"]
+        else:
+            raise Exception(response.json())
+
+    def update_document_by_text(
+        self, dataset_id: str, document_id: str, name: str, text: str
+    ):
+        """
+        通过文本更新文档, the text counterpart of update_document_by_file
+        :return: document id
+        """
+        url = f"{self.kb_config.base_url}/datasets/{dataset_id}/documents/{document_id}/update-by-text"
+        data = Document(name=name, text=text).to_json()
+        response = self.request(
+            "POST", url, json=data, timeout=self.kb_config.upload_timeout
+        )
         if response.status_code == 200:
             return response.json()["document"]["id"]
         else:
@@ -224,31 +506,70 @@ class DifyKnowledgeBase:
         self, dataset_id: str, document_id: str, metadata_vlist: list
     ):
         """
-        更新文档元数据 (可以批量操作)
+        更新文档元数据 (单个文档, 批量见 update_documents_metadata)
         :param dataset_id: 知识库ID
         :param document_id: 文档ID
         :param metadata_vdict: 元数据 metadata [{'id':1,'name':name,'value':value}]  id, name, value
         :return: API响应
         """
+        return self.post_metadata_operations(
+            dataset_id, [(document_id, metadata_vlist)]
+        )
+
+    def post_metadata_operations(self, dataset_id: str, operations: list):
+        """
+        Send one metadata request for several documents.
+        :param operations: [(document_id, metadata_vlist), ...]
+        :return: API响应, raises DifyAPIError on failure
+        """
         url = f"{self.kb_config.base_url}/datasets/{dataset_id}/documents/metadata"
-        headers = {
-            "Authorization": f"Bearer {self.kb_config.api_key}",
-            "Content-Type": "application/json",
-        }
+        headers = {"Content-Type": "application/json"}
         data = {
             "operation_data": [
                 {
                     "document_id": document_id,
                     "metadata_list": metadata_vlist,
                 }
+                for document_id, metadata_vlist in operations
             ]
         }
         data = json.dumps(data, ensure_ascii=False)
-        response = requests.post(url, headers=headers, data=data)
+        response = self.request("POST", url, headers=headers, data=data)
         if response.status_code == 200:
             return response.json()
         else:
-            raise Exception(f"Status: {response.status_code}, Detail: {response.text}")
+            raise DifyAPIError(response.status_code, response.text)
+
+    def update_documents_metadata(
+        self, dataset_id: str, operations: list, batch_size: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        批量更新文档元数据, batch_size documents per request (kb_config.metadata_batch_size).
+        A chunk rejected with a 4xx is bisected to isolate the offending documents;
+        on a 5xx or connection error (already retried) the whole chunk is reported failed.
+        :param operations: [(document_id, metadata_vlist), ...]
+        :return: {"success": [document_id, ...], "failed": {document_id: error}}
+        """
+        batch_size = batch_size or self.kb_config.metadata_batch_size
+        result = {"success": [], "failed": {}}
+        for i in range(0, len(operations), batch_size):
+            self._update_metadata_chunk(
+                dataset_id, operations[i : i + batch_size], result
+            )
+        return result
+
+    def _update_metadata_chunk(self, dataset_id: str, chunk: list, result: dict):
+        try:
+            self.post_metadata_operations(dataset_id, chunk)
+            result["success"].extend(document_id for document_id, _ in chunk)
+        except Exception as e:
+            if len(chunk) > 1 and isinstance(e, DifyAPIError) and e.status < 500:
+                mid = len(chunk) // 2
+                self._update_metadata_chunk(dataset_id, chunk[:mid], result)
+                self._update_metadata_chunk(dataset_id, chunk[mid:], result)
+                return
+            for document_id, _ in chunk:
+                result["failed"][document_id] = str(e)
 
     def delete_document(self, dataset_id: str, document_id: str):
         """
@@ -258,8 +579,9 @@ class DifyKnowledgeBase:
         :return: API响应
         """
         url = f"{self.kb_config.base_url}/datasets/{dataset_id}/documents/{document_id}"
-        response = requests.delete(url, headers=self.headers)
+        response = self.request("DELETE", url)
         if response.status_code == 200:
+            self.forget_document(document_id)
             return response.json()
         else:
             raise Exception(response.json())
@@ -276,5 +598,10 @@ class DifyKnowledgeBase:
             "name": metadata_name,
             "type": metadata_type,
         }
-        response = requests.post(url, headers=self.headers, json=data)
-        return response.json()
+        response = self.request("POST", url, json=data)
+        res = response.json()
+        if response.ok and "id" in res:
+            self._metadata[res.get("name", metadata_name)] = res["id"]
+        else:
+            self.invalidate("metadata")
+        return res
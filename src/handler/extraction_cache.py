@@ -0,0 +1,122 @@
+import mmap
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+from src.config import get_logger
+from src.utils.hashing import hash_file
+
+logger = get_logger()
+
+# eviction frees space down to this share of max_bytes, so the next puts fit without
+# scanning the cache again
+LOW_WATER = 0.9
+
+
+class ExtractionCache:
+    """
+    Content-addressed store of text extracted from files, one file per sha256 under
+    <root>/<extractor>-<version>/<hash[:2]>/<hash>.md, so a new extractor version never
+    reads text produced by an older one.
+    The whole root is kept below max_bytes by evicting the least recently used entries,
+    entries of other extractor versions included, down to LOW_WATER * max_bytes. Reads
+    bump the mtime to record use.
+
+        cache = ExtractionCache(PATH_DATA / "extraction_cache", "docling", "2.15.1")
+        text = cache.get(attachment.fileHash)
+    """
+
+    def __init__(
+        self, root, extractor: str, version: str, max_bytes: int = 2 * 1024**3
+    ):
+        self.root = Path(root)
+        self.dir = self.root / f"{extractor}-{version}"
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes  # <= 0 for no limit
+        self._total: Optional[int] = None  # bytes under root, scanned on the first put
+
+    def path(self, file_hash: str) -> Path:
+        return self.dir / file_hash[:2] / f"{file_hash}.md"
+
+    def __contains__(self, file_hash: str) -> bool:
+        return self.path(file_hash).exists()
+
+    @contextmanager
+    def mapped(self, file_hash: str) -> Iterator[Optional[bytes]]:
+        """
+        Read-only memory map of the cached UTF-8 text, None when not cached.
+        Nothing is copied until the caller slices or decodes it.
+        """
+        path = self.path(file_hash)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            yield None
+            return
+        with f:
+            os.utime(path)
+            if os.fstat(f.fileno()).st_size == 0:
+                yield b""  # an empty file cannot be mapped
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                yield m
+
+    def get(self, file_hash: str) -> Optional[str]:
+        with self.mapped(file_hash) as m:
+            return None if m is None else str(m, "utf-8")
+
+    def get_for_file(self, path) -> Optional[str]:
+        return self.get(hash_file(path))
+
+    def put(self, file_hash: str, text: str):
+        """
+        Store the text atomically: written to a temporary file next to the entry and
+        renamed over it, so readers see either no entry or the complete text.
+        """
+        path = self.path(file_hash)
+        path.parent.mkdir(exist_ok=True)
+        if self.max_bytes > 0 and self._total is None:
+            self._total = self.size()
+        data = text.encode("utf-8")
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            try:
+                replaced = path.stat().st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        if self.max_bytes > 0:
+            self._total += len(data) - replaced
+            if self._total > self.max_bytes:
+                self.evict()
+
+    def entries(self) -> List[Path]:
+        return list(self.root.glob("*/*/*.md"))
+
+    def size(self) -> int:
+        return sum(p.stat().st_size for p in self.entries())
+
+    def evict(self):
+        """
+        Delete least recently used entries until the root fits in LOW_WATER * max_bytes.
+        """
+        entries = sorted(
+            ((p.stat(), p) for p in self.entries()), key=lambda e: e[0].st_mtime_ns
+        )
+        total = sum(st.st_size for st, _ in entries)
+        evicted = 0
+        for st, p in entries:
+            if total <= self.max_bytes * LOW_WATER:
+                break
+            p.unlink(missing_ok=True)
+            total -= st.st_size
+            evicted += 1
+        self._total = total
+        logger.info(f"Evicted {evicted} extracted texts, cache holds {total} bytes")
@@ -0,0 +1,373 @@
+import math
+import re
+import sqlite3
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Set
+
+import numpy as np
+
+from src.config import get_logger, get_setting
+
+logger = get_logger()
+
+DEFAULT_MODEL = "BAAI/bge-small-en-v1.5"
+# BM25Okapi parameters, as in rank_bm25
+K1 = 1.5
+B = 0.75
+EPSILON = 0.25
+# reciprocal rank fusion constant
+RRF_K = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    id INTEGER PRIMARY KEY,
+    itemKey TEXT NOT NULL,
+    text TEXT NOT NULL,
+    vector BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chunks_itemKey ON chunks(itemKey);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+CJK = r"\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af"
+# words, and single characters of scripts written without spaces
+TOKEN = re.compile(rf"[{CJK}]|[^\W{CJK}]+")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN.findall(text.lower())
+
+
+def split_paragraphs(text: str, max_chars: int = 2000) -> List[str]:
+    """
+    Chunks of whole paragraphs up to max_chars, for texts not chunked by a Chunker.
+    """
+    chunks, current = [], ""
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if current and len(current) + len(paragraph) + 2 > max_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class FastEmbedder:
+    """
+    fastembed TextEmbedding (ONNX on CPU), loaded on first use.
+    """
+
+    def __init__(self, model_name: Optional[str] = None):
+        self.model_name = model_name or get_setting("local_index.model", DEFAULT_MODEL)
+        self._model = None
+
+    def __call__(self, texts: Sequence[str]) -> np.ndarray:
+        if self._model is None:
+            from fastembed import TextEmbedding
+
+            self._model = TextEmbedding(self.model_name)
+        return np.asarray(list(self._model.embed(list(texts))), dtype=np.float32)
+
+
+@dataclass
+class Hit:
+    itemKey: str
+    text: str  # best matching chunk of the item
+    score: float
+
+
+class LocalIndex:
+    """
+    Offline hybrid index over the text of synced attachments: chunk embeddings and a
+    BM25 inverted index, fused by reciprocal rank. Chunks and their embeddings persist
+    in a SQLite file, the search structures live in memory and are kept up to date by
+    upsert / delete, so only changed items are ever embedded.
+
+        index = LocalIndex("data/local_index.sqlite")
+        index.upsert("ABCD1234", chunks)
+        hits = index.search("urban heat island", k=10)
+    """
+
+    def __init__(
+        self, path, embed: Optional[Callable[[Sequence[str]], np.ndarray]] = None
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(self.path))
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        self.embed = embed or FastEmbedder()
+        self._loaded = False
+        self.check_model()
+
+    def close(self):
+        self.db.close()
+
+    def check_model(self):
+        """
+        Stored vectors are only comparable with vectors of the same model: when the
+        embedder changed, the index is emptied and marked for a new backfill from the
+        extraction cache, see Pipeline.backfill_index.
+        """
+        model = getattr(self.embed, "model_name", type(self.embed).__name__)
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'model'").fetchone()
+        if row and row[0] != model:
+            logger.warning(
+                f"Local index was built with {row[0]}, not {model}: clearing it"
+            )
+            with self.db:
+                self.db.execute("DELETE FROM chunks")
+                self.db.execute("DELETE FROM meta WHERE key = 'backfilled'")
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('model', ?)", (model,)
+            )
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT count(DISTINCT itemKey) FROM chunks").fetchone()[
+            0
+        ]
+
+    def __contains__(self, item_key: str) -> bool:
+        row = self.db.execute(
+            "SELECT 1 FROM chunks WHERE itemKey = ? LIMIT 1", (item_key,)
+        ).fetchone()
+        return row is not None
+
+    @property
+    def backfilled(self) -> bool:
+        """
+        Whether the items synced before the index existed (or before its model changed)
+        were added, set by mark_backfilled.
+        """
+        row = self.db.execute(
+            "SELECT value FROM meta WHERE key = 'backfilled'"
+        ).fetchone()
+        return row is not None
+
+    def mark_backfilled(self, done: bool = True):
+        with self.db:
+            self.db.execute("DELETE FROM meta WHERE key = 'backfilled'")
+            if done:
+                self.db.execute(
+                    "INSERT INTO meta (key, value) VALUES ('backfilled', '1')"
+                )
+
+    def keys(self) -> Set[str]:
+        return {k for (k,) in self.db.execute("SELECT DISTINCT itemKey FROM chunks")}
+
+    def load(self):
+        """
+        Build the in-memory structures from the stored chunks, done on the first search.
+        """
+        self.item_keys: List[str] = []
+        self.texts: List[str] = []
+        self.rows_by_item: Dict[str, List[int]] = {}
+        # row buffers grow by doubling, the first `size` rows are in use
+        self.size = 0
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._doc_len = np.zeros(0, dtype=np.float64)
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self._arrays: Dict[str, tuple] = {}
+        rows = self.db.execute(
+            "SELECT id, itemKey, text, vector FROM chunks ORDER BY id"
+        )
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == 10000:
+                self._append(batch)
+                batch = []
+        self._append(batch)
+        self._loaded = True
+        logger.info(f"Loaded local index of {self.size} chunks from {self.path}")
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._vectors[: self.size]
+
+    @property
+    def alive(self) -> np.ndarray:
+        return self._alive[: self.size]
+
+    @property
+    def doc_len(self) -> np.ndarray:
+        return self._doc_len[: self.size]
+
+    def _reserve(self, rows: int, dim: int):
+        if self.size + rows <= len(self._alive):
+            return
+        capacity = max(self.size + rows, 2 * len(self._alive), 1024)
+        vectors = np.zeros((capacity, dim), dtype=np.float32)
+        if self.size:
+            vectors[: self.size] = self.vectors
+        alive = np.zeros(capacity, dtype=bool)
+        alive[: self.size] = self.alive
+        doc_len = np.zeros(capacity, dtype=np.float64)
+        doc_len[: self.size] = self.doc_len
+        self._vectors, self._alive, self._doc_len = vectors, alive, doc_len
+
+    def _append(self, rows):
+        if not rows:
+            return
+        vectors = np.stack([np.frombuffer(v, dtype=np.float32) for *_, v in rows])
+        self._reserve(len(rows), vectors.shape[1])
+        start = self.size
+        self._vectors[start : start + len(rows)] = vectors
+        self._alive[start : start + len(rows)] = True
+        for offset, (_, item_key, text, _) in enumerate(rows):
+            row = start + offset
+            self.item_keys.append(item_key)
+            self.texts.append(text)
+            self.rows_by_item.setdefault(item_key, []).append(row)
+            terms = Counter(tokenize(text))
+            self._doc_len[row] = sum(terms.values())
+            for term, tf in terms.items():
+                self.postings.setdefault(term, {})[row] = tf
+                self._arrays.pop(term, None)
+        self.size += len(rows)
+
+    def _remove(self, item_key: str):
+        for row in self.rows_by_item.pop(item_key, []):
+            self._alive[row] = False
+            for term in set(tokenize(self.texts[row])):
+                posting = self.postings[term]
+                posting.pop(row, None)
+                if not posting:
+                    del self.postings[term]
+                self._arrays.pop(term, None)
+            self.texts[row] = ""
+
+    def upsert(self, item_key: str, chunks: Sequence[str]):
+        """
+        Replace the chunks of an item. Unchanged chunks keep their stored embedding,
+        only new text is embedded.
+        """
+        chunks = [c for c in chunks if c.strip()]
+        known = {
+            text: vector
+            for text, vector in self.db.execute(
+                "SELECT text, vector FROM chunks WHERE itemKey = ?", (item_key,)
+            )
+        }
+        new = [c for c in dict.fromkeys(chunks) if c not in known]
+        if new:
+            vectors = self.normalize(np.asarray(self.embed(new), dtype=np.float32))
+            known.update((c, v.tobytes()) for c, v in zip(new, vectors))
+        with self.db:
+            self.db.execute("DELETE FROM chunks WHERE itemKey = ?", (item_key,))
+            self.db.executemany(
+                "INSERT INTO chunks (itemKey, text, vector) VALUES (?, ?, ?)",
+                [(item_key, c, known[c]) for c in chunks],
+            )
+        if self._loaded:
+            self._remove(item_key)
+            self._append(
+                self.db.execute(
+                    "SELECT id, itemKey, text, vector FROM chunks WHERE itemKey = ? ORDER BY id",
+                    (item_key,),
+                ).fetchall()
+            )
+
+    def delete(self, item_key: str):
+        with self.db:
+            self.db.execute("DELETE FROM chunks WHERE itemKey = ?", (item_key,))
+        if self._loaded:
+            self._remove(item_key)
+
+    @staticmethod
+    def normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def vector_scores(self, query: str) -> np.ndarray:
+        if not self.size:
+            return np.zeros(0)
+        q = self.normalize(np.asarray(self.embed([query]), dtype=np.float32))[0]
+        return self.vectors @ q
+
+    def bm25_scores(self, query: str) -> np.ndarray:
+        """
+        BM25Okapi scores over the live chunks, from the inverted index, so a query only
+        touches the chunks containing one of its terms.
+        """
+        scores = np.zeros(self.size)
+        n = int(self.alive.sum())
+        if not n:
+            return scores
+        avgdl = self.doc_len[self.alive].mean() or 1.0
+        idfs = {
+            t: math.log(n - len(self.postings[t]) + 0.5)
+            - math.log(len(self.postings[t]) + 0.5)
+            for t in set(tokenize(query))
+            if self.postings.get(t)
+        }
+        # rank_bm25 floors negative idf at epsilon times the average idf
+        floor = EPSILON * (sum(idfs.values()) / len(idfs)) if idfs else 0.0
+        for term, idf in idfs.items():
+            rows, tf = self.posting_arrays(term)
+            norm = K1 * (1 - B + B * self.doc_len[rows] / avgdl)
+            scores[rows] += max(idf, floor) * tf * (K1 + 1) / (tf + norm)
+        return scores
+
+    def posting_arrays(self, term: str):
+        arrays = self._arrays.get(term)
+        if arrays is None:
+            posting = self.postings[term]
+            arrays = (
+                np.fromiter(posting.keys(), dtype=np.int64, count=len(posting)),
+                np.fromiter(posting.values(), dtype=np.float64, count=len(posting)),
+            )
+            self._arrays[term] = arrays
+        return arrays
+
+    def top_rows(
+        self, scores: np.ndarray, k: int, positive: bool = False
+    ) -> np.ndarray:
+        scores = np.where(self.alive, scores, -np.inf)
+        if positive:
+            scores = np.where(scores > 0, scores, -np.inf)
+        k = min(k, int(np.isfinite(scores).sum()))
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64)
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top])]
+
+    def search(self, query: str, k: int = 10, candidates: int = 50) -> List[Hit]:
+        """
+        Top k items for the query: the `candidates` best chunks of the vector and the
+        BM25 ranking are fused by reciprocal rank, an item scores by its best chunk.
+        """
+        if not self._loaded:
+            self.load()
+        fused: Dict[int, float] = {}
+        for rows in (
+            self.top_rows(self.vector_scores(query), candidates),
+            self.top_rows(self.bm25_scores(query), candidates, positive=True),
+        ):
+            for rank, row in enumerate(rows.tolist()):
+                fused[row] = fused.get(row, 0.0) + 1.0 / (RRF_K + rank + 1)
+        hits: Dict[str, Hit] = {}
+        for row, score in sorted(fused.items(), key=lambda x: -x[1]):
+            item_key = self.item_keys[row]
+            if item_key not in hits:
+                hits[item_key] = Hit(item_key, self.texts[row], score)
+            if len(hits) == k:
+                break
+        return list(hits.values())
+
+    def search_keys(self, query: str, k: int = 10) -> List[str]:
+        """
+        itemKeys of the top k items, e.g. to restrict a Dify retrieval to them.
+        """
+        return [hit.itemKey for hit in self.search(query, k)]
@@ -0,0 +1,316 @@
+import json
+import sqlite3
+import time
+import uuid
+from dataclasses import asdict
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from src.config import get_logger
+from src.handler.zotero_database import Attachment
+
+logger = get_logger()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS attachments (
+    itemKey TEXT PRIMARY KEY,
+    parentKey TEXT NOT NULL,
+    fileHash TEXT,
+    data TEXT NOT NULL,
+    updatedAt REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS attachments_parentKey ON attachments(parentKey);
+CREATE TABLE IF NOT EXISTS journal (
+    id INTEGER PRIMARY KEY,
+    runId TEXT NOT NULL,
+    action TEXT NOT NULL,
+    itemKey TEXT NOT NULL,
+    data TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    error TEXT,
+    updatedAt REAL NOT NULL,
+    docId TEXT
+);
+CREATE INDEX IF NOT EXISTS journal_run ON journal(runId, action, itemKey);
+CREATE INDEX IF NOT EXISTS journal_status ON journal(status);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# journal.status
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+
+class SyncArchive:
+    """
+    Local record of the attachments synced to Dify, one row per itemKey in a SQLite file.
+    Every write is its own transaction, so each item is recorded as soon as its action
+    succeeds and a crash mid-run keeps everything done so far.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(self.path))
+        self.db.execute("PRAGMA journal_mode=WAL")
+        # durable enough for an archive: a power loss may lose the last commits, never corrupt
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(journal)")}
+        if "docId" not in columns:  # journal of an archive created before docId
+            with self.db:
+                self.db.execute("ALTER TABLE journal ADD COLUMN docId TEXT")
+
+    def close(self):
+        self.db.close()
+
+    @staticmethod
+    def to_row(att: Attachment, now: float) -> tuple:
+        return (
+            att.itemKey,
+            att.parentItem.key,
+            att.fileHash,
+            json.dumps(asdict(att), ensure_ascii=False),
+            now,
+        )
+
+    @staticmethod
+    def from_row(data: str, parents: Optional[dict] = None) -> Attachment:
+        # rows store their parent inline, `parents` interns equal ones while loading many
+        return Attachment.from_dict(json.loads(data), parents)
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT count(*) FROM attachments").fetchone()[0]
+
+    def __contains__(self, item_key: str) -> bool:
+        row = self.db.execute(
+            "SELECT 1 FROM attachments WHERE itemKey = ?", (item_key,)
+        ).fetchone()
+        return row is not None
+
+    def get(self, item_key: str) -> Optional[Attachment]:
+        row = self.db.execute(
+            "SELECT data FROM attachments WHERE itemKey = ?", (item_key,)
+        ).fetchone()
+        return self.from_row(row[0]) if row else None
+
+    def select_in(self, column: str, values: Iterable[str]) -> Dict[str, Attachment]:
+        # IN lists in chunks below SQLite's host parameter limit
+        res = {}
+        parents = {}
+        values = list(values)
+        for i in range(0, len(values), 500):
+            chunk = values[i : i + 500]
+            sql = f"SELECT data FROM attachments WHERE {column} IN ({','.join('?' * len(chunk))})"
+            for (data,) in self.db.execute(sql, chunk):
+                att = self.from_row(data, parents)
+                res[att.itemKey] = att
+        return res
+
+    def get_many(self, item_keys: Iterable[str]) -> Dict[str, Attachment]:
+        """
+        Keyed lookup of several attachments, missing keys are left out.
+        """
+        return self.select_in("itemKey", item_keys)
+
+    def get_by_parents(self, parent_keys: Iterable[str]) -> Dict[str, Attachment]:
+        """
+        All archived attachments of the given parent items (indexed on parentKey).
+        """
+        return self.select_in("parentKey", parent_keys)
+
+    def scan(
+        self, start: Optional[str] = None, end: Optional[str] = None
+    ) -> Iterator[Attachment]:
+        """
+        Attachments ordered by itemKey with start <= itemKey < end, either bound optional.
+        """
+        sql = "SELECT data FROM attachments WHERE itemKey >= ?"
+        params = [start or ""]
+        if end is not None:
+            sql += " AND itemKey < ?"
+            params.append(end)
+        parents = {}
+        for (data,) in self.db.execute(sql + " ORDER BY itemKey", params):
+            yield self.from_row(data, parents)
+
+    def keys(self) -> List[str]:
+        return [k for (k,) in self.db.execute("SELECT itemKey FROM attachments")]
+
+    def file_states(self) -> Iterator[Tuple[str, int, str, int, int]]:
+        """
+        (itemKey, parent itemID, relpath, fileSize, fileMtime) of the attachments archived
+        with a file state, read straight from the JSON rows without decoding them.
+        """
+        sql = """
+            SELECT itemKey, json_extract(data, '$.parentItem.itemID'),
+                   json_extract(data, '$.relpath'), json_extract(data, '$.fileSize'),
+                   json_extract(data, '$.fileMtime')
+            FROM attachments
+            WHERE fileHash IS NOT NULL AND json_extract(data, '$.relpath') IS NOT NULL
+        """
+        yield from self.db.execute(sql)
+
+    def items(self) -> Dict[str, Attachment]:
+        return {att.itemKey: att for att in self.scan()}
+
+    def put(self, att: Attachment):
+        self.put_many([att])
+
+    def put_many(
+        self, attachments: Iterable[Attachment], run_id: str = None, action: str = None
+    ):
+        """
+        Insert or replace archive rows. With run_id and action the matching journal
+        entries are marked done in the same transaction.
+        """
+        now = time.time()
+        attachments = list(attachments)
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO attachments (itemKey, parentKey, fileHash, data, updatedAt) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [self.to_row(att, now) for att in attachments],
+            )
+            if run_id:
+                self._mark(
+                    run_id, action, [a.itemKey for a in attachments], DONE, None, now
+                )
+
+    def delete(self, item_key: str):
+        self.delete_many([item_key])
+
+    def delete_many(
+        self, item_keys: Iterable[str], run_id: str = None, action: str = "delete"
+    ):
+        now = time.time()
+        item_keys = list(item_keys)
+        with self.db:
+            self.db.executemany(
+                "DELETE FROM attachments WHERE itemKey = ?", [(k,) for k in item_keys]
+            )
+            if run_id:
+                self._mark(run_id, action, item_keys, DONE, None, now)
+
+    def journal_begin(self, actions: Iterable[Tuple[str, Attachment]]) -> str:
+        """
+        Write the planned (action, attachment) pairs as pending before any of them runs.
+        Returns the run id used to mark them done or failed.
+        """
+        run_id = uuid.uuid4().hex
+        now = time.time()
+        with self.db:
+            self.db.executemany(
+                "INSERT INTO journal (runId, action, itemKey, data, status, updatedAt) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        run_id,
+                        action,
+                        att.itemKey,
+                        json.dumps(asdict(att), ensure_ascii=False),
+                        PENDING,
+                        now,
+                    )
+                    for action, att in actions
+                ],
+            )
+        return run_id
+
+    def journal_fail(self, run_id: str, action: str, item_key: str, error: str):
+        with self.db:
+            self._mark(run_id, action, [item_key], FAILED, error, time.time())
+
+    def journal_document(self, run_id: str, action: str, item_key: str, doc_id: str):
+        """
+        Record the Dify document created by a pending action as soon as it exists, so a
+        replay finds it even when the run stopped before tagging it with its itemKey.
+        updatedAt is left alone, it dates the plan, see journal_pending.
+        """
+        with self.db:
+            self.db.execute(
+                "UPDATE journal SET docId = ? WHERE runId = ? AND action = ? AND itemKey = ?",
+                (doc_id, run_id, action, item_key),
+            )
+
+    def _mark(self, run_id, action, item_keys, status, error, now):
+        self.db.executemany(
+            "UPDATE journal SET status = ?, error = ?, updatedAt = ? "
+            "WHERE runId = ? AND action = ? AND itemKey = ?",
+            [(status, error, now, run_id, action, k) for k in item_keys],
+        )
+
+    def journal_finish(self, run_id: str):
+        """
+        Drop the journal of a run that completed, failed items are picked up by the next diff.
+        """
+        with self.db:
+            self.db.execute("DELETE FROM journal WHERE runId = ?", (run_id,))
+
+    def journal_pending(self) -> List[Tuple[str, Attachment]]:
+        """
+        (action, attachment) pairs of interrupted runs that never completed, in planned order.
+        Entries whose archive row was written after they were planned are left out: a later
+        sync already brought that item up to date, replaying them would restore old values.
+        """
+        return [(action, att) for action, att, _ in self.journal_pending_documents()]
+
+    def journal_pending_documents(self) -> List[Tuple[str, Attachment, Optional[str]]]:
+        """
+        journal_pending with the Dify document id each entry created, None when none was
+        recorded with journal_document.
+        """
+        rows = self.db.execute(
+            "SELECT journal.action, journal.data, journal.docId FROM journal "
+            "LEFT JOIN attachments ON attachments.itemKey = journal.itemKey "
+            "WHERE journal.status = ? "
+            "AND (attachments.updatedAt IS NULL OR attachments.updatedAt <= journal.updatedAt) "
+            "ORDER BY journal.id",
+            (PENDING,),
+        )
+        return [(action, self.from_row(data), doc_id) for action, data, doc_id in rows]
+
+    def journal_clear(self):
+        with self.db:
+            self.db.execute("DELETE FROM journal")
+
+    def get_meta(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key: str, value: Optional[str]):
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value)
+            )
+
+    def replace_all(self, attachments: Iterable[Attachment]):
+        """
+        Replace the whole archive in one transaction.
+        """
+        now = time.time()
+        with self.db:
+            self.db.execute("DELETE FROM attachments")
+            self.db.executemany(
+                "INSERT OR REPLACE INTO attachments (itemKey, parentKey, fileHash, data, updatedAt) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [self.to_row(att, now) for att in attachments],
+            )
+
+    def migrate_json(self, json_path) -> int:
+        """
+        Import a legacy zdb_attachments.json archive, then rename it to *.json.migrated
+        so it is only imported once. Returns the number of imported attachments.
+        """
+        json_path = Path(json_path)
+        with open(json_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        parents = {}
+        self.put_many(Attachment.from_dict(a, parents) for a in data)
+        json_path.rename(json_path.with_name(json_path.name + ".migrated"))
+        logger.info(f"Migrated {len(data)} attachments from {json_path} to {self.path}")
+        return len(data)
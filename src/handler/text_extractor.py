@@ -0,0 +1,137 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from importlib.metadata import PackageNotFoundError, version
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from src.config import get_logger
+from src.handler.extraction_cache import ExtractionCache
+from src.utils.hashing import hash_file
+
+logger = get_logger()
+
+# content types converted locally, other attachments are still uploaded as files
+EXTRACTABLE_TYPES = frozenset(
+    {
+        "application/pdf",
+        "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+        "text/html",
+    }
+)
+
+_converter = None
+
+
+def docling_version() -> str:
+    # part of the cache key, without importing docling itself
+    try:
+        return version("docling")
+    except PackageNotFoundError:
+        return "unknown"
+
+
+def docling_to_markdown(path: str) -> str:
+    """
+    Markdown of a document converted by docling. The converter loads its models on
+    first use and is then reused by every file handled in the same process.
+    """
+    global _converter
+    if _converter is None:
+        # heavy import, only paid by the processes that convert something
+        from docling.document_converter import DocumentConverter
+
+        _converter = DocumentConverter()
+    return _converter.convert(path).document.export_to_markdown()
+
+
+class TextExtractor:
+    """
+    Converts attachment files to text in a pool of worker processes and keeps the text
+    in an ExtractionCache under the sha256 of the file, so a file is converted once
+    whatever item it belongs to and however often it is uploaded.
+    The pool is started on the first conversion and kept until close(), so the workers
+    load the docling models once per run rather than once per batch.
+
+        cache = ExtractionCache(PATH_DATA / "extraction_cache", "docling", docling_version())
+        with TextExtractor(cache, workers=4) as extractor:
+            texts = extractor.extract_many([(path, None)])
+    """
+
+    def __init__(
+        self,
+        cache: ExtractionCache,
+        workers: int = 0,
+        convert: Callable[[str], str] = docling_to_markdown,
+    ):
+        self.cache = cache
+        # 0 uses every core, conversion is CPU bound
+        self.workers = workers or os.cpu_count() or 1
+        # runs in the workers, must be a picklable module-level function
+        self.convert = convert
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def extract_many(
+        self, files: Iterable[Tuple[Path, Optional[str]]]
+    ) -> Dict[Path, str]:
+        """
+        Text of each (path, sha256) pair, the hash is computed when None.
+        Files already in the cache are read back, the others are converted in parallel.
+        Files that fail to convert are logged and left out of the result.
+        """
+        hashes = {Path(p): h or hash_file(p) for p, h in files}
+        texts, misses = {}, {}
+        for path, file_hash in hashes.items():
+            text = self.cache.get(file_hash)
+            if text is not None:
+                texts[path] = text
+            else:
+                # identical files under several items are converted once
+                misses.setdefault(file_hash, path)
+        if misses:
+            logger.info(
+                f"Extracting text of {len(misses)} files, {len(texts)} from cache"
+            )
+            converted = self.convert_all(misses)
+            for path, file_hash in hashes.items():
+                if path not in texts and file_hash in converted:
+                    texts[path] = converted[file_hash]
+        return texts
+
+    def convert_all(self, misses: Dict[str, Path]) -> Dict[str, str]:
+        converted = {}
+        if self.workers == 1 or len(misses) == 1:
+            # a pool costs more than it saves for a single file
+            for file_hash, path in misses.items():
+                self.store(converted, file_hash, path, self.convert, str(path))
+            return converted
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        futures = {
+            self._pool.submit(self.convert, str(path)): (file_hash, path)
+            for file_hash, path in misses.items()
+        }
+        for future in as_completed(futures):
+            file_hash, path = futures[future]
+            self.store(converted, file_hash, path, future.result)
+        return converted
+
+    def store(self, converted: dict, file_hash: str, path: Path, call, *args):
+        try:
+            text = call(*args)
+        except Exception as e:
+            logger.error(f"Failed to extract text of {path}: {e}")
+            return
+        self.cache.put(file_hash, text)
+        converted[file_hash] = text
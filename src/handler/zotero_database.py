@@ -1,23 +1,33 @@
 import shutil
 import json
-from dataclasses import asdict, dataclass
+import os
+import sys
+import time
+from dataclasses import asdict, dataclass, replace
 from pathlib import Path
-from sqlite3 import Connection, connect
-from typing import List, Tuple
+from sqlite3 import Connection, OperationalError, connect
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 from pprint import pprint
-from src.config import CONFIG, get_logger
+from src.config import get_logger, get_setting
+from src.handler.extraction_cache import ExtractionCache
+from src.utils.hashing import hash_file
+from src.utils.metrics import METRICS
 
 logger = get_logger()
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class ParentItem:
     itemID: int
     key: str
-    tags: List[str]
+    tags: Tuple[str, ...]  # lists are converted, tag names are interned
     title: str
     itemTypeID: int
 
+    def __post_init__(self):
+        # a library has few distinct tags repeated on many items
+        object.__setattr__(self, "tags", tuple(sys.intern(t) for t in self.tags))
+
     @staticmethod
     def from_dict(d):
         return ParentItem(
@@ -29,7 +39,7 @@ class ParentItem:
         )
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Attachment:
     itemID: int
     itemKey: str
@@ -37,30 +47,44 @@ class Attachment:
     relpath: str
     title: str
     parentItem: ParentItem
+    # state of the file when it was last synced, see with_file_state
+    fileSize: Optional[int] = None
+    fileMtime: Optional[int] = None  # st_mtime_ns
+    fileHash: Optional[str] = None  # sha256 of the content
 
     @staticmethod
-    def from_dict(d):
+    def from_dict(d, parents: Optional[Dict[ParentItem, ParentItem]] = None):
+        """
+        :param parents: interning table shared across calls, equal parents of several
+            attachments are then loaded as one ParentItem
+        """
+        parent = ParentItem.from_dict(d["parentItem"])
+        if parents is not None:
+            parent = parents.setdefault(parent, parent)
         return Attachment(
             itemID=d["itemID"],
             itemKey=d["itemKey"],
             contentType=d["contentType"],
             relpath=d["relpath"],
             title=d["title"],
-            parentItem=ParentItem.from_dict(d["parentItem"]),
+            parentItem=parent,
+            fileSize=d.get("fileSize"),
+            fileMtime=d.get("fileMtime"),
+            fileHash=d.get("fileHash"),
         )
 
     def to_dict(self):
-        return  {
-                "itemKey": self.itemKey,
-                "title": self.title,
-                "parentItemKey": self.parentItem.key,
-                "parentItemTitle": self.parentItem.title,
-                "parentItemTags": (
-                    ", ".join(self.parentItem.tags) if self.parentItem.tags else ""
-                ),
-                "parentItemType": str(self.parentItem.itemTypeID),
-                "relpath": self.relpath,
-            }
+        return {
+            "itemKey": self.itemKey,
+            "title": self.title,
+            "parentItemKey": self.parentItem.key,
+            "parentItemTitle": self.parentItem.title,
+            "parentItemTags": (
+                ", ".join(self.parentItem.tags) if self.parentItem.tags else ""
+            ),
+            "parentItemType": str(self.parentItem.itemTypeID),
+            "relpath": self.relpath,
+        }
 
     @property
     def abspath(self) -> Path:
@@ -69,7 +93,43 @@ class Attachment:
         """
         if self.relpath is None:
             return Path("")
-        return Path(CONFIG["zotero"]["data_dir"], self.relpath)
+        return Path(get_setting("zotero.data_dir"), self.relpath)
+
+    def with_file_state(self, previous: Optional["Attachment"] = None) -> "Attachment":
+        """
+        Copy of the attachment with size, mtime and content hash of its file on disk.
+        The hash of `previous` is reused when size and mtime are unchanged, so the
+        content is only read for new or modified files. Returned unchanged when
+        there is no local file.
+        """
+        if self.relpath is None or self.is_attachment_url:
+            return self
+        try:
+            stat = self.abspath.stat()
+        except OSError:
+            return self
+        if (
+            previous is not None
+            and previous.fileHash
+            and previous.fileSize == stat.st_size
+            and previous.fileMtime == stat.st_mtime_ns
+        ):
+            file_hash = previous.fileHash
+        else:
+            file_hash = hash_file(self.abspath)
+        return replace(
+            self,
+            fileSize=stat.st_size,
+            fileMtime=stat.st_mtime_ns,
+            fileHash=file_hash,
+        )
+
+    def cached_text(self, cache: ExtractionCache) -> Optional[str]:
+        """
+        Text extracted earlier from this attachment's file, None when it was never
+        extracted by the cache's extractor version or the file state is unknown.
+        """
+        return cache.get(self.fileHash) if self.fileHash else None
 
     @property
     def is_attachment_url(self) -> bool:
@@ -81,63 +141,321 @@ class Attachment:
         return self.relpath is None
 
 
+@dataclass(frozen=True)
+class ZoteroDelta:
+    """
+    Changes of the Zotero database since a high-water mark, see ZoteroConn.get_delta.
+    """
+
+    mark: Dict[str, Any]  # high-water mark of this snapshot, `since` of the next delta
+    # itemID -> key of the items modified, trashed or restored, directly or through an attachment
+    parents: Dict[int, str]
+    erased_keys: List[str]  # items erased from the database, parents or attachments
+
+
+SNAPSHOT_MODES = ("backup", "copy", "readonly")
+# prepared statements kept per connection, every query below is parameterized so
+# repeated per-item lookups reuse one compiled statement
+STATEMENT_CACHE_SIZE = 256
+# syncDeleteLog.syncObjectTypeID of items
+SYNC_OBJECT_ITEM = 3
+
+
 class ZoteroConn:
     """
-    Zotero database handler. Copies the database once on initialization and provides query methods.
+    Zotero database handler. Snapshots the database once on initialization and provides query methods.
+
+    snapshot_mode:
+        backup   -- SQLite online backup API into the .bak file, skipped when the live database is unchanged
+        copy     -- plain file copy of zotero.sqlite on every run (legacy behaviour)
+        readonly -- no snapshot, the live database is opened read-only
     """
 
-    def __init__(self, zotero_dir: str = None):
+    def __init__(self, zotero_dir: str = None, snapshot_mode: str = "backup"):
+        if snapshot_mode not in SNAPSHOT_MODES:
+            raise ValueError(
+                f"Unknown snapshot mode: {snapshot_mode}, expected one of {SNAPSHOT_MODES}"
+            )
         self.data_dir = Path(zotero_dir)
         self.src = self.data_dir / "zotero.sqlite"
         self.dest = self.data_dir / "zotero.wrap.sqlite.bak"
+        self.state_path = self.data_dir / "zotero.wrap.sqlite.json"
+        self.snapshot_mode = snapshot_mode
+        self.snapshot_seconds: float = 0.0
+        self.snapshot_fingerprint: Optional[Dict[str, Any]] = None
         self.copy_db()
         self.db = self.create_conn()
 
-    def copy_db(self):
+    def fingerprint(self) -> Dict[str, Any]:
         """
-        Copy the Zotero database to a backup file for safe read access.
+        Cheap change fingerprint of the live database, no table is read.
+        PRAGMA data_version is only comparable within a single connection, so the file
+        change counter in the database header (its persistent counterpart) is used instead.
+        In WAL mode the header is not bumped on commit, hence the -wal sidecar stat.
         """
-        shutil.copy(self.src, self.dest)
-        assert self.dest.exists(), f"Backup Zotero database not found: {self.dest}"
+        stat = self.src.stat()
+        wal = Path(f"{self.src}-wal")
+        wal_stat = wal.stat() if wal.exists() else None
+        with open(self.src, "rb") as f:
+            f.seek(24)
+            change_counter = int.from_bytes(f.read(4), "big")
+        return {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "wal_mtime_ns": wal_stat.st_mtime_ns if wal_stat else None,
+            "wal_size": wal_stat.st_size if wal_stat else None,
+            "change_counter": change_counter,
+        }
+
+    def load_snapshot_state(self) -> Optional[Dict[str, Any]]:
+        """
+        Load the fingerprint recorded by the last snapshot, None if there is none.
+        """
+        if not self.state_path.exists():
+            return None
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable snapshot state {self.state_path}: {e}")
+            return None
+
+    def save_snapshot_state(self, fingerprint: Dict[str, Any]):
+        with open(self.state_path, "w", encoding="utf-8") as f:
+            json.dump(fingerprint, f)
+
+    def source_uri(self, immutable: bool = False) -> str:
+        """
+        Read-only URI of the live database. immutable=1 skips all locking, which is needed
+        while Zotero holds its exclusive lock, but it also ignores the -wal file.
+        """
+        uri = f"{self.src.resolve().as_uri()}?mode=ro"
+        return f"{uri}&immutable=1" if immutable else uri
+
+    def connect_source(self) -> Connection:
+        """
+        Open the live database read-only, WAL-aware when possible.
+        Falls back to immutable mode when the database is locked by a running Zotero.
+        """
+        conn = connect(
+            self.source_uri(), uri=True, cached_statements=STATEMENT_CACHE_SIZE
+        )
+        try:
+            conn.execute("SELECT count(*) FROM sqlite_master").fetchone()
+            return conn
+        except OperationalError as e:
+            conn.close()
+            wal = Path(f"{self.src}-wal")
+            if wal.exists() and wal.stat().st_size > 0:
+                logger.warning(
+                    f"{self.src} is locked ({e}) and has a non-empty WAL, "
+                    "uncheckpointed changes are not visible in immutable mode"
+                )
+            return connect(
+                self.source_uri(immutable=True),
+                uri=True,
+                cached_statements=STATEMENT_CACHE_SIZE,
+            )
+
+    def backup_db(self):
+        """
+        Snapshot the live database with the SQLite online backup API.
+        Written to a temporary file first so a failed backup never leaves a torn .bak behind.
+        """
+        tmp = self.dest.with_name(self.dest.name + ".tmp")
+        source = self.connect_source()
+        try:
+            target = connect(str(tmp))
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+        finally:
+            source.close()
+        os.replace(tmp, self.dest)
+
+    @METRICS.timed("zotero.snapshot")
+    def copy_db(self) -> float:
+        """
+        Snapshot the Zotero database for safe read access according to snapshot_mode.
+        Returns how long the snapshot took in seconds (also kept in self.snapshot_seconds).
+        """
+        start = time.perf_counter()
+        # taken before the snapshot: a change during the copy makes the next check differ
+        fingerprint = self.fingerprint()
+        if self.snapshot_mode == "readonly":
+            status = "skipped, reading the live database"
+        elif self.snapshot_mode == "copy":
+            shutil.copy(self.src, self.dest)
+            status = "copied"
+        else:
+            if self.dest.exists() and self.load_snapshot_state() == fingerprint:
+                status = "unchanged, reusing the last snapshot"
+            else:
+                self.backup_db()
+                self.save_snapshot_state(fingerprint)
+                status = "backed up"
+        if self.snapshot_mode != "readonly":
+            assert self.dest.exists(), f"Backup Zotero database not found: {self.dest}"
+        self.snapshot_fingerprint = fingerprint
+        self.snapshot_seconds = time.perf_counter() - start
+        logger.info(
+            f"Zotero snapshot ({self.snapshot_mode}) {status} in {self.snapshot_seconds:.3f}s"
+        )
+        return self.snapshot_seconds
 
     def create_conn(self) -> Connection:
         """
-        Create a connection to the backup Zotero database.
+        Create a connection to the backup Zotero database, or to the live one in readonly mode.
         """
+        if self.snapshot_mode == "readonly":
+            return self.connect_source()
         assert self.dest.exists(), f"Backup Zotero database not found: {self.dest}"
-        return connect(str(self.dest))
+        return connect(str(self.dest), cached_statements=STATEMENT_CACHE_SIZE)
+
+    def refresh(self):
+        """
+        Re-snapshot the database and reconnect, for long-running callers like watch mode.
+        In backup mode an unchanged database keeps its snapshot.
+        """
+        self.db.close()
+        self.copy_db()
+        self.db = self.create_conn()
+
+    def get_high_water_mark(self) -> Dict[str, Any]:
+        """
+        Position of this snapshot in the change history, the `since` of the next get_delta.
+        clientDateModified is bumped by Zotero on every local edit (tags included), version
+        by zotero.org syncs, dateDeleted marks trashing and erasing. The snapshot fingerprint
+        lets an unchanged database skip the delta queries altogether.
+        """
+        sql = """
+            WITH dates AS (
+                SELECT max(clientDateModified) AS d, max(version) AS v FROM items
+                UNION ALL SELECT max(dateDeleted), NULL FROM deletedItems
+                UNION ALL SELECT max(dateDeleted), NULL FROM syncDeleteLog
+            )
+            SELECT max(d), max(v) FROM dates
+        """
+        values = self.exec_fetchall(sql)
+        date, version = values[0] if values else (None, None)
+        return {
+            "clientDateModified": date,
+            "version": version or 0,
+            "fingerprint": self.snapshot_fingerprint,
+        }
+
+    def get_modified_parents(self, since: Dict[str, Any]) -> Dict[int, str]:
+        """
+        itemID -> key of the items modified or trashed since the `since` mark, either
+        directly or through one of their attachments.
+        The date bound is inclusive because clientDateModified has one second resolution.
+        """
+        sql = """
+            WITH changed AS (
+                SELECT itemID FROM items
+                WHERE clientDateModified >= :date OR version > :version
+                UNION
+                SELECT itemID FROM deletedItems WHERE dateDeleted >= :date
+            )
+            SELECT items.itemID, items.key FROM changed
+            JOIN items ON items.itemID = changed.itemID
+            WHERE changed.itemID NOT IN (SELECT itemID FROM itemAttachments)
+            UNION
+            SELECT parent.itemID, parent.key FROM changed
+            JOIN itemAttachments ON itemAttachments.itemID = changed.itemID
+            JOIN items AS parent ON parent.itemID = itemAttachments.parentItemID
+        """
+        params = {"date": since["clientDateModified"], "version": since["version"]}
+        return dict(self.exec_fetchall(sql, params))
+
+    def get_erased_keys(self, since: Dict[str, Any]) -> List[str]:
+        """
+        Keys of the items erased from the database (emptied trash) since the `since` mark,
+        from Zotero's syncDeleteLog tombstones.
+        """
+        sql = """
+            SELECT key FROM syncDeleteLog
+            WHERE syncObjectTypeID = ? AND dateDeleted >= ?
+        """
+        return [
+            key
+            for (key,) in self.exec_fetchall(
+                sql, (SYNC_OBJECT_ITEM, since["clientDateModified"])
+            )
+        ]
 
-    def exec_fetchall(self, sql: str) -> List[Tuple]:
+    @METRICS.timed("zotero.delta")
+    def get_delta(self, since: Dict[str, Any]) -> ZoteroDelta:
+        """
+        Everything that changed since a mark returned by get_high_water_mark.
+        Only the changed slice is returned, load its attachments with
+        get_parent_items_with_attachments(parent_ids=delta.parents).
+        """
+        if (
+            since.get("fingerprint")
+            and since["fingerprint"] == self.snapshot_fingerprint
+        ):
+            return ZoteroDelta(mark=since, parents={}, erased_keys=[])
+        return ZoteroDelta(
+            mark=self.get_high_water_mark(),
+            parents=self.get_modified_parents(since),
+            erased_keys=self.get_erased_keys(since),
+        )
+
+    def exec_fetchall(self, sql: str, params: Tuple = ()) -> List[Tuple]:
         """
         Execute a SQL query and return all results. Returns an empty list on error.
         """
         try:
             with self.db as conn:
                 cursor = conn.cursor()
-                cursor.execute(sql)
+                cursor.execute(sql, params)
                 values = cursor.fetchall()
                 return values
         except Exception as e:
             logger.error(f"Error executing query: {e}")
             return []
 
+    def exec_fetchmany(
+        self, sql: str, params: Tuple = (), batch_size: int = 500
+    ) -> Iterator[List[Tuple]]:
+        """
+        Execute a SQL query and yield its rows in lists of up to batch_size.
+        Unlike exec_fetchall errors are logged and raised.
+        """
+        cursor = self.db.cursor()
+        try:
+            cursor.execute(sql, params)
+            while rows := cursor.fetchmany(batch_size):
+                yield rows
+        except Exception as e:
+            logger.error(f"Error executing query: {e}")
+            raise
+        finally:
+            cursor.close()
+
     def get_parent_items_with_special_tag(
         self, tag_pattern: str = "#%/%"
     ) -> List[ParentItem]:
         """
         Get all parent items with tags matching the given pattern (e.g., #x/xxx).
         Returns a list of ParentItem objects, each with all matching tags.
-        由于item 和 tag 一对多的关系， 所以需要使用FULL OUTER JOIN 来获取所有数据
+        matching tagIDs are resolved first, then itemTags is joined on its tagID index
         选取item时过滤掉itemTypeID为1和2的item， annotation = 1, attachment = 2
         """
-        sql = f"""
-            SELECT items.itemID, tags.name, items.key, items.itemTypeID
-            FROM items
-            FULL OUTER JOIN itemTags ON items.itemID = itemTags.itemID
-            FULL OUTER JOIN tags ON itemTags.tagID = tags.tagID
-            WHERE tags.name LIKE '{tag_pattern}%' AND items.itemTypeID NOT IN (1,2)
+        sql = """
+            WITH matching_tags AS MATERIALIZED (
+                SELECT tagID, name FROM tags WHERE name LIKE ?
+            )
+            SELECT items.itemID, matching_tags.name, items.key, items.itemTypeID
+            FROM matching_tags
+            CROSS JOIN itemTags ON itemTags.tagID = matching_tags.tagID
+            JOIN items ON items.itemID = itemTags.itemID
+            WHERE items.itemTypeID NOT IN (1,2)
+              AND items.itemID NOT IN (SELECT itemID FROM deletedItems)
         """
-        values = self.exec_fetchall(sql)
+        values = self.exec_fetchall(sql, (f"{tag_pattern}%",))
         # Merge all tags for each item
         item_map = {}
         for itemID, tag, itemKey, itemTypeID in values:
@@ -165,20 +483,223 @@ class ZoteroConn:
 
         for more fieldID, see https://github.com/sailist/pyzotero-local/blob/master/pyzolocal/beans/enum.py
         """
-        sql = f"""
-        WITH item_fields AS (
-            SELECT itemDataValues.value
-            FROM itemData
-            JOIN itemDataValues ON itemData.valueID = itemDataValues.valueID
-            WHERE itemID = {itemID} AND fieldID = {fieldID}
-        )
-        SELECT value FROM item_fields
+        sql = """
+        SELECT itemDataValues.value
+        FROM itemData
+        JOIN itemDataValues ON itemData.valueID = itemDataValues.valueID
+        WHERE itemData.itemID = ? AND itemData.fieldID = ?
         """
-        values = self.exec_fetchall(sql)
+        values = self.exec_fetchall(sql, (itemID, fieldID))
         if len(values) == 0:
             return None
         return values[0][0]
 
+    @staticmethod
+    def attachment_relpath(key: str, path: Optional[str]) -> Optional[str]:
+        """
+        Relative path of a stored attachment under the Zotero data dir, None for URL attachments.
+        """
+        if path is None:
+            return None
+        # os.path.join rather than pathlib: this runs once per attachment in bulk loads
+        return os.path.join("storage", key, path.replace("storage:", ""))
+
+    @staticmethod
+    def tagged_items_sql(
+        parent_ids: Optional[Iterable[int]] = None,
+    ) -> Tuple[str, Tuple]:
+        """
+        WITH clause of the tag filter: matching_tags (tagID, name) and tagged (itemID) of the
+        non-trashed items carrying them. Parameters: the LIKE pattern, then the returned ones.
+        """
+        # CROSS JOIN pins the join order: the matching tagIDs (or the requested parents)
+        # drive, itemTags is then searched on its tagID (or itemID) index
+        source = """matching_tags
+                CROSS JOIN itemTags ON itemTags.tagID = matching_tags.tagID"""
+        id_params = ()
+        if parent_ids is not None:
+            # one JSON parameter instead of an IN list, no host parameter limit
+            source = """json_each(?) AS ids
+                CROSS JOIN itemTags ON itemTags.itemID = ids.value
+                JOIN matching_tags ON matching_tags.tagID = itemTags.tagID"""
+            id_params = (json.dumps(list(parent_ids)),)
+        tagged = f"""
+            WITH matching_tags AS MATERIALIZED (
+                SELECT tagID, name FROM tags WHERE name LIKE ?
+            ),
+            tagged AS (
+                SELECT DISTINCT itemTags.itemID
+                FROM {source}
+                JOIN items ON items.itemID = itemTags.itemID
+                WHERE items.itemTypeID NOT IN (1,2)
+                  AND items.itemID NOT IN (SELECT itemID FROM deletedItems)
+            )
+        """
+        return tagged, id_params
+
+    @METRICS.timed("zotero.query")
+    def get_parent_items_with_attachments(
+        self,
+        tag_pattern: str = "#%/%",
+        fieldID: int = 1,
+        parent_ids: Optional[Iterable[int]] = None,
+    ) -> List[Tuple[ParentItem, List[Attachment]]]:
+        """
+        Bulk counterpart of get_parent_items_with_special_tag + get_attachments_by_parent_item.
+        Returns (ParentItem, [Attachment]) pairs for every item with a tag matching the pattern,
+        loaded with two set-based queries instead of one query per parent and per attachment.
+        parent_ids restricts the result to those items, e.g. the ones modified since a sync.
+        Items and attachments in the trash (deletedItems) are left out.
+        """
+        tagged, id_params = self.tagged_items_sql(parent_ids)
+        sql_parents = f"""
+            {tagged}
+            SELECT items.itemID, matching_tags.name, items.key, items.itemTypeID,
+                   itemDataValues.value
+            FROM tagged
+            JOIN items ON items.itemID = tagged.itemID
+            CROSS JOIN itemTags ON itemTags.itemID = tagged.itemID
+            JOIN matching_tags ON matching_tags.tagID = itemTags.tagID
+            LEFT JOIN itemData ON itemData.itemID = tagged.itemID AND itemData.fieldID = ?
+            LEFT JOIN itemDataValues ON itemDataValues.valueID = itemData.valueID
+        """
+        sql_attachments = f"""
+            {tagged}
+            SELECT itemAttachments.parentItemID, itemAttachments.itemID, items.key,
+                   itemAttachments.contentType, itemAttachments.path, itemDataValues.value
+            FROM tagged
+            JOIN itemAttachments ON itemAttachments.parentItemID = tagged.itemID
+                AND itemAttachments.itemID NOT IN (SELECT itemID FROM deletedItems)
+            LEFT JOIN items ON items.itemID = itemAttachments.itemID
+            LEFT JOIN itemData ON itemData.itemID = itemAttachments.itemID AND itemData.fieldID = ?
+            LEFT JOIN itemDataValues ON itemDataValues.valueID = itemData.valueID
+        """
+        like = f"{tag_pattern}%"
+        item_map = {}
+        for itemID, tag, itemKey, itemTypeID, title in self.exec_fetchall(
+            sql_parents, (like, *id_params, fieldID)
+        ):
+            if itemID not in item_map:
+                item_map[itemID] = {
+                    "key": itemKey,
+                    "tags": [],
+                    "type": itemTypeID,
+                    "title": title,
+                }
+            item_map[itemID]["tags"].append(tag)
+        parents = {
+            itemID: ParentItem(
+                itemID=itemID,
+                key=info["key"],
+                tags=info["tags"],
+                title=info["title"],
+                itemTypeID=info["type"],
+            )
+            for itemID, info in item_map.items()
+        }
+        children = {itemID: [] for itemID in parents}
+        for parentID, itemID, key, contentType, path, title in self.exec_fetchall(
+            sql_attachments, (like, *id_params, fieldID)
+        ):
+            children[parentID].append(
+                Attachment(
+                    itemID=itemID,
+                    itemKey=key,
+                    contentType=contentType,
+                    relpath=self.attachment_relpath(key, path),
+                    title=title,
+                    parentItem=parents[parentID],
+                )
+            )
+        return [(parents[itemID], children[itemID]) for itemID in parents]
+
+    def iter_attachment_batches(
+        self,
+        tag_pattern: str = "#%/%",
+        fieldID: int = 1,
+        parent_ids: Optional[Iterable[int]] = None,
+        batch_size: int = 500,
+    ) -> Iterator[List[Attachment]]:
+        """
+        Streaming counterpart of get_parent_items_with_attachments: one query whose rows
+        carry the parent with its aggregated tags, read with fetchmany and yielded as
+        batches of Attachments, so nothing is materialized beyond the current batch.
+        Parents without attachments are not part of the stream. Query errors are raised,
+        a silently truncated stream would look like deleted attachments to a sync.
+        """
+        tagged, id_params = self.tagged_items_sql(parent_ids)
+        sql = f"""
+            {tagged},
+            parent_tags AS (
+                SELECT tagged.itemID, group_concat(matching_tags.name, char(31)) AS tags
+                FROM tagged
+                CROSS JOIN itemTags ON itemTags.itemID = tagged.itemID
+                JOIN matching_tags ON matching_tags.tagID = itemTags.tagID
+                GROUP BY tagged.itemID
+            )
+            SELECT parent.itemID, parent.key, parent.itemTypeID, parent_tags.tags,
+                   parentTitle.value, itemAttachments.itemID, items.key,
+                   itemAttachments.contentType, itemAttachments.path, title.value
+            FROM parent_tags
+            JOIN items AS parent ON parent.itemID = parent_tags.itemID
+            LEFT JOIN itemData AS parentData
+                ON parentData.itemID = parent.itemID AND parentData.fieldID = ?
+            LEFT JOIN itemDataValues AS parentTitle ON parentTitle.valueID = parentData.valueID
+            CROSS JOIN itemAttachments ON itemAttachments.parentItemID = parent_tags.itemID
+                AND itemAttachments.itemID NOT IN (SELECT itemID FROM deletedItems)
+            LEFT JOIN items ON items.itemID = itemAttachments.itemID
+            LEFT JOIN itemData ON itemData.itemID = itemAttachments.itemID AND itemData.fieldID = ?
+            LEFT JOIN itemDataValues AS title ON title.valueID = itemData.valueID
+            ORDER BY parent.itemID, itemAttachments.itemID
+        """
+        params = (f"{tag_pattern}%", *id_params, fieldID, fieldID)
+        parent = None
+        for rows in self.exec_fetchmany(sql, params, batch_size):
+            batch = []
+            for (
+                parentID,
+                parentKey,
+                itemTypeID,
+                tags,
+                parentTitle,
+                itemID,
+                key,
+                contentType,
+                path,
+                title,
+            ) in rows:
+                # rows are ordered by parent, one ParentItem is shared by its attachments
+                if parent is None or parent.itemID != parentID:
+                    parent = ParentItem(
+                        itemID=parentID,
+                        key=parentKey,
+                        tags=tags.split("\x1f"),
+                        title=parentTitle,
+                        itemTypeID=itemTypeID,
+                    )
+                batch.append(
+                    Attachment(
+                        itemID=itemID,
+                        itemKey=key,
+                        contentType=contentType,
+                        relpath=self.attachment_relpath(key, path),
+                        title=title,
+                        parentItem=parent,
+                    )
+                )
+            yield batch
+
+    def iter_attachments(
+        self, tag_pattern: str = "#%/%", batch_size: int = 500, **kwargs
+    ) -> Iterator[Attachment]:
+        """
+        Attachments of iter_attachment_batches one by one.
+        """
+        for batch in self.iter_attachment_batches(
+            tag_pattern, batch_size=batch_size, **kwargs
+        ):
+            yield from batch
+
     def get_attachments_by_parent_item(
         self, parent_item: ParentItem
     ) -> List[Attachment]:
@@ -187,20 +708,17 @@ class ZoteroConn:
         Returns a list of Attachment objects.
         attachment 的itemTypeID 是3
         """
-        sql = f"""
+        sql = """
         SELECT itemAttachments.itemID, items.key, itemAttachments.contentType, itemAttachments.path
         FROM itemAttachments
         LEFT JOIN items ON itemAttachments.itemID = items.itemID
-        WHERE itemAttachments.parentItemID = {parent_item.itemID}
+        WHERE itemAttachments.parentItemID = ?
+          AND itemAttachments.itemID NOT IN (SELECT itemID FROM deletedItems)
         """
-        attachment_values = self.exec_fetchall(sql)
+        attachment_values = self.exec_fetchall(sql, (parent_item.itemID,))
         res = []
         for itemID, key, contentType, path in attachment_values:
-            if path is not None:
-                relpath = str(Path("storage") / key / path.replace("storage:", ""))
-            else:
-                relpath = None
-
+            relpath = self.attachment_relpath(key, path)
             title = self.get_itemfield_by_itemid(itemID, 1)
             res.append(
                 Attachment(
@@ -219,12 +737,10 @@ def main():
     """
     Example usage: Get all parent items with special tags and their attachments.
     """
-    conn = ZoteroConn(CONFIG["zotero"]["data_dir"])
+    conn = ZoteroConn(get_setting("zotero.data_dir"))
     tag_pattern = "#%/%"
-    parent_items = conn.get_parent_items_with_special_tag(tag_pattern)
     attachments = []
-    for parent_item in parent_items:
-        atts = conn.get_attachments_by_parent_item(parent_item)
+    for _, atts in conn.get_parent_items_with_attachments(tag_pattern):
         attachments.extend(atts)
 
     pprint(attachments)
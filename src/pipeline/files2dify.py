@@ -1,8 +1,13 @@
-from typing import Dict, Any
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Any, Iterator, Optional
 from dataclasses import dataclass, field
 
 from src.handler.dify_knowledge_base import DifyKnowledgeBase
-from src.config import get_logger
+from src.config import get_logger, setting
+from src.utils.hashing import hash_file
+from src.utils.metrics import METRICS
 
 logger = get_logger()
 
@@ -19,8 +24,42 @@ class PipelineConfig:
             "parentItemTags": "string",
             "contentType": "string",
             "relpath": "string",
+            "fileSize": "number",
+            "modifiedTime": "time",
         }
     )
+    workers: int = 8  # files hashed and uploaded in parallel
+    # passes over the failed files after the first one, each after a doubling delay
+    retry_rounds: int = 2
+    retry_delay: float = 5.0  # seconds before the first retry pass
+    # phase timings and request metrics written under PATH_LOG after each batch, see METRICS
+    metrics: bool = setting("metrics.enabled", False)
+
+
+def iter_files(root, pattern: str = "**/*") -> Iterator[Path]:
+    """
+    Files under root matching the glob pattern, in a stable order.
+    """
+    return (p for p in sorted(Path(root).glob(pattern)) if p.is_file())
+
+
+def file_metadata(path, file_hash: str, root=None) -> dict:
+    """
+    Per-file metadata from the path and its stat. The content hash is the itemKey, so a
+    file already in the dataset is recognised under any name or location.
+    """
+    path = Path(path)
+    stat = path.stat()
+    relpath = path.relative_to(root) if root is not None else path
+    return {
+        "itemKey": file_hash,
+        "title": path.stem,
+        "parentItemTitle": path.parent.name,
+        "contentType": path.suffix.lstrip(".").lower(),
+        "relpath": relpath.as_posix(),
+        "fileSize": stat.st_size,
+        "modifiedTime": int(stat.st_mtime),
+    }
 
 
 class Pipeline:
@@ -31,10 +70,13 @@ class Pipeline:
 
     def __init__(self, pipe_config: PipelineConfig = None):
         self.config = pipe_config
+        if self.config.metrics:
+            METRICS.enable()
         self.dify_kb = DifyKnowledgeBase(dataset_name=self.config.kb_name)
         self.dataset_id: str = self.dify_kb.dataset_id
         self.document_id_dict: Dict[str, Any] = self.dify_kb.documents
         self.metadata_id_dict: Dict[str, Any] = self.dify_kb.metadata
+        self.failed: Dict[str, str] = {}  # file path -> error, after every retry pass
 
     # def update_all(self):
     #     """
@@ -57,9 +99,17 @@ class Pipeline:
         if not self.dataset_id:
             logger.error("Dataset ID is not set. Cannot upload file.")
             return None
-        res = self.dify_kb.upload_document_by_file(self.dataset_id, file_path)
-        document_id = res["document"]["id"]
-        # Prepare metadata update list
+        document_id = self.dify_kb.upload_document_by_file(self.dataset_id, file_path)
+        return {
+            "upload": Path(file_path).name,
+            "document_id": document_id,
+            "update_metadata": self.update_metadata(document_id, metadata_input),
+        }
+
+    def update_metadata(self, document_id: str, metadata_input: dict):
+        """
+        Set the metadata of an uploaded document, fields unknown to the KB are skipped.
+        """
         metadata_vlist = []
         for item in metadata_input:
             if item in self.metadata_id_dict:
@@ -74,26 +124,137 @@ class Pipeline:
                 logger.warning(
                     f"Metadata field '{item}' not found in Dify KB, skipping."
                 )
-        update_res = self.dify_kb.update_document_metadata(
+        return self.dify_kb.update_document_metadata(
             self.dataset_id, document_id, metadata_vlist
         )
-        return {"upload": res["document"]["name"], "update_metadata": update_res}
 
-    def upload_batchfile(self, file_path_list: list, metadata_input: dict):
+    def ensure_metadata_fields_exist(self):
+        for name, type in self.config.metadata_fields.items():
+            if name not in self.metadata_id_dict:
+                logger.info(
+                    f"Metadata field '{name}' not found in Dify KB, creating..."
+                )
+                res = self.dify_kb.create_metadata(self.dataset_id, name, type)
+                if "id" in res:
+                    self.metadata_id_dict[name] = res["id"]
+
+    @METRICS.run("files2dify")
+    def upload_dir(self, root, pattern: str = "**/*") -> list:
+        """
+        Upload every file under root matching the glob pattern, see upload_batchfile.
         """
-        Upload a batch of files and update their metadata.
+        if not self.dataset_id:
+            logger.error("Dataset ID is not set. Cannot upload files.")
+            return []
+        return self.upload_batchfile(list(iter_files(root, pattern)), root=root)
+
+    @METRICS.run("files2dify")
+    def upload_batchfile(
+        self, file_path_list: list, metadata_input: dict = None, root=None
+    ):
+        """
+        Upload a batch of files on config.workers threads and update their metadata.
+        Files are hashed first: a file whose content is already in the dataset, or
+        earlier in the batch, is skipped, so an interrupted import resumes where it
+        stopped. A failed file does not stop the batch, it is queued and retried after
+        the others, up to config.retry_rounds more times.
         Args:
             file_path_list (list): List of local file paths
-            metadata_input (dict): Metadata to update for each file
+            metadata_input (dict): Extra metadata for each file, the per-file values win
+            root: Directory the relpath metadata is relative to
         Returns:
-            list: Results for each file
+            list: Results of the uploaded files, failures are left in self.failed
         """
         if not self.dataset_id:
             logger.error("Dataset ID is not set. Cannot upload files.")
             return []
-        results = []
-        for file_path in file_path_list:
-            result = self.upload_onefile(file_path, metadata_input)
-            logger.info(result)
-            results.append(result)
+        self.ensure_metadata_fields_exist()
+        self.failed = {}
+        with ThreadPoolExecutor(self.config.workers) as pool:
+            with METRICS.phase("files.hash"):
+                hashes = dict(
+                    zip(file_path_list, pool.map(self.try_hash, file_path_list))
+                )
+            queue, seen = [], set()
+            for file_path, file_hash in hashes.items():
+                if file_hash is None or file_hash in seen:
+                    continue
+                seen.add(file_hash)
+                if file_hash in self.document_id_dict:
+                    logger.debug(f"Skip {file_path}, already uploaded")
+                    self.count("skipped")
+                    continue
+                metadata = file_metadata(file_path, file_hash, root)
+                queue.append((file_path, {**(metadata_input or {}), **metadata}))
+            logger.info(
+                f"Uploading {len(queue)} of {len(file_path_list)} files, "
+                f"{len(seen) - len(queue)} already uploaded"
+            )
+            results = self.upload_queue(pool, queue)
+        for file_path, error in self.failed.items():
+            logger.error(f"Failed to upload {file_path}: {error}")
+        self.count("failure", len(self.failed))
+        return [results[p] for p in file_path_list if p in results]
+
+    @METRICS.timed("dify.upload")
+    def upload_queue(self, pool: ThreadPoolExecutor, queue: list) -> dict:
+        """
+        Upload (file_path, metadata) jobs on the pool, then retry the failed ones in up
+        to config.retry_rounds more passes. Returns the results by file path.
+        """
+        results = {}
+        for attempt in range(self.config.retry_rounds + 1):
+            if attempt:
+                time.sleep(self.config.retry_delay * 2 ** (attempt - 1))
+                logger.info(f"Retrying {len(queue)} failed files, pass {attempt}")
+            outcomes = pool.map(lambda job: self.try_upload(*job), queue)
+            retry = []
+            for job, outcome in zip(queue, outcomes):
+                if isinstance(outcome, Exception):
+                    self.failed[str(job[0])] = str(outcome)
+                    retry.append(job)
+                else:
+                    self.failed.pop(str(job[0]), None)
+                    results[job[0]] = outcome
+                    self.count("success")
+            queue = retry
+            if not queue:
+                break
         return results
+
+    @staticmethod
+    def count(result: str, n: int = 1):
+        METRICS.inc(
+            "sync_actions", n, pipeline="files2dify", action="upload", result=result
+        )
+
+    def try_hash(self, file_path) -> Optional[str]:
+        try:
+            return hash_file(file_path)
+        except OSError as e:
+            self.failed[str(file_path)] = str(e)
+            return None
+
+    def try_upload(self, file_path, metadata_input: dict):
+        """
+        Upload the file and set its metadata. The document id is recorded as soon as
+        the upload returns, so a retry pass after a failed metadata update only repeats
+        that step instead of creating a second document.
+        """
+        item_key = metadata_input["itemKey"]
+        try:
+            document_id = self.document_id_dict.get(item_key)
+            if document_id is None:
+                document_id = self.dify_kb.upload_document_by_file(
+                    self.dataset_id, str(file_path)
+                )
+                self.document_id_dict[item_key] = document_id
+                logger.info(f"Uploaded {file_path} to Dify with doc_id: {document_id}")
+            update_res = self.update_metadata(document_id, metadata_input)
+        except Exception as e:
+            return e
+        return {
+            "upload": Path(file_path).name,
+            "document_id": document_id,
+            "update_metadata": update_res,
+        }
@@ -0,0 +1,116 @@
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from src.config import get_logger, setting
+from src.pipeline.zdb2dify import Pipeline
+
+logger = get_logger()
+
+
+@dataclass
+class WatchConfig:
+    # seconds between checks of the database fingerprint
+    poll_interval: float = setting("zotero.watch.poll_interval", 2.0)
+    # quiet period after the last change before a sync, bursts of edits become one sync
+    debounce: float = setting("zotero.watch.debounce", 5.0)
+    # longest a change waits while edits keep coming in
+    max_delay: float = setting("zotero.watch.max_delay", 60.0)
+    # periodic full rescan as a safety net for changes the delta misses, <= 0 disables
+    full_sync_interval: float = setting("zotero.watch.full_sync_interval", 3600.0)
+
+
+class ZoteroWatcher:
+    """
+    Long-running sync driven by changes of the Zotero database.
+    Polls ZoteroConn.fingerprint (a stat and a 4 byte header read, no query), debounces
+    bursts of changes and then syncs only the items modified since the last sync.
+
+        ZoteroWatcher(Pipeline(PipeConfig())).run()
+    """
+
+    def __init__(
+        self,
+        pipeline: Pipeline,
+        watch_config: WatchConfig = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.pipeline = pipeline
+        self.config = watch_config or WatchConfig()
+        self.clock = clock
+        self.sleep = sleep
+        self.fingerprint = pipeline.zotero_conn.fingerprint()
+        self.first_change: Optional[float] = None
+        self.last_change: Optional[float] = None
+        self.last_full = clock()
+
+    def poll(self) -> bool:
+        """
+        Check the database for changes, True if it changed since the last poll.
+        """
+        fingerprint = self.pipeline.zotero_conn.fingerprint()
+        if fingerprint == self.fingerprint:
+            return False
+        self.fingerprint = fingerprint
+        now = self.clock()
+        if self.first_change is None:
+            self.first_change = now
+        self.last_change = now
+        return True
+
+    def due(self) -> bool:
+        if self.first_change is None:
+            return False
+        now = self.clock()
+        return (
+            now - self.last_change >= self.config.debounce
+            or now - self.first_change >= self.config.max_delay
+        )
+
+    def sync(self, full: bool = False):
+        start = self.clock()
+        try:
+            self.pipeline.zotero_conn.refresh()
+            if full:
+                self.pipeline.sync_zotero_attachments()
+                self.last_full = start
+            else:
+                self.pipeline.sync_modified_attachments()
+        except Exception as e:
+            # keep watching, the change stays pending and is retried after another debounce
+            logger.error(f"Watch sync failed: {e}")
+            self.last_change = self.clock()
+            return
+        self.first_change = self.last_change = None
+        logger.info(
+            f"Watch {'full' if full else 'delta'} sync done in {self.clock() - start:.3f}s"
+        )
+
+    def step(self) -> Optional[str]:
+        """
+        One poll cycle. Returns "full" or "delta" when a sync ran, else None.
+        """
+        self.poll()
+        interval = self.config.full_sync_interval
+        if interval > 0 and self.clock() - self.last_full >= interval:
+            self.sync(full=True)
+            return "full"
+        if self.due():
+            self.sync()
+            return "delta"
+        return None
+
+    def run(self, max_steps: Optional[int] = None):
+        """
+        Catch up with changes made while not watching, then poll until interrupted.
+        """
+        logger.info(
+            f"Watching {self.pipeline.zotero_conn.src} every {self.config.poll_interval}s"
+        )
+        self.sync()
+        steps = 0
+        while max_steps is None or steps < max_steps:
+            self.sleep(self.config.poll_interval)
+            self.step()
+            steps += 1
@@ -1,21 +1,52 @@
-from dataclasses import dataclass, asdict, field
+from dataclasses import dataclass, field
+from pathlib import Path
+import asyncio
 import json
 import os
+import time
 
-from src.config import CONFIG, get_logger
-from src.handler.dify_knowledge_base import DifyKnowledgeBase
-from src.handler.zotero_database import ZoteroConn, Attachment
-from typing import Dict, Any
+from src.config import get_logger, project_path, setting
+from src.handler.async_dify_knowledge_base import AsyncDifyKnowledgeBase
+from src.handler.dify_knowledge_base import DifyKnowledgeBase, KBConfig
+from src.handler.sync_archive import SyncArchive
+from src.handler.extraction_cache import ExtractionCache
+from src.handler.text_extractor import (
+    EXTRACTABLE_TYPES,
+    TextExtractor,
+    docling_version,
+)
+from src.handler.zotero_database import ZoteroConn
+from src.utils.metrics import METRICS
+from typing import TYPE_CHECKING, Dict, Any, Optional
+
+if TYPE_CHECKING:
+    from src.handler.local_index import LocalIndex
 
 logger = get_logger()
 
+DEFAULT_ARCHIVE_PATH = "data/zdb_archive.sqlite"
+# archive location before the SQLite store, migrated into the default archive on first use
+LEGACY_ARCHIVE_PATH = Path("data/zdb_attachments.json")
+# archive meta key of the Zotero high-water mark already synced, see ZoteroConn.get_delta
+HIGH_WATER_MARK = "zotero.highWaterMark"
+# archive meta key of the attachments whose action failed, see Pipeline.save_retry_items
+RETRY_ITEMS = "zotero.retryItems"
+# archive meta key of the time of the last check of the archived files on disk
+FILES_CHECKED_AT = "zotero.filesCheckedAt"
+
 
 @dataclass
 class PipeConfig:
     kb_name: str = "Zotero"
     tag_pattern: str = "#%/%"
-    zotero_db: str = CONFIG["zotero"]["data_dir"]
-    archive_path: str = "data/zdb_attachments.json"
+    zotero_db: str = setting("zotero.data_dir")
+    snapshot_mode: str = "backup"  # backup / copy / readonly, see ZoteroConn
+    # seconds between checks of the archived files on disk while the Zotero database is
+    # unchanged, a file edited in place does not touch it; 0 checks on every delta sync
+    file_check_interval: float = setting("zotero.file_check_interval", 3600.0)
+    # SQLite sync archive, the legacy *.json archive of the same name is migrated (the
+    # old default data/zdb_attachments.json for the default path)
+    archive_path: str = DEFAULT_ARCHIVE_PATH
     metadata_fields: dict[str, str] = field(
         default_factory=lambda: {
             "itemKey": "string",
@@ -27,6 +58,35 @@ class PipeConfig:
             "relpath": "string",
         }
     )
+    # concurrency > 1 runs the sync actions on the asyncio client
+    concurrency: int = 1
+    rate_limit: float = 10.0  # requests started per second, <= 0 for no limit
+    # > 0 streams a full sync from Zotero in batches of this size, the first uploads start
+    # after the first batch instead of after the whole library is loaded and diffed
+    stream_batch_size: int = 0
+    # convert attachments to text locally and upload the text, Dify then skips its own parsing
+    extract_text: bool = setting("zotero.extraction.enabled", False)
+    extract_workers: int = setting("zotero.extraction.workers", 0)  # 0 for one per core
+    extract_cache_dir: str = setting(
+        "zotero.extraction.cache_dir",
+        lambda: str(project_path("PATH_DATA") / "extraction_cache"),
+    )
+    # size budget of the extraction cache, least recently used texts are evicted
+    extract_cache_mb: int = setting("zotero.extraction.cache_mb", 2048)
+    # chunk extracted texts locally with Document.process_rule before upload: logs the
+    # chunk and token totals and fixes the parent boundaries Dify will use
+    prechunk: bool = setting("zotero.extraction.prechunk", False)
+    # keep an offline hybrid (embedding + BM25) index of the extracted texts, searchable
+    # without Dify, see LocalIndex
+    local_index: bool = setting("local_index.enabled", False)
+    local_index_path: str = setting(
+        "local_index.path",
+        lambda: str(project_path("PATH_DATA") / "local_index.sqlite"),
+    )
+    # Dify endpoint and HTTP policy, None for the [dify] settings of config.toml
+    kb_config: Optional[KBConfig] = None
+    # phase timings and request metrics written under PATH_LOG after each sync, see METRICS
+    metrics: bool = setting("metrics.enabled", False)
 
 
 class Pipeline:
@@ -34,14 +94,38 @@ class Pipeline:
     def __init__(self, pipe_config: PipeConfig = None):
         # dataset
         self.config = pipe_config
-        self.zotero_conn = ZoteroConn(zotero_dir=self.config.zotero_db)
-        self.dify_kb = DifyKnowledgeBase(dataset_name=self.config.kb_name)
+        if self.config.metrics:
+            METRICS.enable()
+        self.zotero_conn = ZoteroConn(
+            zotero_dir=self.config.zotero_db, snapshot_mode=self.config.snapshot_mode
+        )
+        self.dify_kb = DifyKnowledgeBase(
+            dataset_name=self.config.kb_name, kb_config=self.config.kb_config
+        )
+        self.archive = self.open_archive(self.config.archive_path)
+        self.run_id: str = None  # journal run of the actions being applied
+        self.extractor = self.open_extractor() if self.config.extract_text else None
+        self.chunker = self.open_chunker() if self.config.prechunk else None
+        self.index = self.open_index() if self.config.local_index else None
+        self.run_texts: Dict[str, str] = {}  # extracted texts of the current run
+        self.index_actions = []  # (action, itemKey) done in the current run
         self.dataset_id: str = self.dify_kb.dataset_id
         self._document_id_dict: Dict[str, Any] = self.dify_kb.documents
         self._metadata_id_dict: Dict[str, Any] = self.dify_kb.metadata
+        if self.index is not None and not self.index.backfilled:
+            self.backfill_index()
+
+    def close(self):
+        # stops the extraction workers, kept between batches of a stream or watch run
+        if self.extractor is not None:
+            self.extractor.close()
+        if self.index is not None:
+            self.index.close()
+        self.archive.close()
 
     @property
     def document_id_dict(self):
+        # cached in DifyKnowledgeBase, refetched only after cache_ttl or invalidation
         self._document_id_dict = self.dify_kb.documents
         return self._document_id_dict
 
@@ -50,112 +134,486 @@ class Pipeline:
         self._metadata_id_dict = self.dify_kb.metadata
         return self._metadata_id_dict
 
-    def get_current_attachments(self):
-        parent_items = self.zotero_conn.get_parent_items_with_special_tag(
-            self.config.tag_pattern
-        )
+    def get_current_attachments(self, parent_ids=None):
         attachments = []
-        for parent_item in parent_items:
-            attachments.extend(
-                self.zotero_conn.get_attachments_by_parent_item(parent_item)
-            )
+        for _, atts in self.zotero_conn.get_parent_items_with_attachments(
+            self.config.tag_pattern, parent_ids=parent_ids
+        ):
+            attachments.extend(atts)
         logger.info(f"Found {len(attachments)} attachments in Zotero")
         return {a.itemKey: a for a in attachments}
 
-    def get_archived_attachments(self):
-        if not os.path.exists(self.config.archive_path):
+    @staticmethod
+    def open_archive(archive_path: str) -> SyncArchive:
+        path = Path(archive_path).with_suffix(".sqlite")
+        if path == Path(DEFAULT_ARCHIVE_PATH):
+            json_path = LEGACY_ARCHIVE_PATH
+        else:
+            # only the JSON next to the archive, a temporary archive never takes the real one
+            json_path = path.with_suffix(".json")
+        archive = SyncArchive(path)
+        if json_path.exists():
+            archive.migrate_json(json_path)
+        return archive
+
+    def open_extractor(self) -> TextExtractor:
+        cache = ExtractionCache(
+            self.config.extract_cache_dir,
+            "docling",
+            docling_version(),
+            max_bytes=self.config.extract_cache_mb * 1024**2,
+        )
+        return TextExtractor(cache, self.config.extract_workers)
+
+    @staticmethod
+    def open_chunker():
+        # tiktoken and numpy are only imported when chunking is on
+        from src.handler.chunker import Chunker
+
+        return Chunker()
+
+    def open_index(self) -> "LocalIndex":
+        from src.handler.local_index import LocalIndex
+
+        if not self.config.extract_text:
             logger.warning(
-                f"Archive file not found: {self.config.archive_path}, create a new one"
+                "The local index only holds extracted texts, extraction is off"
             )
-            self.save_local_archive([])
-            return {}
-        with open(self.config.archive_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        attachments = [Attachment.from_dict(a) for a in data]
+        return LocalIndex(self.config.local_index_path)
+
+    @METRICS.timed("archive.load")
+    def get_archived_attachments(self):
+        attachments = self.archive.items()
         logger.info(f"Found {len(attachments)} attachments in archive")
-        return {a.itemKey: a for a in attachments}
+        return attachments
 
     def save_local_archive(self, attachments):
-        attachments_dict = [asdict(a) for a in attachments]
-        with open(self.config.archive_path, "w", encoding="utf-8") as f:
-            json.dump(attachments_dict, f, indent=4, ensure_ascii=False)
+        self.archive.replace_all(attachments)
+
+    @METRICS.timed("files.hash")
+    def refresh_file_states(self, current, archived):
+        """
+        Attach size, mtime and content hash of the local files to the current attachments.
+        Files whose size and mtime match the archive reuse the archived hash, so a run
+        without file changes reads no file content.
+        """
+        return {k: att.with_file_state(archived.get(k)) for k, att in current.items()}
 
-    def diff_attachments(self, current, archived):
+    @staticmethod
+    @METRICS.timed("diff")
+    def diff_attachments(current, archived):
         to_upload = [current[k] for k in current if k not in archived]
+        # file content changed: re-upload into the existing document (metadata is re-sent too)
+        to_replace = [
+            current[k]
+            for k in current
+            if k in archived
+            and archived[k].fileHash
+            and current[k].fileHash
+            and current[k].fileHash != archived[k].fileHash
+        ]
+        replace_keys = {a.itemKey for a in to_replace}
         to_update = [
             current[k]
             for k in current
             if k in archived
+            and k not in replace_keys
             and set(current[k].parentItem.tags) != set(archived[k].parentItem.tags)
         ]
         to_delete = [archived[k] for k in archived if k not in current]
-        return to_upload, to_update, to_delete
+        return to_upload, to_update, to_delete, to_replace
 
-    def upload_onefile(self, file_path: str, metadata_input: dict):
-        doc_id = self.dify_kb.upload_document_by_file(self.dataset_id, file_path)
+    def build_metadata_vlist(self, metadata_input: dict, metadata_id_dict: dict):
+        return [
+            {"id": metadata_id_dict[k], "name": k, "value": v}
+            for k, v in metadata_input.items()
+            if k in metadata_id_dict
+        ]
+
+    @METRICS.timed("extract")
+    def extract_texts(self, attachments) -> Dict[str, str]:
+        """
+        Locally extracted text of the attachments to upload, by itemKey. Empty when
+        extraction is off; attachments missing here are uploaded as files.
+        """
+        if self.extractor is None:
+            return {}
+        paths = {
+            att.itemKey: (att.abspath, att.fileHash)
+            for att in attachments
+            if att.contentType in EXTRACTABLE_TYPES and att.abspath.is_file()
+        }
+        texts = self.extractor.extract_many(paths.values())
+        texts = {k: texts[p] for k, (p, _) in paths.items() if p in texts}
+        return self.prechunk_texts(texts) if self.chunker and texts else texts
+
+    def prechunk_texts(self, texts: Dict[str, str]) -> Dict[str, str]:
+        """
+        Chunk the texts locally, log what Dify is going to index and return texts
+        whose parent chunks split exactly at the local boundaries.
+        """
+        keys = list(texts)
+        documents = self.chunker.chunk([texts[k] for k in keys])
+        stats = self.chunker.stats(documents)
+        logger.info(
+            f"Chunked {stats.documents} texts into {stats.parents} parent chunks ({stats.parent_tokens} tokens) "
+            f"and {stats.children} child chunks ({stats.child_tokens} tokens to embed)"
+        )
+        return {k: self.chunker.prechunked_text(d) for k, d in zip(keys, documents)}
+
+    def upload_onefile(self, file_path: str, metadata_input: dict, text: str = None):
+        if text is not None:
+            doc_id = self.dify_kb.upload_document_by_text(
+                self.dataset_id, Path(file_path).name, text
+            )["document"]["id"]
+        else:
+            doc_id = self.dify_kb.upload_document_by_file(self.dataset_id, file_path)
         logger.info(f"Uploaded {file_path} to Dify with doc_id: {doc_id}")
+        self.record_created(metadata_input.get("itemKey"), doc_id)
 
         # 更新metadata
-        metadata_vlist = []
-        for k, v in metadata_input.items():
-            if k in self._metadata_id_dict:
-                metadata_vlist.append(
-                    {"id": self._metadata_id_dict[k], "name": k, "value": v}
-                )
+        metadata_vlist = self.build_metadata_vlist(
+            metadata_input, self.metadata_id_dict
+        )
         self.dify_kb.update_document_metadata(self.dataset_id, doc_id, metadata_vlist)
         logger.info(f"Updated metadata for {file_path} in Dify")
         return doc_id
 
-    def apply_sync_actions(self, to_upload, to_update, to_delete):
+    def begin_run(self, to_upload, to_update, to_delete, to_replace):
+        """
+        Journal every planned action as pending before anything is sent to Dify.
+        """
+        self.run_id = self.archive.journal_begin(
+            [("upload", a) for a in to_upload]
+            + [("update", a) for a in to_update]
+            + [("delete", a) for a in to_delete]
+            + [("replace", a) for a in to_replace]
+        )
+
+    def record_created(self, item_key: Optional[str], doc_id: str):
+        # journaled before the metadata update, a crash in between leaves a document
+        # without itemKey that resume_sync then tags instead of uploading it again
+        if self.run_id and item_key:
+            self.archive.journal_document(self.run_id, "upload", item_key, doc_id)
+
+    def record_done(self, action: str, attachments):
+        # archive row and journal entry change in one transaction
+        if action == "delete":
+            self.archive.delete_many(
+                [a.itemKey for a in attachments], run_id=self.run_id, action=action
+            )
+        else:
+            self.archive.put_many(attachments, run_id=self.run_id, action=action)
+        if self.index is not None:
+            self.index_actions += [(action, a.itemKey) for a in attachments]
+        METRICS.inc(
+            "sync_actions",
+            len(attachments),
+            pipeline="zdb2dify",
+            action=action,
+            result="success",
+        )
+
+    def record_failed(self, action: str, att, error):
+        self.archive.journal_fail(self.run_id, action, att.itemKey, str(error))
+        METRICS.inc(
+            "sync_actions", pipeline="zdb2dify", action=action, result="failure"
+        )
+
+    def finish_run(self):
+        self.archive.journal_finish(self.run_id)
+        self.run_id = None
+        self.update_index()
+
+    @METRICS.timed("index.update")
+    def update_index(self):
+        """
+        Bring the local index in line with the run once it is over, outside the upload
+        loop: new texts are chunked and embedded, deleted items and replaced files
+        without text are dropped.
+        """
+        actions, self.index_actions = self.index_actions, []
+        texts, self.run_texts = self.run_texts, {}
+        if self.index is None:
+            return
+        from src.handler.local_index import split_paragraphs
+
+        for action, key in actions:
+            if key in texts and action in ("upload", "replace"):
+                self.index.upsert(key, split_paragraphs(texts[key]))
+            elif action in ("delete", "replace"):
+                self.index.delete(key)
+
+    @METRICS.timed("index.backfill")
+    def backfill_index(self, batch_size: int = 100):
+        """
+        Index the archived attachments missing from the local index, synced before it was
+        enabled or emptied by a model change, with their texts from the extraction cache.
+        Runs once, when the pipeline opens an index not backfilled yet, or on demand with
+        main.py --backfill-index; items whose text is not cached are left to the next
+        upload or replace of their file.
+        """
+        if self.extractor is None:
+            return
+        from src.handler.local_index import split_paragraphs
+
+        indexed = self.index.keys()
+        missing = [
+            att
+            for att in self.archive.scan()
+            if att.itemKey not in indexed
+            and att.fileHash
+            and att.contentType in EXTRACTABLE_TYPES
+        ]
+        done = 0
+        for i in range(0, len(missing), batch_size):
+            texts = {}
+            for att in missing[i : i + batch_size]:
+                text = self.extractor.cache.get(att.fileHash)
+                if text is not None:
+                    texts[att.itemKey] = text
+            if self.chunker and texts:
+                texts = self.prechunk_texts(texts)
+            for key, text in texts.items():
+                self.index.upsert(key, split_paragraphs(text))
+            done += len(texts)
+        self.index.mark_backfilled()
+        if missing:
+            logger.info(
+                f"Backfilled the local index with {done} of {len(missing)} archived "
+                f"attachments, {len(missing) - done} have no cached text"
+            )
+
+    def apply_sync_actions(self, to_upload, to_update, to_delete, to_replace=()):
         # 自动补全metadata
         self.ensure_metadata_fields_exist(self.config.metadata_fields)
-        success_items = {"upload": [], "update": [], "delete": []}
+        self.begin_run(to_upload, to_update, to_delete, to_replace)
+        success_items = {"upload": [], "update": [], "delete": [], "replace": []}
+        texts = self.run_texts = self.extract_texts(list(to_upload) + list(to_replace))
         # 上传
         for att in to_upload:
             file_path = att.abspath
             if not file_path.exists():
                 logger.warning(f"File not found: {file_path}")
+                self.record_failed("upload", att, "file not found")
                 continue
             metadata_input = att.to_dict()
             try:
-                doc_id = self.upload_onefile(file_path, metadata_input)
-                self.document_id_dict[att.itemKey] = doc_id
+                doc_id = self.upload_onefile(
+                    file_path, metadata_input, texts.get(att.itemKey)
+                )
+                self.dify_kb.remember_document(att.itemKey, doc_id)
                 success_items["upload"].append(att.itemKey)
+                self.record_done("upload", [att])
             except Exception as e:
                 logger.error(f"Failed to upload {file_path}: {e}")
-        # 更新
-        for att in to_update:
-            doc_id = self.document_id_dict.get(att.itemKey)
-            if doc_id:
-                try:
-                    metadata_input = att.to_dict()
-                    metadata_vlist = []
-                    for k, v in metadata_input.items():
-                        if k in self.metadata_id_dict:
-                            metadata_vlist.append(
-                                {"id": self.metadata_id_dict[k], "name": k, "value": v}
-                            )
-                    self.dify_kb.update_document_metadata(
-                        self.dataset_id, doc_id, metadata_vlist
+                self.record_failed("upload", att, e)
+        # 替换文件
+        replaced = []
+        document_id_dict = self.document_id_dict
+        for att in to_replace:
+            doc_id = document_id_dict.get(att.itemKey)
+            if not doc_id:
+                logger.warning(f"No doc_id for {att.itemKey}, skip replace.")
+                self.record_failed("replace", att, "no doc_id")
+                continue
+            try:
+                if att.itemKey in texts:
+                    self.dify_kb.update_document_by_text(
+                        self.dataset_id, doc_id, att.abspath.name, texts[att.itemKey]
                     )
-                    logger.info(f"Updated tags for {att.itemKey} in Dify")
-                    success_items["update"].append(att.itemKey)
-                except Exception as e:
-                    logger.error(f"Failed to update tags for {att.itemKey}: {e}")
-            else:
-                logger.warning(f"No doc_id for {att.itemKey}, skip update.")
+                else:
+                    self.dify_kb.update_document_by_file(
+                        self.dataset_id, doc_id, att.abspath
+                    )
+                logger.info(f"Replaced file of {att.itemKey} {att.abspath} in Dify")
+                replaced.append(att)
+            except Exception as e:
+                logger.error(f"Failed to replace {att.abspath}: {e}")
+                self.record_failed("replace", att, e)
+        # 更新 (批量), 替换过的文档一并更新metadata
+        updated = set(self.update_metadata_batch(list(to_update) + replaced))
+        self.split_updated(updated, to_update, replaced, success_items)
         # 删除
+        document_id_dict = self.document_id_dict
         for att in to_delete:
-            doc_id = self._document_id_dict.get(att.itemKey)
+            doc_id = document_id_dict.get(att.itemKey)
             if doc_id:
                 try:
                     self.dify_kb.delete_document(self.dataset_id, doc_id)
                     logger.info(f"Deleted {att.itemKey} {att.title} from Dify")
                     success_items["delete"].append(att.itemKey)
+                    self.record_done("delete", [att])
                 except Exception as e:
                     logger.error(f"Failed to delete {att.itemKey}: {e}")
+                    self.record_failed("delete", att, e)
             else:
                 logger.warning(f"No doc_id for {att.itemKey}, skip delete.")
+                self.record_failed("delete", att, "no doc_id")
+        self.finish_run()
+        return success_items
+
+    def split_updated(self, updated: set, to_update, replaced, success_items: dict):
+        # a replace only counts once its metadata is in place as well
+        success_items["update"] = [a.itemKey for a in to_update if a.itemKey in updated]
+        success_items["replace"] = [a.itemKey for a in replaced if a.itemKey in updated]
+        self.record_done("update", [a for a in to_update if a.itemKey in updated])
+        self.record_done("replace", [a for a in replaced if a.itemKey in updated])
+        for action, atts in (("update", to_update), ("replace", replaced)):
+            for a in atts:
+                if a.itemKey not in updated:
+                    self.record_failed(action, a, "metadata update failed")
+
+    def update_metadata_batch(self, attachments) -> list:
+        """
+        Push the metadata of already uploaded attachments with batched requests.
+        Returns the itemKeys updated successfully.
+        """
+        operations, key_by_doc = self.collect_metadata_operations(attachments)
+        if not operations:
+            return []
+        result = self.dify_kb.update_documents_metadata(self.dataset_id, operations)
+        return self.report_metadata_result(result, key_by_doc)
+
+    def collect_metadata_operations(self, attachments):
+        metadata_id_dict = self.metadata_id_dict
+        document_id_dict = self.document_id_dict
+        operations, key_by_doc = [], {}
+        for att in attachments:
+            doc_id = document_id_dict.get(att.itemKey)
+            if not doc_id:
+                logger.warning(f"No doc_id for {att.itemKey}, skip update.")
+                continue
+            operations.append(
+                (doc_id, self.build_metadata_vlist(att.to_dict(), metadata_id_dict))
+            )
+            key_by_doc[doc_id] = att.itemKey
+        return operations, key_by_doc
+
+    def report_metadata_result(self, result: dict, key_by_doc: dict) -> list:
+        for doc_id, error in result["failed"].items():
+            logger.error(f"Failed to update tags for {key_by_doc[doc_id]}: {error}")
+        updated = [key_by_doc[doc_id] for doc_id in result["success"]]
+        if updated:
+            logger.info(f"Updated tags for {len(updated)} attachments in Dify")
+        return updated
+
+    async def apply_sync_actions_async(
+        self, to_upload, to_update, to_delete, to_replace=()
+    ):
+        """
+        Concurrent version of apply_sync_actions on AsyncDifyKnowledgeBase, bounded by
+        config.concurrency and config.rate_limit. Per-item success/failure reporting is
+        the same: a failed item is logged and left out of success_items.
+        """
+        self.ensure_metadata_fields_exist(self.config.metadata_fields)
+        self.begin_run(to_upload, to_update, to_delete, to_replace)
+        success_items = {"upload": [], "update": [], "delete": [], "replace": []}
+        # dataset-level maps are read once, writes go through dify_kb.remember/forget_document
+        metadata_id_dict = self.metadata_id_dict
+        document_id_dict = self.document_id_dict
+        replaced = []
+        texts = self.run_texts = self.extract_texts(list(to_upload) + list(to_replace))
+        # bounds items in flight (and file contents held in memory), the client bounds requests
+        slots = asyncio.Semaphore(self.config.concurrency)
+
+        async with AsyncDifyKnowledgeBase(
+            kb_config=self.dify_kb.kb_config,
+            concurrency=self.config.concurrency,
+            rate_limit=self.config.rate_limit,
+        ) as kb:
+
+            async def upload(att):
+                file_path = att.abspath
+                if not file_path.exists():
+                    logger.warning(f"File not found: {file_path}")
+                    self.record_failed("upload", att, "file not found")
+                    return
+                async with slots:
+                    try:
+                        if att.itemKey in texts:
+                            doc_id = await kb.upload_document_by_text(
+                                self.dataset_id, file_path.name, texts[att.itemKey]
+                            )
+                        else:
+                            doc_id = await kb.upload_document_by_file(
+                                self.dataset_id, str(file_path)
+                            )
+                        logger.info(
+                            f"Uploaded {file_path} to Dify with doc_id: {doc_id}"
+                        )
+                        self.record_created(att.itemKey, doc_id)
+                        await kb.update_document_metadata(
+                            self.dataset_id,
+                            doc_id,
+                            self.build_metadata_vlist(att.to_dict(), metadata_id_dict),
+                        )
+                        self.dify_kb.remember_document(att.itemKey, doc_id)
+                        success_items["upload"].append(att.itemKey)
+                        self.record_done("upload", [att])
+                    except Exception as e:
+                        logger.error(f"Failed to upload {file_path}: {e}")
+                        self.record_failed("upload", att, e)
+
+            async def delete(att):
+                doc_id = document_id_dict.get(att.itemKey)
+                if not doc_id:
+                    logger.warning(f"No doc_id for {att.itemKey}, skip delete.")
+                    self.record_failed("delete", att, "no doc_id")
+                    return
+                async with slots:
+                    try:
+                        await kb.delete_document(self.dataset_id, doc_id)
+                        self.dify_kb.forget_document(doc_id)
+                        logger.info(f"Deleted {att.itemKey} {att.title} from Dify")
+                        success_items["delete"].append(att.itemKey)
+                        self.record_done("delete", [att])
+                    except Exception as e:
+                        logger.error(f"Failed to delete {att.itemKey}: {e}")
+                        self.record_failed("delete", att, e)
+
+            async def replace(att):
+                doc_id = document_id_dict.get(att.itemKey)
+                if not doc_id:
+                    logger.warning(f"No doc_id for {att.itemKey}, skip replace.")
+                    self.record_failed("replace", att, "no doc_id")
+                    return
+                async with slots:
+                    try:
+                        if att.itemKey in texts:
+                            await kb.update_document_by_text(
+                                self.dataset_id,
+                                doc_id,
+                                att.abspath.name,
+                                texts[att.itemKey],
+                            )
+                        else:
+                            await kb.update_document_by_file(
+                                self.dataset_id, doc_id, str(att.abspath)
+                            )
+                        logger.info(
+                            f"Replaced file of {att.itemKey} {att.abspath} in Dify"
+                        )
+                        replaced.append(att)
+                    except Exception as e:
+                        logger.error(f"Failed to replace {att.abspath}: {e}")
+                        self.record_failed("replace", att, e)
+
+            await asyncio.gather(
+                *(upload(att) for att in to_upload),
+                *(replace(att) for att in to_replace),
+                *(delete(att) for att in to_delete),
+            )
+            # 更新 (批量), 替换过的文档一并更新metadata
+            operations, key_by_doc = self.collect_metadata_operations(
+                list(to_update) + replaced
+            )
+            updated = set()
+            if operations:
+                result = await kb.update_documents_metadata(self.dataset_id, operations)
+                updated = set(self.report_metadata_result(result, key_by_doc))
+            self.split_updated(updated, to_update, replaced, success_items)
+        self.finish_run()
         return success_items
 
     def ensure_metadata_fields_exist(self, required_fields: dict):
@@ -170,32 +628,292 @@ class Pipeline:
                 )
                 self.dify_kb.create_metadata(self.dataset_id, name, type)
 
-    def sync_zotero_attachments(self):
-        current = self.get_current_attachments()
-        archived = self.get_archived_attachments()
-        to_upload, to_update, to_delete = self.diff_attachments(current, archived)
+    @METRICS.timed("dify.actions")
+    def run_sync_actions(self, to_upload, to_update, to_delete, to_replace):
+        if self.config.concurrency > 1:
+            return asyncio.run(
+                self.apply_sync_actions_async(
+                    to_upload, to_update, to_delete, to_replace
+                )
+            )
+        return self.apply_sync_actions(to_upload, to_update, to_delete, to_replace)
+
+    @METRICS.run("zdb2dify")
+    def resume_sync(self):
+        """
+        Replay the pending actions of an interrupted sync from the journal.
+        Live Dify documents are checked by itemKey first: an upload that already
+        reached Dify and a delete of a document that is gone are only recorded,
+        so a replay never uploads or deletes twice. An upload whose document was
+        created but not tagged yet is found by its journaled doc_id and only tagged.
+        Entries superseded by a later sync are not part of the journal_pending replay.
+        """
+        pending = self.archive.journal_pending_documents()
+        actions = {"upload": {}, "update": {}, "delete": {}, "replace": {}}
+        created = {}  # itemKey -> document created by a pending upload
+        for action, att, doc_id in pending:
+            actions[action][att.itemKey] = att  # later runs win
+            if action == "upload" and doc_id:
+                created[att.itemKey] = doc_id
+        if not pending:
+            logger.info("No interrupted sync to resume")
+        self.dify_kb.invalidate("documents")
+        live = self.document_id_dict
+        untagged = [
+            a for k, a in actions["upload"].items() if k not in live and k in created
+        ]
+        tagged = set(self.tag_created_documents(untagged, created))
+        uploaded = [a for k, a in actions["upload"].items() if k in live or k in tagged]
+        deleted = [a for k, a in actions["delete"].items() if k not in live]
+        self.archive.journal_clear()
+        self.archive.put_many(uploaded)
+        self.archive.delete_many([a.itemKey for a in deleted])
+        to_upload = [
+            a for k, a in actions["upload"].items() if k not in live and k not in tagged
+        ]
+        to_delete = [a for k, a in actions["delete"].items() if k in live]
+        to_update = list(actions["update"].values())
+        to_replace = list(actions["replace"].values())
         logger.info(
-            f"Found {len(to_upload)} attachments to upload, {len(to_update)} attachments to update, {len(to_delete)} attachments to delete"
+            f"Resuming {len(pending)} pending actions: {len(uploaded)} uploads ({len(tagged)} of them untagged) and {len(deleted)} deletes already in Dify, "
+            f"{len(to_upload)} to upload, {len(to_update)} to update, {len(to_delete)} to delete, {len(to_replace)} to replace"
+        )
+        success_items = self.run_sync_actions(
+            to_upload, to_update, to_delete, to_replace
         )
-        success_items = self.apply_sync_actions(to_upload, to_update, to_delete)
+        success_items["upload"] += [a.itemKey for a in uploaded]
+        success_items["delete"] += [a.itemKey for a in deleted]
+        return success_items
+
+    def tag_created_documents(self, attachments, created: Dict[str, str]) -> list:
+        """
+        Set the metadata of documents created by an interrupted run before it tagged
+        them. Returns the itemKeys tagged; the others, e.g. documents deleted since,
+        are uploaded again.
+        """
+        if not attachments:
+            return []
+        self.ensure_metadata_fields_exist(self.config.metadata_fields)
+        metadata_id_dict = self.metadata_id_dict
+        operations = [
+            (
+                created[a.itemKey],
+                self.build_metadata_vlist(a.to_dict(), metadata_id_dict),
+            )
+            for a in attachments
+        ]
+        key_by_doc = {created[a.itemKey]: a.itemKey for a in attachments}
+        result = self.dify_kb.update_documents_metadata(self.dataset_id, operations)
+        tagged = self.report_metadata_result(result, key_by_doc)
+        for key in tagged:
+            self.dify_kb.remember_document(key, created[key])
+        return tagged
+
+    @staticmethod
+    def is_syncable(att) -> bool:
+        """
+        Whether the attachment has a local file to upload: linked URLs and files missing
+        on disk (e.g. not downloaded by Zotero yet) are not uploaded. Missing files are
+        retried by key, see sync_slice.
+        """
+        return not att.is_attachment_url and att.abspath.exists()
+
+    def sync_slice(self, current, archived) -> Dict[str, int]:
+        """
+        Diff and sync `current` Zotero attachments against their `archived` records.
+        Returns the attachments whose action failed or whose file is missing,
+        itemKey -> parent itemID, see save_retry_items.
+        """
+        current = self.refresh_file_states(current, archived)
+        to_upload, to_update, to_delete, to_replace = self.diff_attachments(
+            current, archived
+        )
+        skipped = [a for a in to_upload if not self.is_syncable(a)]
+        if skipped:
+            logger.info(f"Skipping {len(skipped)} attachments without a local file")
+            to_upload = [a for a in to_upload if self.is_syncable(a)]
         logger.info(
-            f"Successfully synced {len(success_items['upload'])} attachments to upload, {len(success_items['update'])} attachments to update, {len(success_items['delete'])} attachments to delete"
+            f"Found {len(to_upload)} attachments to upload, {len(to_update)} attachments to update, {len(to_delete)} attachments to delete, {len(to_replace)} attachments to replace"
+        )
+        success_items = self.run_sync_actions(
+            to_upload, to_update, to_delete, to_replace
+        )
+        logger.info(
+            f"Successfully synced {len(success_items['upload'])} attachments to upload, {len(success_items['update'])} attachments to update, {len(success_items['delete'])} attachments to delete, {len(success_items.get('replace', []))} attachments to replace"
         )
 
-        # 归档逻辑：
-        # 1. 本次上传成功的
-        # 2. 本次更新成功的
-        to_keep_keys = set(success_items["upload"]) | set(success_items["update"])
-        # 3. 加上archive中未被删除的
-        deleted_keys = set(success_items["delete"])
-        for k in archived:
-            if k not in deleted_keys:
-                to_keep_keys.add(k)
-        # 归档这些key对应的Attachment对象
-        all_attachments = {**current, **archived}  # 以current为主，补充archive
-        to_archive = [all_attachments[k] for k in to_keep_keys if k in all_attachments]
-        self.save_local_archive(to_archive)
-        logger.info(f"Archived {len(to_archive)} attachments")
+        # 归档: 成功的动作已在apply中逐条记录, 失败的保留原记录以便下次重试
+        # 无待处理动作但文件状态有变化 (如只改了mtime) 的, 刷新记录避免下次重新计算hash
+        pending = {a.itemKey for a in to_update} | {a.itemKey for a in to_replace}
+        refreshed = [
+            current[k]
+            for k in current
+            if k in archived
+            and k not in pending
+            and (current[k].fileSize, current[k].fileMtime, current[k].fileHash)
+            != (archived[k].fileSize, archived[k].fileMtime, archived[k].fileHash)
+        ]
+        self.archive.put_many(refreshed)
+        logger.info(f"Archive holds {len(self.archive)} attachments")
+        planned = {
+            "upload": to_upload,
+            "update": to_update,
+            "delete": to_delete,
+            "replace": to_replace,
+        }
+        # downloading the file later does not touch the item in Zotero, the delta would
+        # never see it again: rechecked by key like the failures
+        failed = {
+            a.itemKey: a.parentItem.itemID for a in skipped if not a.is_attachment_url
+        }
+        for action, atts in planned.items():
+            done = set(success_items.get(action, []))
+            failed.update(
+                (a.itemKey, a.parentItem.itemID) for a in atts if a.itemKey not in done
+            )
+        return failed
+
+    @METRICS.run("zdb2dify")
+    def sync_zotero_attachments(self):
+        if self.archive.journal_pending():
+            logger.warning(
+                "A previous sync was interrupted, its pending actions are redone by the diff; "
+                "run with --resume first to check them against Dify and avoid duplicates"
+            )
+        # taken before the query, from the same snapshot
+        mark = self.zotero_conn.get_high_water_mark()
+        if self.config.stream_batch_size > 0:
+            failed = self.sync_stream(
+                self.zotero_conn.iter_attachment_batches(
+                    self.config.tag_pattern, batch_size=self.config.stream_batch_size
+                )
+            )
+        else:
+            archived = self.get_archived_attachments()
+            failed = self.sync_slice(self.get_current_attachments(), archived)
+        # a full sync covers every earlier failure, what failed now is retried next time
+        self.save_retry_items(failed)
+        self.save_high_water_mark(mark)
+
+    def sync_stream(self, batches) -> Dict[str, int]:
+        """
+        Full sync over batches of current attachments: each batch is diffed against its
+        archived records and synced before the next one is read. Archived attachments
+        never seen in any batch are deleted at the end. Only keys are kept across batches.
+        Returns the failed attachments of all batches, as sync_slice.
+        """
+        seen = set()
+        failed = {}
+        for n, batch in enumerate(batches, 1):
+            current = {a.itemKey: a for a in batch}
+            seen.update(current)
+            logger.info(f"Batch {n}: {len(current)} attachments from Zotero")
+            failed.update(self.sync_slice(current, self.archive.get_many(current)))
+        gone = [k for k in self.archive.keys() if k not in seen]
+        if gone:
+            failed.update(self.sync_slice({}, self.archive.get_many(gone)))
+        return failed
+
+    def load_high_water_mark(self):
+        mark = self.archive.get_meta(HIGH_WATER_MARK)
+        return json.loads(mark) if mark else None
+
+    def save_high_water_mark(self, mark: dict):
+        self.archive.set_meta(HIGH_WATER_MARK, json.dumps(mark))
+
+    @METRICS.timed("files.stat")
+    def get_changed_files(self) -> Dict[str, int]:
+        """
+        Archived attachments whose file size or mtime on disk differ from the archive,
+        itemKey -> parent itemID. Editing or replacing a file leaves zotero.sqlite
+        untouched, so no delta sees it; this costs a stat per file and reads no content.
+        Files gone from disk are left to Zotero, deleting an attachment shows in the delta.
+        """
+        changed = {}
+        for item_key, parent_id, relpath, size, mtime in self.archive.file_states():
+            try:
+                stat = os.stat(os.path.join(self.config.zotero_db, relpath))
+            except OSError:
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime):
+                changed[item_key] = parent_id
+        self.archive.set_meta(FILES_CHECKED_AT, str(time.time()))
+        return changed
+
+    def file_check_due(self, since: Dict[str, Any], mark: Dict[str, Any]) -> bool:
+        """
+        Whether this delta sync checks the archived files with get_changed_files. While
+        the Zotero fingerprint is unchanged the check waits for file_check_interval, so
+        a run without changes reads neither the archive nor the disk.
+        """
+        unchanged = since.get("fingerprint") and since["fingerprint"] == mark.get(
+            "fingerprint"
+        )
+        checked_at = float(self.archive.get_meta(FILES_CHECKED_AT) or 0)
+        return (
+            not unchanged or time.time() - checked_at >= self.config.file_check_interval
+        )
+
+    def load_retry_items(self) -> Dict[str, int]:
+        items = self.archive.get_meta(RETRY_ITEMS)
+        return json.loads(items) if items else {}
+
+    def save_retry_items(self, items: Dict[str, int]):
+        """
+        Attachments whose action failed or whose file was missing, itemKey -> parent
+        itemID. The next delta sync adds them to its slice, so the high-water mark can
+        advance past them.
+        """
+        if items:
+            logger.warning(
+                f"{len(items)} attachments failed or have no local file, "
+                "retried on the next sync"
+            )
+        self.archive.set_meta(RETRY_ITEMS, json.dumps(items))
+
+    @METRICS.run("zdb2dify")
+    def sync_modified_attachments(self):
+        """
+        Sync only the slice of Zotero changed since the high-water mark of the last sync:
+        items modified, trashed or restored, and tombstones of erased items, plus the
+        attachments whose file changed on disk and those that failed last time. Falls back to a full sync when there is no
+        mark yet. The mark always advances, failed attachments are kept for the next
+        run with save_retry_items.
+        """
+        since = self.load_high_water_mark()
+        if since is None:
+            return self.sync_zotero_attachments()
+        delta = self.zotero_conn.get_delta(since)
+        retry = self.load_retry_items()
+        changed_files = (
+            self.get_changed_files() if self.file_check_due(since, delta.mark) else {}
+        )
+        logger.info(
+            f"{len(delta.parents)} Zotero items changed and {len(delta.erased_keys)} erased "
+            f"since {since['clientDateModified']}, {len(changed_files)} files changed on disk, "
+            f"{len(retry)} attachments to retry"
+        )
+        recheck = {**changed_files, **retry}
+        if not delta.parents and not delta.erased_keys and not recheck:
+            self.save_high_water_mark(delta.mark)
+            return
+        parent_ids = list(dict.fromkeys([*delta.parents, *recheck.values()]))
+        # of a parent loaded only for a recheck, those attachments and not their siblings
+        current = {
+            k: a
+            for k, a in self.get_current_attachments(parent_ids).items()
+            if a.parentItem.itemID in delta.parents or k in recheck
+        }
+        archived = self.archive.get_by_parents(
+            list(delta.parents.values()) + delta.erased_keys
+        )
+        # erased attachments, attachments moved here from a parent outside the slice
+        # and failed deletes of attachments gone from Zotero
+        archived.update(
+            self.archive.get_many(delta.erased_keys + list(current) + list(retry))
+        )
+        self.save_retry_items(self.sync_slice(current, archived))
+        self.save_high_water_mark(delta.mark)
 
 
 if __name__ == "__main__":
@@ -203,4 +921,4 @@ if __name__ == "__main__":
         kb_name="Zotero", tag_pattern="#%/%", archive_path="data/zdb.json"
     )
     pipeline = Pipeline(pipe_config)
-    pipeline.sync_zotero_attachments()
+    pipeline.sync_modified_attachments()
@@ -0,0 +1,15 @@
+import hashlib
+from pathlib import Path
+
+CHUNK_SIZE = 1 << 20  # 1 MiB
+
+
+def hash_file(path, algorithm: str = "sha256") -> str:
+    """
+    Hex digest of a file's content, read in chunks so large PDFs are never held in memory.
+    """
+    digest = hashlib.new(algorithm)
+    with open(Path(path), "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,345 @@
+"""
+Run metrics of the sync pipelines: phase durations, HTTP requests per endpoint (status,
+bytes, latency histogram, retries) and per-action outcomes.
+
+Off by default, every call then returns right away. Once enabled, the outermost
+`METRICS.run(job)` writes two files under PATH_LOG/metrics (or [metrics] dir) on exit:
+
+    <job>.prom  -- OpenMetrics text, cumulative over the process, for the node_exporter
+                   textfile collector or any OpenMetrics scraper
+    <job>.json  -- report of the last run: its phase timeline and the metric deltas
+
+    METRICS.enable()
+    with METRICS.run("zdb2dify"):
+        with METRICS.phase("zotero.query"):
+            ...
+"""
+
+import bisect
+import contextlib
+import functools
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+from src.config import get_logger, get_setting, project_path
+
+logger = get_logger()
+
+PREFIX = "zogents"
+# seconds, upper bounds of the request latency buckets, +Inf is implicit
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+# metric name (without prefix) -> (type, help)
+FAMILIES = {
+    "phase_seconds": ("summary", "Time spent in a pipeline phase"),
+    "http_requests": ("counter", "HTTP requests to Dify by final status"),
+    "http_request_seconds": ("histogram", "HTTP request latency, retries included"),
+    "http_sent_bytes": ("counter", "Request body bytes sent to Dify"),
+    "http_received_bytes": ("counter", "Response body bytes received from Dify"),
+    "http_retries": ("counter", "HTTP attempts retried after an error or status"),
+    "sync_actions": ("counter", "Sync actions by outcome"),
+    "last_run_timestamp_seconds": ("gauge", "Unix time the last run ended"),
+    "last_run_duration_seconds": ("gauge", "Duration of the last run"),
+    "last_run_success": ("gauge", "1 if the last run ended without an exception"),
+}
+# phases kept in the timeline of a run report, a long stream sync would grow it unbounded
+MAX_TIMELINE = 1000
+# uuids in request paths, e.g. /datasets/<id>/documents/<id> -> /datasets/{id}/documents/{id}
+ID_SEGMENT = re.compile(r"/[0-9a-fA-F]{8}-[0-9a-fA-F-]{27}(?=/|$)")
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def endpoint(url: str) -> str:
+    """
+    Path of a Dify API url from /datasets on, with the ids replaced by {id}.
+    """
+    path = urlsplit(url).path
+    start = path.find("/datasets")
+    return ID_SEGMENT.sub("/{id}", path[start:] if start >= 0 else path) or "/"
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def format_labels(labels: Labels, extra: str = "") -> str:
+    pairs = [f'{k}="{escape(v)}"' for k, v in labels] + ([extra] if extra else [])
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metrics:
+    """
+    Thread-safe registry of the FAMILIES samples, keyed by name and label set.
+    Counters and gauges hold a float, summaries [sum, count] and histograms
+    [bucket counts..., sum, count] with non-cumulative bucket counts.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.values: Dict[Tuple[str, Labels], Any] = {}
+        self.timeline = []  # phases of the current run: {"phase", "start", "seconds"}
+        self._run: Optional[tuple] = None  # (started unix time, perf_counter, values)
+
+    def enable(self, enabled: bool = True):
+        self.enabled = enabled
+
+    def reset(self):
+        with self.lock:
+            self.values = {}
+            self.timeline = []
+
+    def update(self, name: str, value: float, labels: dict):
+        kind = FAMILIES[name][0]
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self.lock:
+            if kind == "counter":
+                self.values[key] = self.values.get(key, 0.0) + value
+            elif kind == "gauge":
+                self.values[key] = float(value)
+            elif kind == "summary":
+                total = self.values.setdefault(key, [0.0, 0])
+                total[0] += value
+                total[1] += 1
+            else:
+                hist = self.values.setdefault(key, [0] * (len(LATENCY_BUCKETS) + 3))
+                hist[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+                hist[-2] += value
+                hist[-1] += 1
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        if self.enabled:
+            self.update(name, value, labels)
+
+    def set(self, name: str, value: float, **labels):
+        if self.enabled:
+            self.update(name, value, labels)
+
+    def observe(self, name: str, value: float, **labels):
+        if self.enabled:
+            self.update(name, value, labels)
+
+    def phase(self, name: str):
+        """
+        Context manager timing a phase, a no-op while disabled.
+        """
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._phase(name)
+
+    @contextlib.contextmanager
+    def _phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.update("phase_seconds", seconds, {"phase": name})
+            run = self._run
+            if run is not None and len(self.timeline) < MAX_TIMELINE:
+                self.timeline.append(
+                    {"phase": name, "start": start - run[1], "seconds": seconds}
+                )
+
+    def timed(self, name: str):
+        """
+        Decorator timing every call of a function as phase `name`. Whether metrics are
+        enabled is checked per call, so it can decorate methods at import time.
+        """
+
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with self._phase(name):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def observe_request(
+        self,
+        method: str,
+        url: str,
+        status,
+        seconds: float,
+        sent: int = 0,
+        received: int = 0,
+        retries: int = 0,
+    ):
+        """
+        Record one logical request, its retries included. status is the final HTTP
+        status, or "error" when no response came back.
+        """
+        if not self.enabled:
+            return
+        labels = {"method": method.upper(), "endpoint": endpoint(url)}
+        self.update("http_requests", 1, dict(labels, status=status))
+        self.update("http_request_seconds", seconds, labels)
+        self.update("http_sent_bytes", sent, labels)
+        self.update("http_received_bytes", received, labels)
+        if retries:
+            self.update("http_retries", retries, labels)
+
+    @contextlib.contextmanager
+    def run(self, job: str):
+        """
+        Outermost sync entry point: on exit the last_run gauges are set and both files
+        written. A nested run, e.g. a delta sync falling back to a full one, is part of
+        the outer run.
+        """
+        if not self.enabled or self._run is not None:
+            yield
+            return
+        with self.lock:
+            self._run = (time.time(), time.perf_counter(), self.copy_values())
+            self.timeline = []
+        success = False
+        try:
+            yield
+            success = True
+        finally:
+            started, start, before = self._run
+            seconds = time.perf_counter() - start
+            self._run = None
+            self.set("last_run_timestamp_seconds", started + seconds, job=job)
+            self.set("last_run_duration_seconds", seconds, job=job)
+            self.set("last_run_success", float(success), job=job)
+            report = self.report(job, started, seconds, success, before)
+            try:
+                self.write(job, report)
+            except OSError as e:
+                logger.warning(f"Could not write the metrics of {job}: {e}")
+
+    def copy_values(self) -> dict:
+        return {
+            k: list(v) if isinstance(v, list) else v for k, v in self.values.items()
+        }
+
+    def report(
+        self, job: str, started: float, seconds: float, success: bool, before: dict
+    ) -> dict:
+        """
+        JSON report of a run: per-phase totals, the phase timeline and every metric
+        as its change since `before`.
+        """
+        with self.lock:
+            values = self.copy_values()
+            timeline = list(self.timeline)
+        metrics = {}
+        for (name, labels), value in sorted(values.items()):
+            old = before.get((name, labels))
+            kind = FAMILIES[name][0]
+            if kind == "gauge":
+                delta = value
+            elif isinstance(value, list):
+                delta = [v - o for v, o in zip(value, old)] if old else value
+                if not delta[-1]:
+                    continue
+                if kind == "summary":
+                    delta = {"sum": delta[0], "count": delta[1]}
+                else:
+                    buckets = dict(
+                        zip([str(b) for b in LATENCY_BUCKETS] + ["+Inf"], delta[:-2])
+                    )
+                    delta = {"sum": delta[-2], "count": delta[-1], "buckets": buckets}
+            else:
+                delta = value - (old or 0.0)
+                if not delta:
+                    continue
+            metrics.setdefault(name, []).append(
+                {"labels": dict(labels), "value": delta}
+            )
+        return {
+            "job": job,
+            "started": datetime.fromtimestamp(started, timezone.utc).isoformat(),
+            "seconds": seconds,
+            "success": success,
+            "phases": {
+                s["labels"]["phase"]: s["value"]["sum"]
+                for s in metrics.get("phase_seconds", [])
+            },
+            "timeline": timeline,
+            "metrics": metrics,
+        }
+
+    def openmetrics(self) -> str:
+        """
+        The registry in the OpenMetrics text format, cumulative since the process start.
+        """
+        with self.lock:
+            values = self.copy_values()
+        lines = []
+        for name, (kind, help_text) in FAMILIES.items():
+            samples = sorted((k[1], v) for k, v in values.items() if k[0] == name)
+            if not samples:
+                continue
+            family = f"{PREFIX}_{name}"
+            lines += [f"# TYPE {family} {kind}", f"# HELP {family} {help_text}"]
+            for labels, value in samples:
+                if kind == "counter":
+                    lines.append(f"{family}_total{format_labels(labels)} {value}")
+                elif kind == "gauge":
+                    lines.append(f"{family}{format_labels(labels)} {value}")
+                elif kind == "summary":
+                    lines.append(f"{family}_sum{format_labels(labels)} {value[0]}")
+                    lines.append(f"{family}_count{format_labels(labels)} {value[1]}")
+                else:
+                    cumulative = 0
+                    for bound, count in zip(
+                        [str(b) for b in LATENCY_BUCKETS] + ["+Inf"], value[:-2]
+                    ):
+                        cumulative += count
+                        le = format_labels(labels, f'le="{bound}"')
+                        lines.append(f"{family}_bucket{le} {cumulative}")
+                    lines.append(f"{family}_sum{format_labels(labels)} {value[-2]}")
+                    lines.append(f"{family}_count{format_labels(labels)} {value[-1]}")
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def write(self, job: str, report: dict, directory=None) -> Tuple[Path, Path]:
+        """
+        Write <job>.prom and <job>.json, each through a temporary file so a scraper
+        never reads a partial file.
+        """
+        directory = Path(
+            directory
+            or get_setting("metrics.dir")
+            or project_path("PATH_LOG") / "metrics"
+        )
+        directory.mkdir(parents=True, exist_ok=True)
+        paths = directory / f"{job}.prom", directory / f"{job}.json"
+        contents = self.openmetrics(), json.dumps(report, indent=2) + "\n"
+        for path, content in zip(paths, contents):
+            tmp = path.with_name(path.name + ".tmp")
+            tmp.write_text(content, encoding="utf-8")
+            os.replace(tmp, path)
+        logger.info(f"Metrics of {job} written to {paths[0]} and {paths[1]}")
+        return paths
+
+
+# process-wide registry, enabled by the pipelines when [metrics] enabled is set
+METRICS = Metrics()
@@ -0,0 +1,269 @@
+"""
+Profiling of sync runs, see main.py --profile.
+
+    with Profiler("zdb2dify", mode="sample", memory=True) as profiler:
+        pipeline = Pipeline(PipeConfig())
+        profiler.trace_allocations(pipeline)
+        pipeline.sync_zotero_attachments()
+
+Files are written under PATH_LOG/profile as <job>-<timestamp>.<ext> on exit:
+
+    .collapsed   -- "thread;frame;...;frame count" lines (sample mode), the input of
+                    flamegraph.pl, inferno or speedscope
+    .prof        -- pstats dump (cprofile mode), for snakeviz or python -m pstats
+    .txt         -- top-N hot functions
+    .memory.txt  -- with memory on, the allocations of each traced call by source line
+"""
+
+import functools
+import inspect
+import io
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from src.config import get_logger, project_path
+
+logger = get_logger()
+
+MODES = ("sample", "cprofile")
+# Pipeline methods traced with memory on: loading and diffing hold the whole library
+SYNC_HOOKS = (
+    "get_current_attachments",
+    "get_archived_attachments",
+    "apply_sync_actions",
+    "apply_sync_actions_async",
+)
+
+
+def short_path(filename: str) -> str:
+    """
+    filename relative to the sys.path entry it is under, e.g. requests/models.py.
+    """
+    roots = [
+        p for p in map(os.path.abspath, sys.path) if filename.startswith(p + os.sep)
+    ]
+    return os.path.relpath(filename, max(roots, key=len)) if roots else filename
+
+
+class StackSampler:
+    """
+    Sampling profiler: a daemon thread reads the stack of every other thread each
+    `interval` seconds and counts the collapsed stacks. Unlike cProfile it sees the
+    worker threads too, and the overhead does not depend on the number of calls.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._labels: Dict[object, str] = {}  # code object -> frame label
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="stack-sampler", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    self.stacks[self.collapse(names.get(ident, ident), frame)] += 1
+            self.samples += 1
+
+    def label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            filename = short_path(code.co_filename)
+            label = f"{code.co_qualname} ({filename}:{code.co_firstlineno})"
+            label = self._labels[code] = label.replace(";", ":")
+        return label
+
+    def collapse(self, thread, frame) -> str:
+        frames = []
+        while frame is not None:
+            frames.append(self.label(frame.f_code))
+            frame = frame.f_back
+        frames.append(str(thread))
+        return ";".join(reversed(frames))
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {n}\n" for stack, n in self.stacks.most_common())
+
+    def summary(self, top: int, seconds: float) -> str:
+        """
+        Functions with the most samples on top of the stack (self) and anywhere in it
+        (total), as a share of the sampling ticks: a function running in one thread for
+        the whole run is at 100%, idle threads waiting in select or a lock included.
+        """
+        own, total = Counter(), Counter()
+        for stack, n in self.stacks.items():
+            frames = stack.split(";")[1:]
+            own[frames[-1]] += n
+            for frame in set(frames):
+                total[frame] += n
+        count = self.samples or 1
+        lines = [
+            f"{self.samples} samples every {self.interval * 1000:.1f} ms over {seconds:.2f}s",
+            "",
+            f"{'self %':>7} {'total %':>8}  function",
+        ]
+        for frame, n in own.most_common(top):
+            lines.append(f"{n / count:7.1%} {total[frame] / count:8.1%}  {frame}")
+        return "\n".join(lines) + "\n"
+
+
+class Profiler:
+    """
+    Profile what runs inside the `with` block, then write the reports.
+    mode: "sample" (StackSampler), "cprofile" (deterministic, calling thread only) or
+    None for no CPU profile. memory: trace allocations of the methods handed to
+    trace_allocations. With neither, nothing is profiled or written.
+    """
+
+    def __init__(
+        self,
+        job: str,
+        mode: Optional[str] = "sample",
+        memory: bool = False,
+        interval: float = 0.005,
+        top: int = 30,
+        directory=None,
+    ):
+        if mode is not None and mode not in MODES:
+            raise ValueError(f"Unknown profile mode: {mode}, expected one of {MODES}")
+        self.job = job
+        self.mode = mode
+        self.memory = memory
+        self.interval = interval
+        self.top = top
+        self.directory = directory  # PATH_LOG/profile when None
+        self.memory_report: List[str] = []
+        self.paths: List[Path] = []
+        self._profiler = None
+        self._start = 0.0
+
+    def __enter__(self):
+        if self.memory:
+            tracemalloc.start()  # one frame per allocation, reported by line
+        if self.mode == "sample":
+            self._profiler = StackSampler(self.interval)
+            self._profiler.start()
+        elif self.mode == "cprofile":
+            import cProfile
+
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self._start
+        if self.mode == "sample":
+            self._profiler.stop()
+        elif self.mode == "cprofile":
+            self._profiler.disable()
+        if self.memory:
+            tracemalloc.stop()
+        if self.mode or self.memory:
+            self.write(seconds)
+
+    def write(self, seconds: float):
+        directory = Path(self.directory or project_path("PATH_LOG") / "profile")
+        directory.mkdir(parents=True, exist_ok=True)
+        stem = directory / f"{self.job}-{datetime.now():%Y%m%d-%H%M%S}"
+        files = {}
+        if self.mode == "sample":
+            files[".collapsed"] = self._profiler.collapsed()
+            files[".txt"] = self._profiler.summary(self.top, seconds)
+        elif self.mode == "cprofile":
+            import pstats
+
+            self._profiler.dump_stats(f"{stem}.prof")
+            self.paths.append(Path(f"{stem}.prof"))
+            out = io.StringIO()
+            stats = pstats.Stats(self._profiler, stream=out).strip_dirs()
+            stats.sort_stats("cumulative").print_stats(self.top)
+            stats.sort_stats("tottime").print_stats(self.top)
+            files[".txt"] = out.getvalue()
+        if self.memory:
+            files[".memory.txt"] = "\n".join(self.memory_report) or "no traced call\n"
+        for suffix, content in files.items():
+            path = Path(f"{stem}{suffix}")
+            path.write_text(content, encoding="utf-8")
+            self.paths.append(path)
+        logger.info(
+            f"Profile of {self.job} ({seconds:.2f}s) written to "
+            + ", ".join(str(p) for p in self.paths)
+        )
+
+    def trace_allocations(self, obj, names: Iterable[str] = SYNC_HOOKS):
+        """
+        Wrap the methods `names` of obj (a Pipeline by default) so every call is
+        bracketed by tracemalloc snapshots. A no-op with memory off.
+        """
+        if not self.memory:
+            return
+        for name in names:
+            method = getattr(obj, name, None)
+            if method is not None:
+                setattr(obj, name, self.traced(name, method))
+
+    def traced(self, name: str, method):
+        if inspect.iscoroutinefunction(method):
+
+            @functools.wraps(method)
+            async def async_wrapper(*args, **kwargs):
+                before = self.before_call()
+                try:
+                    return await method(*args, **kwargs)
+                finally:
+                    self.after_call(name, before)
+
+            return async_wrapper
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            before = self.before_call()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.after_call(name, before)
+
+        return wrapper
+
+    def before_call(self) -> tracemalloc.Snapshot:
+        tracemalloc.reset_peak()
+        return tracemalloc.take_snapshot()
+
+    def after_call(self, name: str, before: tracemalloc.Snapshot):
+        """
+        Allocations still held after the call, by source line, and its peak.
+        """
+        peak = tracemalloc.get_traced_memory()[1]
+        diff = [
+            d
+            for d in tracemalloc.take_snapshot().compare_to(before, "lineno")
+            # the sampler thread and the snapshots themselves
+            if d.traceback[0].filename not in (__file__, tracemalloc.__file__)
+        ]
+        held = sum(d.size_diff for d in diff)
+        self.memory_report.append(
+            f"{name}: {held / 2**20:+.1f} MiB held after the call, "
+            f"peak {peak / 2**20:.1f} MiB traced"
+        )
+        self.memory_report += [f"  {d}" for d in diff[: self.top]] + [""]
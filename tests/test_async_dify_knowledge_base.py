@@ -0,0 +1,167 @@
+import asyncio
+import json
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import aiohttp
+
+from src.handler.async_dify_knowledge_base import (
+    AsyncDifyKnowledgeBase,
+    AsyncRateLimiter,
+    DifyAPIError,
+)
+from src.handler.dify_knowledge_base import KBConfig
+
+
+class UploadHandler(BaseHTTPRequestHandler):
+    # answers the first `failures` uploads with `failure_status`, then returns a document id
+    failures = 1
+    failure_status = 429
+    delay = 0.0
+    calls = 0
+
+    def reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if status == 429:
+            self.send_header("Retry-After", "0")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        type(self).calls += 1
+        self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(type(self).delay)
+        if type(self).calls <= type(self).failures:
+            self.reply(type(self).failure_status, {"code": "too_many_requests"})
+        elif self.path.endswith("/document/create-by-file"):
+            self.reply(200, {"document": {"id": f"doc{type(self).calls}"}})
+        else:
+            self.reply(200, {"result": "success"})
+
+    def do_DELETE(self):
+        self.reply(404, {"code": "not_found"})
+
+    def log_message(self, *args):
+        pass
+
+
+class TestAsyncDifyKnowledgeBase(unittest.TestCase):
+    def setUp(self):
+        UploadHandler.calls = 0
+        UploadHandler.failures, UploadHandler.failure_status = 1, 429
+        UploadHandler.delay = 0.0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), UploadHandler)
+        threading.Thread(
+            target=self.server.serve_forever, args=(0.05,), daemon=True
+        ).start()
+        self.config = KBConfig(
+            api_key="k",
+            base_url=f"http://127.0.0.1:{self.server.server_port}",
+            backoff_factor=0,
+            backoff_jitter=0,
+        )
+        self.tmpfile = tempfile.NamedTemporaryFile(suffix=".md")
+        self.tmpfile.write(b"# test")
+        self.tmpfile.flush()
+
+    def tearDown(self):
+        self.tmpfile.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_upload_retries_429(self):
+        async def run():
+            async with AsyncDifyKnowledgeBase(self.config, concurrency=2) as kb:
+                return await kb.upload_document_by_file("ds1", self.tmpfile.name)
+
+        self.assertEqual(asyncio.run(run()), "doc2")
+        self.assertEqual(UploadHandler.calls, 2)
+
+    def test_concurrent_metadata_updates(self):
+        async def run():
+            async with AsyncDifyKnowledgeBase(
+                self.config, concurrency=4, rate_limit=0
+            ) as kb:
+                return await asyncio.gather(
+                    *(kb.update_document_metadata("ds1", f"d{i}", []) for i in range(8))
+                )
+
+        UploadHandler.failures = 0
+        try:
+            res = asyncio.run(run())
+        finally:
+            UploadHandler.failures = 1
+        self.assertEqual(len(res), 8)
+        self.assertEqual(UploadHandler.calls, 8)
+
+    def upload(self, **config):
+        async def run():
+            kb_config = KBConfig(**dict(vars(self.config), **config))
+            async with AsyncDifyKnowledgeBase(kb_config) as kb:
+                return await kb.upload_document_by_file("ds1", self.tmpfile.name)
+
+        return asyncio.run(run())
+
+    def test_upload_not_resent_after_read_timeout(self):
+        # the server may have created the document, a retry would create a second one
+        UploadHandler.failures, UploadHandler.delay = 0, 0.5
+        with self.assertRaises(asyncio.TimeoutError):
+            self.upload(upload_timeout=0.2)
+        self.assertEqual(UploadHandler.calls, 1)
+
+    def test_upload_not_resent_after_502(self):
+        UploadHandler.failure_status = 502
+        with self.assertRaises(DifyAPIError) as ctx:
+            self.upload()
+        self.assertEqual(ctx.exception.status, 502)
+        self.assertEqual(UploadHandler.calls, 1)
+
+    def test_retry_policy(self):
+        kb = AsyncDifyKnowledgeBase(self.config)
+        refused = aiohttp.ClientConnectorError(None, OSError(111, "refused"))
+        create = "http://dify/v1/datasets/ds1/document/create-by-file"
+        metadata = "http://dify/v1/datasets/ds1/documents/metadata"
+        self.assertTrue(kb.retryable("POST", create, error=refused))
+        self.assertFalse(kb.retryable("POST", create, error=asyncio.TimeoutError()))
+        self.assertTrue(kb.retryable("GET", create, error=asyncio.TimeoutError()))
+        self.assertTrue(kb.retryable("POST", create, 503))
+        self.assertFalse(kb.retryable("POST", create, 504))
+        self.assertTrue(kb.retryable("DELETE", create, 504))
+        self.assertFalse(kb.retryable("GET", create, 404))
+        # idempotent POSTs are retried like GET
+        self.assertTrue(kb.retryable("POST", metadata, 504))
+        self.assertTrue(kb.retryable("POST", metadata, error=asyncio.TimeoutError()))
+
+    def test_error_status_raises(self):
+        async def run():
+            async with AsyncDifyKnowledgeBase(self.config) as kb:
+                await kb.delete_document("ds1", "missing")
+
+        with self.assertRaises(DifyAPIError) as ctx:
+            asyncio.run(run())
+        self.assertEqual(ctx.exception.status, 404)
+
+
+class TestAsyncRateLimiter(unittest.TestCase):
+    def test_rate_limit_spacing(self):
+        async def run():
+            limiter = AsyncRateLimiter(rate=50)
+            start = time.monotonic()
+            await asyncio.gather(*(limiter.acquire() for _ in range(6)))
+            return time.monotonic() - start
+
+        # 6 starts at 50/s need at least 5 intervals of 20ms
+        self.assertGreaterEqual(asyncio.run(run()), 0.09)
+
+    def test_no_limit(self):
+        self.assertEqual(AsyncRateLimiter(rate=0).interval, 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
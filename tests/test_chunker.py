@@ -0,0 +1,104 @@
+import unittest
+
+from src.handler.chunker import Chunker, Segment, SegmentRule, byte_level_encoding
+
+
+def rule(max_tokens, overlap=0, parent_mode="paragraph", cleaning=True):
+    return {
+        "mode": "custom",
+        "rules": {
+            "pre_processing_rules": [
+                {"id": "remove_extra_spaces", "enabled": cleaning},
+                {"id": "remove_urls_emails", "enabled": cleaning},
+            ],
+            "segmentation": {"separator": "\n\n\n", "max_tokens": max_tokens},
+            "parent_mode": parent_mode,
+            "subchunk_segmentation": {
+                "separator": "\n\n",
+                "max_tokens": max_tokens,
+                "chunk_overlap": overlap,
+            },
+        },
+    }
+
+
+class TestChunker(unittest.TestCase):
+    # one token per byte, so token counts are lengths
+    encoding = byte_level_encoding()
+
+    def chunker(self, process_rule=None, **kwargs):
+        return Chunker(process_rule, encoding=self.encoding, **kwargs)
+
+    def test_default_rules(self):
+        chunker = self.chunker()
+        self.assertEqual(chunker.parent_rule, SegmentRule("\n\n\n", 4000))
+        self.assertEqual(chunker.child_rule, SegmentRule("\n\n", 500, 50))
+        text = "Intro one.\n\nIntro two.\n\n\n\nMethods.\n\n\n"
+        (segments,) = chunker.chunk([text])
+        self.assertEqual(
+            segments,
+            [
+                Segment(
+                    "Intro one.\n\nIntro two.",
+                    22,
+                    [Segment("Intro one.", 10), Segment("Intro two.", 10)],
+                ),
+                Segment("Methods.", 8, [Segment("Methods.", 8)]),
+            ],
+        )
+        stats = chunker.stats([segments, []])
+        self.assertEqual((stats.documents, stats.parents, stats.children), (2, 2, 3))
+        self.assertEqual((stats.parent_tokens, stats.child_tokens), (30, 28))
+
+    def test_cleaning_in_dify_order(self):
+        chunker = self.chunker()
+        text = "a\t\tb   c\x01\n\nmail x@y.org or https://x.org/p now"
+        (segments,) = chunker.chunk([text])
+        # spaces collapse before URLs and emails are removed, so the parent keeps the
+        # double spaces they leave and the children, cleaned again, do not
+        self.assertEqual(segments[0].text, "a b c\n\nmail  or  now")
+        self.assertEqual(
+            [c.text for c in segments[0].children], ["a b c", "mail or now"]
+        )
+        raw = self.chunker(rule(100, cleaning=False)).chunk(["a  b"])[0]
+        self.assertEqual(raw[0].text, "a  b")
+
+    def test_oversized_chunks_merged_with_overlap(self):
+        (segments,) = self.chunker(rule(10, overlap=4)).chunk(["aaa bbb ccc ddd eee"])
+        # the parent rule has no overlap
+        self.assertEqual([s.text for s in segments], ["aaa bbb", "ccc ddd", "eee"])
+        chunker = self.chunker(rule(10, overlap=4, parent_mode="full-doc"))
+        (segments,) = chunker.chunk(["aaa bbb ccc ddd eee"])
+        children = segments[0].children
+        self.assertEqual(
+            [c.text for c in children], ["aaa bbb", "bbb ccc", "ccc ddd", "ddd eee"]
+        )
+        self.assertTrue(all(c.tokens == 7 for c in children))
+        # no separator left: the token sequence is cut
+        (segments,) = self.chunker(rule(10)).chunk(["x" * 25])
+        self.assertEqual([s.tokens for s in segments], [10, 10, 5])
+
+    def test_full_doc(self):
+        chunker = self.chunker(rule(100, parent_mode="full-doc"))
+        (segments,) = chunker.chunk(["one\n\n\ntwo\n\nthree"])
+        self.assertEqual(len(segments), 1)
+        self.assertEqual(
+            [c.text for c in segments[0].children], ["one", "two", "three"]
+        )
+
+    def test_prechunked_text_keeps_boundaries(self):
+        chunker = self.chunker(rule(10, overlap=4))
+        (segments,) = chunker.chunk(["aaa bbb ccc ddd eee\n\n\nfff"])
+        again = chunker.split([chunker.prechunked_text(segments)], chunker.parent_rule)
+        self.assertEqual(again[0], [Segment(s.text, s.tokens) for s in segments])
+
+    def test_threaded_counts(self):
+        texts = [f"text {i} " * (i % 7 + 1) for i in range(500)]
+        serial = self.chunker(num_threads=1).count_tokens(texts)
+        threaded = self.chunker(num_threads=4).count_tokens(texts)
+        self.assertEqual(serial.tolist(), threaded.tolist())
+        self.assertEqual(serial[0], len(texts[0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
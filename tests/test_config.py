@@ -0,0 +1,72 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from dataclasses import dataclass
+from pathlib import Path
+from unittest.mock import patch
+
+from src import config
+from src.config import get_setting, load_config, setting
+
+REPO = Path(__file__).resolve().parents[1]
+
+
+class TestConfig(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_env_overrides_merged_over_base(self):
+        (self.dir / "config.toml").write_text(
+            '[dify.http]\npool_size = 10\nread_timeout = 30\n[zotero]\ndata_dir = "z"\n'
+        )
+        (self.dir / "config.prod.toml").write_text("[dify.http]\npool_size = 20\n")
+        (self.dir / "config.dev.toml").write_text("[dify.http]\npool_size = 30\n")
+        with patch.object(config, "CONFIG_DIR", str(self.dir)):
+            prod = load_config("prod")
+            base = load_config("test")
+        self.assertEqual(prod["dify"]["http"], {"pool_size": 20, "read_timeout": 30})
+        self.assertEqual(prod["zotero"], {"data_dir": "z"})
+        self.assertEqual(base["dify"]["http"]["pool_size"], 10)
+
+    def test_settings_resolved_per_instance(self):
+        @dataclass
+        class Settings:
+            pool_size: int = setting("dify.http.pool_size", 10)
+            missing: str = setting("no.such.key", lambda: "computed")
+
+        with patch.object(config, "get_config", return_value={}):
+            self.assertEqual(Settings(), Settings(10, "computed"))
+            self.assertIsNone(get_setting("dify.knowledge_base.api_key"))
+        conf = {"dify": {"http": {"pool_size": 3}}}
+        with patch.object(config, "get_config", return_value=conf):
+            self.assertEqual(Settings().pool_size, 3)
+
+    def test_import_is_lazy(self):
+        # run where there is no config directory at all
+        code = (
+            "import sys, main, src.config as c\n"
+            "assert c.get_config.cache_info().currsize == 0\n"
+            "assert c.get_project_root.cache_info().currsize == 0\n"
+            "heavy = {'aiohttp', 'numpy', 'tiktoken', 'docling', 'fastembed'}\n"
+            "print(sorted(heavy & set(sys.modules)))\n"
+        )
+        env = {**os.environ, "PYTHONPATH": str(REPO)}
+        out = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=self.dir,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        self.assertEqual(out.returncode, 0, out.stderr)
+        self.assertEqual(out.stdout.strip(), "[]")
+
+
+if __name__ == "__main__":
+    unittest.main()
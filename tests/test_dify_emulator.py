@@ -0,0 +1,136 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from benchmarks.dify_emulator import DifyEmulator
+from benchmarks.synthetic_zotero import build_zotero_db
+from src.config import get_config
+from src.handler.dify_knowledge_base import DifyKnowledgeBase, KBConfig
+from src.pipeline.zdb2dify import Pipeline, PipeConfig
+
+
+def kb_config(emulator, **kwargs):
+    return KBConfig(
+        api_key="",
+        base_url=emulator.base_url,
+        backoff_factor=0.0,
+        backoff_jitter=0.0,
+        cache_ttl=0,
+        **kwargs,
+    )
+
+
+class TestDifyEmulator(unittest.TestCase):
+    def setUp(self):
+        self.emulator = DifyEmulator()
+        self.emulator.start()
+        self.addCleanup(self.emulator.stop)
+        self.dataset_id = self.emulator.add_dataset("Zotero")
+        self.kb = DifyKnowledgeBase("Zotero", kb_config(self.emulator, page_size=3))
+        self.addCleanup(self.kb.close)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def write_file(self, name, content="text"):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        return path
+
+    def test_upload_list_and_delete(self):
+        self.assertEqual(self.kb.dataset_id, self.dataset_id)
+        ids = [
+            self.kb.upload_document_by_file(
+                self.dataset_id, self.write_file(f"{i}.md", "x" * i)
+            )
+            for i in range(7)
+        ]
+        # 7 documents over pages of 3, prefetched in parallel and kept in order
+        listed = self.kb.list_documents(self.dataset_id)
+        self.assertEqual([d["id"] for d in listed], ids)
+        self.assertEqual(self.emulator.stats.requests["list_documents"], 3)
+
+        new_id = self.kb.update_document_by_file(
+            self.dataset_id, ids[0], self.write_file("0.md", "updated")
+        )
+        self.assertEqual(new_id, ids[0])
+        self.assertEqual(self.emulator.documents(self.dataset_id)[0]["size"], 7)
+
+        self.kb.delete_document(self.dataset_id, ids[1])
+        self.assertEqual(len(self.emulator.documents(self.dataset_id)), 6)
+
+    def test_metadata_bisect_isolates_unknown_document(self):
+        field = self.kb.create_metadata(self.dataset_id, "itemKey", "string")
+        ids = [
+            self.kb.upload_document_by_text(self.dataset_id, f"{i}.md", "text")[
+                "document"
+            ]["id"]
+            for i in range(4)
+        ]
+        operations = [
+            (doc_id, [{"id": field["id"], "name": "itemKey", "value": f"K{i}"}])
+            for i, doc_id in enumerate(ids + ["missing"])
+        ]
+        result = self.kb.update_documents_metadata(self.dataset_id, operations)
+        self.assertEqual(sorted(result["success"]), sorted(ids))
+        self.assertEqual(list(result["failed"]), ["missing"])
+        values = [
+            d["doc_metadata"][0]["value"]
+            for d in self.emulator.documents(self.dataset_id)
+        ]
+        self.assertEqual(values, ["K0", "K1", "K2", "K3"])
+
+    def test_faults_are_retried(self):
+        self.emulator.config.rate_limit_ratio = 0.3
+        self.emulator.config.error_ratio = 0.3
+        for i in range(20):
+            self.kb.upload_document_by_text(self.dataset_id, f"{i}.md", "text")
+        self.assertEqual(len(self.emulator.documents(self.dataset_id)), 20)
+        self.assertEqual(self.emulator.stats.statuses[200], 20)
+        self.assertIn(429, self.emulator.stats.statuses)
+        self.assertIn(503, self.emulator.stats.statuses)
+
+    def test_api_key_and_unknown_route(self):
+        self.emulator.config.api_key = "secret"
+        with self.assertRaises(Exception):
+            self.kb.list_metadata(self.dataset_id)
+        self.assertEqual(self.emulator.stats.statuses, {401: 1})
+        self.emulator.config.api_key = ""
+        response = self.kb.request("GET", f"{self.emulator.base_url}/nothing")
+        self.assertEqual(response.status_code, 404)
+
+    def test_pipeline_sync(self):
+        build_zotero_db(
+            Path(self.tmpdir.name) / "zotero.sqlite",
+            n_items=12,
+            tagged_ratio=1.0,
+            attachments_per_item=1,
+            storage_files=True,
+            file_size=256,
+        )
+        with patch.dict(get_config(), {"zotero": {"data_dir": self.tmpdir.name}}):
+            pipeline = Pipeline(
+                PipeConfig(
+                    kb_name="Zotero",
+                    zotero_db=self.tmpdir.name,
+                    archive_path=os.path.join(self.tmpdir.name, "archive.sqlite"),
+                    concurrency=4,
+                    rate_limit=0,
+                    kb_config=kb_config(self.emulator),
+                )
+            )
+            self.addCleanup(pipeline.archive.close)
+            pipeline.sync_zotero_attachments()
+            documents = self.emulator.documents(self.dataset_id)
+            self.assertEqual(len(documents), 12)
+            self.assertTrue(all(d["doc_metadata"] for d in documents))
+            # a second sync of the unchanged library uploads nothing
+            uploads = self.emulator.stats.requests["create_by_file"]
+            pipeline.sync_zotero_attachments()
+            self.assertEqual(self.emulator.stats.requests["create_by_file"], uploads)
+
+
+if __name__ == "__main__":
+    unittest.main()
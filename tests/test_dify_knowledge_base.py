@@ -1,7 +1,20 @@
+import json
+import tempfile
+import threading
+import time
 import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import MagicMock, patch, PropertyMock
 import os
-from src.handler.dify_knowledge_base import DifyKnowledgeBase, Document
+
+import requests
+
+from src.handler.dify_knowledge_base import (
+    DifyAPIError,
+    DifyKnowledgeBase,
+    Document,
+    KBConfig,
+)
 from src.pipeline.zdb2dify import Pipeline, PipeConfig
 
 
@@ -65,6 +78,273 @@ class TestDifyKnowledgeBase(unittest.TestCase):
         self.assertEqual(res["name"], "newmeta")
 
 
+class TestDifyCache(unittest.TestCase):
+    def setUp(self):
+        self.dify = DifyKnowledgeBase("kb1", kb_config=KBConfig(cache_ttl=60))
+        self.dify.list_knowledge_base = MagicMock(
+            return_value={"data": [{"name": "kb1", "id": "id1"}]}
+        )
+        self.dify.list_metadata = MagicMock(
+            return_value=[{"name": "itemKey", "id": "m1"}]
+        )
+        self.dify.iter_documents = MagicMock(
+            side_effect=lambda dataset_id: iter(
+                [{"id": "docid1", "doc_metadata": [{"name": "itemKey", "value": "A"}]}]
+            )
+        )
+
+    def test_maps_fetched_once(self):
+        for _ in range(3):
+            self.assertEqual(self.dify.dataset_id, "id1")
+            self.assertEqual(self.dify.metadata, {"itemKey": "m1"})
+            self.assertEqual(self.dify.documents, {"A": "docid1"})
+        self.dify.list_knowledge_base.assert_called_once()
+        self.dify.list_metadata.assert_called_once_with("id1")
+        self.dify.iter_documents.assert_called_once_with("id1")
+
+    def test_invalidate(self):
+        self.dify.metadata
+        self.dify.invalidate("metadata")
+        self.dify.metadata
+        self.assertEqual(self.dify.list_metadata.call_count, 2)
+        self.dify.list_knowledge_base.assert_called_once()
+
+    def test_ttl_zero_disables_cache(self):
+        self.dify.kb_config = KBConfig(cache_ttl=0)
+        self.dify.documents
+        self.dify.documents
+        self.assertEqual(self.dify.iter_documents.call_count, 2)
+
+    def test_write_through(self):
+        self.assertEqual(self.dify.documents, {"A": "docid1"})
+        self.assertEqual(self.dify.metadata, {"itemKey": "m1"})
+        self.dify.remember_document("B", "docid2")
+        self.dify.forget_document("docid1")
+        self.assertEqual(self.dify.documents, {"B": "docid2"})
+        response = MagicMock(ok=True)
+        response.json.return_value = {"id": "m2", "name": "title", "type": "string"}
+        with patch.object(self.dify, "request", return_value=response):
+            self.dify.create_metadata("id1", "title", "string")
+        self.assertEqual(self.dify.metadata, {"itemKey": "m1", "title": "m2"})
+        self.dify.iter_documents.assert_called_once()
+        self.dify.list_metadata.assert_called_once()
+
+
+class TestDocumentPaging(unittest.TestCase):
+    def setUp(self):
+        self.dify = DifyKnowledgeBase("kb1", kb_config=KBConfig(page_size=100))
+        self.docs = [
+            {"id": f"doc{i}", "doc_metadata": [{"name": "itemKey", "value": f"K{i}"}]}
+            for i in range(250)
+        ]
+
+        def page(dataset_id, page, limit):
+            data = self.docs[(page - 1) * limit : page * limit]
+            return {
+                "data": data,
+                "has_more": page * limit < len(self.docs),
+                "limit": limit,
+                "total": len(self.docs),
+                "page": page,
+            }
+
+        self.dify.get_documents_page = MagicMock(side_effect=page)
+
+    def test_sequential(self):
+        docs = list(self.dify.iter_documents("id1", page_size=100, prefetch=0))
+        self.assertEqual(docs, self.docs)
+        self.assertEqual(self.dify.get_documents_page.call_count, 3)
+
+    def test_prefetch_keeps_order(self):
+        docs = list(self.dify.iter_documents("id1", page_size=30, prefetch=4))
+        self.assertEqual(docs, self.docs)
+        self.assertEqual(self.dify.get_documents_page.call_count, 9)
+
+    def test_documents_added_while_paging(self):
+        stream = self.dify.iter_documents("id1", page_size=100, prefetch=2)
+        first = [next(stream) for _ in range(100)]
+        self.docs.extend(
+            {"id": f"new{i}", "doc_metadata": []} for i in range(120)
+        )
+        self.assertEqual(first + list(stream), self.docs)
+
+    def test_documents_map_from_stream(self):
+        self.dify._dataset_id = "id1"
+        self.assertEqual(len(self.dify.documents), 250)
+        self.assertEqual(self.dify.documents["K249"], "doc249")
+
+
+class TestBatchMetadata(unittest.TestCase):
+    def setUp(self):
+        self.dify = DifyKnowledgeBase(kb_config=KBConfig(metadata_batch_size=4))
+        self.sent = []
+
+        def post(dataset_id, operations):
+            self.sent.append([doc_id for doc_id, _ in operations])
+            bad = [doc_id for doc_id, _ in operations if doc_id.startswith("bad")]
+            if bad:
+                raise DifyAPIError(400, f"invalid document {bad[0]}")
+            return {"result": "success"}
+
+        self.dify.post_metadata_operations = MagicMock(side_effect=post)
+
+    def test_chunking(self):
+        operations = [(f"d{i}", []) for i in range(10)]
+        res = self.dify.update_documents_metadata("ds1", operations)
+        self.assertEqual(len(self.sent), 3)
+        self.assertEqual(res["success"], [f"d{i}" for i in range(10)])
+        self.assertEqual(res["failed"], {})
+
+    def test_partial_failure_bisected(self):
+        operations = [("d0", []), ("bad1", []), ("d2", []), ("d3", [])]
+        res = self.dify.update_documents_metadata("ds1", operations)
+        self.assertEqual(sorted(res["success"]), ["d0", "d2", "d3"])
+        self.assertEqual(list(res["failed"]), ["bad1"])
+
+    def test_server_error_fails_whole_chunk(self):
+        self.dify.post_metadata_operations.side_effect = DifyAPIError(503, "down")
+        res = self.dify.update_documents_metadata("ds1", [("d0", []), ("d1", [])])
+        self.assertEqual(res["success"], [])
+        self.assertEqual(sorted(res["failed"]), ["d0", "d1"])
+        self.assertEqual(self.dify.post_metadata_operations.call_count, 1)
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    # answers the first `failures` requests with 503 + Retry-After, then 200
+    failures = 2
+    calls = 0
+
+    def do_GET(self):
+        type(self).calls += 1
+        if type(self).calls <= type(self).failures:
+            self.send_response(503)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"{}")
+            return
+        body = json.dumps({"data": [{"name": "kb1", "id": "id1"}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class UploadHandler(BaseHTTPRequestHandler):
+    # answers every POST with the next of `statuses` (200 once they run out) after `delay`
+    statuses = []
+    delay = 0.0
+    calls = 0
+
+    def do_POST(self):
+        type(self).calls += 1
+        self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(type(self).delay)
+        statuses = type(self).statuses
+        status = statuses[self.calls - 1] if self.calls <= len(statuses) else 200
+        body = json.dumps({"document": {"id": "doc1"}}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestDifySession(unittest.TestCase):
+    def setUp(self):
+        FlakyHandler.calls = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FlakyHandler)
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        base_url = f"http://127.0.0.1:{self.server.server_port}"
+        self.config = KBConfig(
+            api_key="k", base_url=base_url, backoff_factor=0, backoff_jitter=0
+        )
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_retry_on_503(self):
+        with DifyKnowledgeBase("kb1", kb_config=self.config) as dify:
+            self.assertEqual(dify.datasets, {"kb1": "id1"})
+        self.assertEqual(FlakyHandler.calls, 3)
+
+    def test_retries_exhausted(self):
+        config = KBConfig(api_key="k", base_url=self.config.base_url, max_retries=1)
+        with DifyKnowledgeBase("kb1", kb_config=config) as dify:
+            with self.assertRaises(Exception):
+                dify.list_knowledge_base()
+        self.assertEqual(FlakyHandler.calls, 2)
+
+    def upload_server(self, statuses=(), delay=0.0):
+        UploadHandler.statuses, UploadHandler.delay, UploadHandler.calls = (
+            list(statuses),
+            delay,
+            0,
+        )
+        server = ThreadingHTTPServer(("127.0.0.1", 0), UploadHandler)
+        threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return KBConfig(
+            api_key="k",
+            base_url=f"http://127.0.0.1:{server.server_port}",
+            backoff_factor=0,
+            backoff_jitter=0,
+            upload_timeout=0.2,
+        )
+
+    def test_upload_not_resent_after_read_timeout(self):
+        # the server may have created the document, a retry would create a second one
+        config = self.upload_server(delay=0.5)
+        with DifyKnowledgeBase(kb_config=config) as dify:
+            with self.assertRaises(requests.exceptions.ReadTimeout):
+                dify.upload_document_by_text("ds1", "a.md", "text")
+        self.assertEqual(UploadHandler.calls, 1)
+
+    def test_upload_retried_on_429_and_503_only(self):
+        config = self.upload_server(statuses=[429, 503])
+        with DifyKnowledgeBase(kb_config=config) as dify:
+            dify.upload_document_by_text("ds1", "a.md", "text")
+        self.assertEqual(UploadHandler.calls, 3)
+        config = self.upload_server(statuses=[502])
+        with DifyKnowledgeBase(kb_config=config) as dify:
+            with self.assertRaises(Exception):
+                dify.upload_document_by_text("ds1", "a.md", "text")
+        self.assertEqual(UploadHandler.calls, 1)
+
+    def test_metadata_retried_on_every_retry_status(self):
+        # setting metadata twice is harmless, a lost answer must not fail the item
+        config = self.upload_server(statuses=[502, 504])
+        with DifyKnowledgeBase(kb_config=config) as dify:
+            dify.update_document_metadata("ds1", "doc1", [])
+        self.assertEqual(UploadHandler.calls, 3)
+
+    def test_metadata_retried_after_read_timeout(self):
+        config = self.upload_server(delay=0.3)
+        config.read_timeout, config.max_retries = 0.1, 1
+        with DifyKnowledgeBase(kb_config=config) as dify:
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                dify.update_document_metadata("ds1", "doc1", [])
+        self.assertEqual(UploadHandler.calls, 2)
+
+    def test_session_config(self):
+        config = KBConfig(api_key="k", pool_size=4, max_retries=7)
+        dify = DifyKnowledgeBase(kb_config=config)
+        adapter = dify.session.get_adapter("https://example.com")
+        self.assertEqual(adapter._pool_maxsize, 4)
+        self.assertEqual(adapter.max_retries.total, 7)
+        self.assertIn(429, adapter.max_retries.status_forcelist)
+        self.assertEqual(dify.session.headers["Authorization"], "Bearer k")
+
+
 class TestZdb2DifyPipeline(unittest.TestCase):
     def setUp(self):
         # Mock all external dependencies before Pipeline instantiation
@@ -88,11 +368,19 @@ class TestZdb2DifyPipeline(unittest.TestCase):
         self.mock_zotero_cls = self.zotero_patcher.start()
         self.mock_zotero = self.mock_zotero_cls.return_value
         
-        self.pipeline = Pipeline(PipeConfig(kb_name="TestKB"))
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.pipeline = Pipeline(
+            PipeConfig(
+                kb_name="TestKB",
+                archive_path=os.path.join(self.tmpdir.name, "archive.sqlite"),
+            )
+        )
 
     def tearDown(self):
         self.dkb_patcher.stop()
         self.zotero_patcher.stop()
+        self.pipeline.archive.close()
+        self.tmpdir.cleanup()
 
     def test_upload_onefile(self):
         dummy_file = "dummy.md"
@@ -0,0 +1,69 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from src.handler.extraction_cache import ExtractionCache
+
+H1, H2, H3 = "aa" + "1" * 62, "bb" + "2" * 62, "aa" + "3" * 62
+
+
+class TestExtractionCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_put_get(self):
+        cache = ExtractionCache(self.root, "docling", "2.15.1")
+        self.assertIsNone(cache.get(H1))
+        cache.put(H1, "# Titel ünïcode")
+        cache.put(H2, "")
+        self.assertIn(H1, cache)
+        self.assertEqual(cache.get(H1), "# Titel ünïcode")
+        self.assertEqual(cache.get(H2), "")
+        with cache.mapped(H1) as m:
+            self.assertEqual(m[:7], b"# Titel")
+        # written atomically, no temporary file is left behind
+        self.assertEqual(
+            sorted(p.name for p in self.root.rglob("*") if p.is_file()),
+            sorted([f"{H1}.md", f"{H2}.md"]),
+        )
+
+    def test_keyed_by_extractor_version(self):
+        ExtractionCache(self.root, "docling", "1").put(H1, "old")
+        self.assertIsNone(ExtractionCache(self.root, "docling", "2").get(H1))
+        self.assertEqual(ExtractionCache(self.root, "docling", "1").get(H1), "old")
+
+    def test_lru_eviction(self):
+        cache = ExtractionCache(self.root, "docling", "1", max_bytes=25)
+        cache.put(H1, "x" * 10)
+        cache.put(H2, "y" * 10)
+        # reading H1 makes H2 the least recently used entry
+        os.utime(cache.path(H1), ns=(1, 1))
+        os.utime(cache.path(H2), ns=(2, 2))
+        cache.get(H1)
+        cache.put(H3, "z" * 10)
+        self.assertEqual(cache.get(H1), "x" * 10)
+        self.assertIsNone(cache.get(H2))
+        self.assertEqual(cache.get(H3), "z" * 10)
+        self.assertEqual(cache.size(), 20)
+
+    def test_eviction_leaves_room_for_next_puts(self):
+        cache = ExtractionCache(self.root, "docling", "1", max_bytes=100)
+        keys = [f"{i:02x}" + "0" * 62 for i in range(12)]
+        for key in keys[:11]:
+            cache.put(key, "x" * 10)
+        # evicted down to 90 bytes, not to 100
+        self.assertEqual(cache.size(), 90)
+        with patch.object(cache, "entries", wraps=cache.entries) as mock_entries:
+            cache.put(keys[11], "x" * 10)
+        mock_entries.assert_not_called()
+        self.assertEqual(cache.size(), 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
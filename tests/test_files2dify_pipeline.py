@@ -1,6 +1,9 @@
+import tempfile
 import unittest
+from pathlib import Path
 from unittest.mock import MagicMock, patch, PropertyMock
 from src.pipeline.files2dify import Pipeline, PipelineConfig
+from src.utils.hashing import hash_file
 
 
 class TestFiles2DifyPipeline(unittest.TestCase):
@@ -16,30 +19,104 @@ class TestFiles2DifyPipeline(unittest.TestCase):
         self.mock_dkb.dataset_id = "ds1"
         
         # Mock methods
-        self.mock_dkb.upload_document_by_file.return_value = {"document": {"id": "docid1", "name": "dummy.md"}}
+        self.mock_dkb.upload_document_by_file.return_value = "docid1"
         self.mock_dkb.update_document_metadata.return_value = {"code": 200}
         
-        self.config = PipelineConfig(kb_name="Files")
+        self.config = PipelineConfig(kb_name="Files", workers=2, retry_delay=0)
         self.pipeline = Pipeline(self.config)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmpdir.name)
 
     def tearDown(self):
         self.dkb_patcher.stop()
+        self.tmpdir.cleanup()
+
+    def write(self, relpath, content):
+        path = self.root / relpath
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+        return path
 
     def test_upload_onefile(self):
         dummy_file = "dummy.md"
         metadata_input = {"tags": "dummy", "itemKey": "k1"}
         res = self.pipeline.upload_onefile(dummy_file, metadata_input)
         self.assertEqual(res["upload"], "dummy.md")
+        self.assertEqual(res["document_id"], "docid1")
         self.assertEqual(res["update_metadata"]["code"], 200)
         self.mock_dkb.upload_document_by_file.assert_called_once()
         self.mock_dkb.update_document_metadata.assert_called_once()
 
     def test_upload_batchfile(self):
-        dummy_file = "dummy.md"
+        dummy_file = self.write("dummy.md", "text")
         metadata_input = {"tags": "dummy", "itemKey": "k1"}
         res_batch = self.pipeline.upload_batchfile([dummy_file], metadata_input)
         self.assertIsInstance(res_batch, list)
         self.assertEqual(res_batch[0]["upload"], "dummy.md")
+        vlist = self.mock_dkb.update_document_metadata.call_args[0][2]
+        # the content hash is the itemKey
+        self.assertEqual(
+            vlist, [{"id": 1, "name": "tags", "value": "dummy"},
+                    {"id": 2, "name": "itemKey", "value": hash_file(dummy_file)}]
+        )
+
+    def test_upload_dir_skips_known_content(self):
+        a = self.write("a.md", "same")
+        self.write("sub/copy.md", "same")
+        self.write("sub/b.pdf", "other")
+        self.write("c.md", "known")
+        self.pipeline.document_id_dict[hash_file(self.root / "c.md")] = "docid0"
+        self.mock_dkb.create_metadata.side_effect = lambda ds, name, type: {"id": name}
+        res = self.pipeline.upload_dir(self.root)
+        self.assertEqual([r["upload"] for r in res], ["a.md", "b.pdf"])
+        self.assertEqual(self.mock_dkb.upload_document_by_file.call_count, 2)
+        self.assertIn(hash_file(a), self.pipeline.document_id_dict)
+        # uploaded concurrently, in any order
+        (metadata,) = [
+            {v["name"]: v["value"] for v in call[0][2]}
+            for call in self.mock_dkb.update_document_metadata.call_args_list
+            if {"id": "relpath", "name": "relpath", "value": "sub/b.pdf"} in call[0][2]
+        ]
+        self.assertEqual(metadata["contentType"], "pdf")
+        self.assertEqual(metadata["fileSize"], 5)
+        # nothing left on a second run
+        self.assertEqual(self.pipeline.upload_dir(self.root), [])
+
+    def test_failed_files_retried(self):
+        files = [self.write(f"{i}.md", str(i)) for i in range(3)]
+        self.mock_dkb.upload_document_by_file.side_effect = [
+            "d0", ConnectionError("reset"), "d2", "d1"
+        ]
+        res = self.pipeline.upload_batchfile(files)
+        self.assertEqual(len(res), 3)
+        self.assertEqual(self.pipeline.failed, {})
+        self.mock_dkb.upload_document_by_file.side_effect = ConnectionError("down")
+        res = self.pipeline.upload_batchfile([self.write("3.md", "3")])
+        self.assertEqual(res, [])
+        self.assertEqual(list(self.pipeline.failed.values()), ["down"])
+        self.assertEqual(self.mock_dkb.upload_document_by_file.call_count, 4 + 3)
+
+    def test_failed_metadata_retried_without_upload(self):
+        path = self.write("a.md", "a")
+        self.mock_dkb.update_document_metadata.side_effect = [
+            ConnectionError("reset"), {"code": 200}
+        ]
+        res = self.pipeline.upload_batchfile([path])
+        self.assertEqual(res[0]["document_id"], "docid1")
+        self.assertEqual(self.pipeline.failed, {})
+        # one document, its metadata set on the retry pass
+        self.mock_dkb.upload_document_by_file.assert_called_once()
+        self.assertEqual(self.mock_dkb.update_document_metadata.call_count, 2)
+        self.assertEqual(
+            self.mock_dkb.update_document_metadata.call_args[0][1], "docid1"
+        )
+
+    def test_upload_batchfile_creates_metadata_fields(self):
+        self.mock_dkb.create_metadata.side_effect = lambda ds, name, type: {"id": name}
+        self.pipeline.upload_batchfile([self.write("a.md", "a")])
+        self.assertIn("contentType", self.pipeline.metadata_id_dict)
+        vlist = self.mock_dkb.update_document_metadata.call_args[0][2]
+        self.assertIn({"id": "contentType", "name": "contentType", "value": "md"}, vlist)
 
     def test_upload_onefile_missing_metadata(self):
         dummy_file = "dummy.md"
@@ -0,0 +1,107 @@
+import tempfile
+import unittest
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+from src.handler.local_index import LocalIndex, split_paragraphs, tokenize
+
+
+class HashingEmbedder:
+    """
+    Bag of hashed words, so texts sharing words are close.
+    """
+
+    model_name = "hashing-64"
+
+    def __init__(self):
+        self.embedded = []
+
+    def __call__(self, texts):
+        self.embedded.extend(texts)
+        vectors = np.zeros((len(texts), 64), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for token in tokenize(text):
+                vectors[i, zlib.crc32(token.encode()) % 64] += 1
+        return vectors
+
+
+class TestLocalIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpdir.name) / "index.sqlite"
+        self.embed = HashingEmbedder()
+        self.index = LocalIndex(self.path, embed=self.embed)
+
+    def tearDown(self):
+        self.index.close()
+        self.tmpdir.cleanup()
+
+    def fill(self):
+        self.index.upsert("K1", ["urban heat island in cities", "street trees"])
+        self.index.upsert("K2", ["graph neural network for traffic"])
+        self.index.upsert("K3", ["rural land use change", "crop yield"])
+
+    def test_upsert_search_delete(self):
+        self.fill()
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(self.index.search_keys("urban heat", k=1), ["K1"])
+        hits = self.index.search("traffic network")
+        self.assertEqual(hits[0].itemKey, "K2")
+        self.assertEqual(hits[0].text, "graph neural network for traffic")
+        # one hit per item, by its best chunk
+        self.assertEqual(len({h.itemKey for h in hits}), len(hits))
+        self.index.delete("K2")
+        self.assertNotIn("K2", self.index)
+        self.assertNotIn("K2", self.index.search_keys("traffic network"))
+
+    def test_only_new_chunks_embedded(self):
+        self.fill()
+        self.embed.embedded.clear()
+        self.index.upsert("K1", ["urban heat island in cities", "green roofs"])
+        self.assertEqual(self.embed.embedded, ["green roofs"])
+
+    def test_updates_after_load(self):
+        self.fill()
+        self.index.search("anything")
+        self.index.upsert("K3", ["urban heat in rural towns"])
+        self.index.upsert("K4", ["heat waves"])
+        self.assertEqual(
+            self.index.search("rural towns")[0].text, "urban heat in rural towns"
+        )
+        self.assertNotIn("crop", self.index.postings)
+        self.assertEqual(self.index.search_keys("waves", k=1), ["K4"])
+
+    def test_bm25_ranks_rare_terms(self):
+        for i in range(20):
+            self.index.upsert(f"C{i}", [f"common words in document {i}"])
+        self.index.upsert("R", ["common words with a rare term"])
+        self.index.load()
+        scores = self.index.bm25_scores("rare")
+        (top,) = self.index.top_rows(scores, 5, positive=True)
+        self.assertEqual(self.index.item_keys[top], "R")
+
+    def test_persists_and_checks_model(self):
+        self.fill()
+        self.index.close()
+        self.index = LocalIndex(self.path, embed=self.embed)
+        self.assertEqual(self.index.search_keys("crop yield", k=1), ["K3"])
+        self.index.close()
+
+        class OtherEmbedder(HashingEmbedder):
+            model_name = "other"
+
+        # vectors of another model are not comparable, the index starts over
+        self.index = LocalIndex(self.path, embed=OtherEmbedder())
+        self.assertEqual(len(self.index), 0)
+
+    def test_split_paragraphs(self):
+        text = "one\n\ntwo\n \nthree\n\n" + "x" * 20
+        self.assertEqual(
+            split_paragraphs(text, max_chars=15), ["one\n\ntwo\n\nthree", "x" * 20]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,196 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from benchmarks.dify_emulator import DifyEmulator, EmulatorConfig
+from benchmarks.synthetic_zotero import build_zotero_db
+from src.config import get_config
+from src.handler.async_dify_knowledge_base import AsyncDifyKnowledgeBase
+from src.handler.dify_knowledge_base import DifyKnowledgeBase, KBConfig
+from src.pipeline.zdb2dify import Pipeline, PipeConfig
+from src.utils.metrics import METRICS, Metrics, endpoint
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.metrics = Metrics(enabled=True)
+
+    def test_disabled_records_nothing(self):
+        metrics = Metrics()
+        with metrics.phase("diff"), metrics.run("job"):
+            metrics.inc("sync_actions", action="upload", result="success")
+            metrics.observe_request("GET", "http://x/v1/datasets", 200, 0.1)
+        self.assertEqual(metrics.values, {})
+        self.assertEqual(metrics.timed("diff")(lambda x: x + 1)(1), 2)
+        self.assertEqual(metrics.values, {})
+
+    def test_endpoint(self):
+        doc = "0b7e8f9c-5a6d-4c3b-8a2f-1e0d9c8b7a65"
+        self.assertEqual(
+            endpoint(f"http://dify/v1/datasets/{doc}/documents/{doc}/update-by-file"),
+            "/datasets/{id}/documents/{id}/update-by-file",
+        )
+        self.assertEqual(endpoint("http://dify/v1/datasets?page=2"), "/datasets")
+
+    def test_openmetrics(self):
+        self.metrics.inc("sync_actions", 3, action="upload", result="success")
+        self.metrics.observe_request("POST", "http://x/v1/datasets", 200, 0.02, 10, 5)
+        self.metrics.observe_request(
+            "POST", "http://x/v1/datasets", 503, 0.2, retries=2
+        )
+        with self.metrics.phase('say "hi"'):
+            pass
+        text = self.metrics.openmetrics()
+        self.assertIn(
+            'zogents_sync_actions_total{action="upload",result="success"} 3.0', text
+        )
+        self.assertIn(
+            'zogents_http_request_seconds_bucket{endpoint="/datasets",method="POST",le="0.025"} 1',
+            text,
+        )
+        self.assertIn(
+            'zogents_http_request_seconds_bucket{endpoint="/datasets",method="POST",le="+Inf"} 2',
+            text,
+        )
+        self.assertIn(
+            'zogents_http_retries_total{endpoint="/datasets",method="POST"} 2', text
+        )
+        self.assertIn('zogents_phase_seconds_count{phase="say \\"hi\\""} 1', text)
+        self.assertTrue(text.endswith("# EOF\n"))
+
+    def test_run_writes_report_of_the_run(self):
+        self.metrics.inc("sync_actions", 5, action="upload", result="success")
+        with patch.dict(get_config(), {"metrics": {"dir": self.tmpdir.name}}):
+            with self.metrics.run("job"):
+                with self.metrics.run("job"):  # nested, part of the outer run
+                    with self.metrics.phase("diff"):
+                        self.metrics.inc(
+                            "sync_actions", 2, action="upload", result="success"
+                        )
+            with self.assertRaises(ValueError):
+                with self.metrics.run("failing"):
+                    raise ValueError
+
+        report = json.loads((Path(self.tmpdir.name) / "job.json").read_text())
+        self.assertTrue(report["success"])
+        self.assertEqual(list(report["phases"]), ["diff"])
+        self.assertEqual(report["timeline"][0]["phase"], "diff")
+        # the report holds the change during the run, the textfile the running total
+        self.assertEqual(report["metrics"]["sync_actions"][0]["value"], 2.0)
+        prom = (Path(self.tmpdir.name) / "job.prom").read_text()
+        self.assertIn(
+            'zogents_sync_actions_total{action="upload",result="success"} 7.0', prom
+        )
+        failing = json.loads((Path(self.tmpdir.name) / "failing.json").read_text())
+        self.assertFalse(failing["success"])
+        self.assertEqual(os.listdir(self.tmpdir.name).count("job.prom.tmp"), 0)
+
+
+class TestPipelineMetrics(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.emulator = DifyEmulator(EmulatorConfig(error_ratio=0.3))
+        self.emulator.start()
+        self.addCleanup(self.emulator.stop)
+        self.emulator.add_dataset("Zotero")
+        self.kb_config = KBConfig(
+            api_key="",
+            base_url=self.emulator.base_url,
+            backoff_factor=0.0,
+            backoff_jitter=0.0,
+        )
+        METRICS.reset()
+        self.addCleanup(METRICS.reset)
+        self.addCleanup(METRICS.enable, False)
+
+    def test_sync_reports_phases_requests_and_actions(self):
+        build_zotero_db(
+            Path(self.tmpdir.name) / "zotero.sqlite",
+            n_items=5,
+            tagged_ratio=1.0,
+            attachments_per_item=1,
+            storage_files=True,
+            file_size=128,
+        )
+        metrics_dir = Path(self.tmpdir.name) / "metrics"
+        settings = {
+            "zotero": {"data_dir": self.tmpdir.name},
+            "metrics": {"dir": str(metrics_dir)},
+        }
+        with patch.dict(get_config(), settings):
+            pipeline = Pipeline(
+                PipeConfig(
+                    kb_name="Zotero",
+                    zotero_db=self.tmpdir.name,
+                    archive_path=os.path.join(self.tmpdir.name, "archive.sqlite"),
+                    kb_config=self.kb_config,
+                    metrics=True,
+                )
+            )
+            self.addCleanup(pipeline.archive.close)
+            errors = self.emulator.stats.statuses.get(503, 0)
+            pipeline.sync_modified_attachments()  # no mark yet: a full sync, one run
+
+        report = json.loads((metrics_dir / "zdb2dify.json").read_text())
+        self.assertTrue(report["success"])
+        for phase in ("zotero.query", "archive.load", "diff", "dify.actions"):
+            self.assertIn(phase, report["phases"])
+        actions = {
+            s["labels"]["action"]: s["value"]
+            for s in report["metrics"]["sync_actions"]
+            if s["labels"]["result"] == "success"
+        }
+        self.assertEqual(actions["upload"], 5.0)
+        requests = {
+            (s["labels"]["endpoint"], s["labels"]["status"]): s["value"]
+            for s in report["metrics"]["http_requests"]
+        }
+        self.assertEqual(requests[("/datasets/{id}/document/create-by-file", "200")], 5)
+        # 503s were retried by the session and show up as retries, not as requests
+        retries = sum(s["value"] for s in report["metrics"]["http_retries"])
+        self.assertGreater(retries, 0)
+        self.assertEqual(retries, self.emulator.stats.statuses[503] - errors)
+        sent = {
+            s["labels"]["endpoint"]: s["value"]
+            for s in report["metrics"]["http_sent_bytes"]
+        }
+        self.assertGreater(sent["/datasets/{id}/document/create-by-file"], 5 * 128)
+
+    def test_async_client_requests(self):
+        dataset_id = self.emulator.add_dataset("Async")
+        path = Path(self.tmpdir.name) / "paper.pdf"
+        path.write_bytes(b"x" * 1000)
+        METRICS.enable()
+
+        async def upload():
+            async with AsyncDifyKnowledgeBase(self.kb_config, rate_limit=0) as kb:
+                for _ in range(5):
+                    await kb.upload_document_by_file(dataset_id, str(path))
+
+        asyncio.run(upload())
+        labels = (
+            ("endpoint", "/datasets/{id}/document/create-by-file"),
+            ("method", "POST"),
+        )
+        self.assertEqual(
+            METRICS.values[("http_requests", labels + (("status", "200"),))], 5
+        )
+        self.assertGreater(METRICS.values[("http_sent_bytes", labels)], 5 * 1000)
+        self.assertEqual(METRICS.values[("http_request_seconds", labels)][-1], 5)
+
+    def test_disabled_session_request_untouched(self):
+        kb = DifyKnowledgeBase("Zotero", self.kb_config)
+        self.addCleanup(kb.close)
+        self.assertTrue(kb.dataset_id)
+        self.assertEqual(METRICS.values, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
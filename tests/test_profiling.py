@@ -0,0 +1,81 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+
+from src.utils.profiling import Profiler
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    n = 0
+    while time.perf_counter() < end:
+        n += 1
+    return n
+
+
+class Loader:
+    def get_current_attachments(self):
+        return [str(i) * 10 for i in range(20000)]
+
+    async def apply_sync_actions_async(self):
+        await asyncio.sleep(0)
+        return bytearray(1 << 20)
+
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def read(self, profiler, suffix):
+        path = next(p for p in profiler.paths if p.name.endswith(suffix))
+        return path.read_text(encoding="utf-8")
+
+    def test_sample_mode_writes_collapsed_stacks(self):
+        with Profiler("job", interval=0.001, directory=self.tmpdir.name) as profiler:
+            busy(0.2)
+        collapsed = self.read(profiler, ".collapsed")
+        line = next(line for line in collapsed.splitlines() if "busy (" in line)
+        stack, count = line.rsplit(" ", 1)
+        self.assertTrue(stack.startswith("MainThread;"))
+        self.assertGreater(int(count), 0)
+        summary = self.read(profiler, ".txt")
+        self.assertIn("busy (", summary)
+
+    def test_cprofile_mode(self):
+        with Profiler("job", "cprofile", directory=self.tmpdir.name) as profiler:
+            busy(0.01)
+        self.assertTrue(any(p.suffix == ".prof" for p in profiler.paths))
+        self.assertIn("busy", self.read(profiler, ".txt"))
+
+    def test_memory_traces_hooked_calls(self):
+        loader = Loader()
+        with Profiler("job", None, memory=True, directory=self.tmpdir.name) as profiler:
+            profiler.trace_allocations(loader)
+            attachments = loader.get_current_attachments()
+            buffer = asyncio.run(loader.apply_sync_actions_async())
+        self.assertEqual(len(attachments), 20000)
+        self.assertEqual(len(buffer), 1 << 20)
+        report = self.read(profiler, ".memory.txt")
+        self.assertIn("get_current_attachments: +", report)
+        self.assertIn("apply_sync_actions_async: +1.0 MiB", report)
+        self.assertIn("test_profiling.py", report)
+        self.assertEqual([p.name[-11:] for p in profiler.paths], [".memory.txt"])
+
+    def test_off_writes_nothing(self):
+        loader = Loader()
+        with Profiler("job", None, directory=self.tmpdir.name) as profiler:
+            profiler.trace_allocations(loader)
+            loader.get_current_attachments()
+        self.assertNotIn("get_current_attachments", vars(loader))
+        self.assertEqual(os.listdir(self.tmpdir.name), [])
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            Profiler("job", "perf")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from dataclasses import asdict
+
+from src.handler.sync_archive import SyncArchive
+from src.handler.zotero_database import Attachment, ParentItem
+
+
+def make_attachment(key, parent_key="PK", tags=("t1",)):
+    parent = ParentItem(
+        itemID=1, key=parent_key, tags=list(tags), title="PT", itemTypeID=22
+    )
+    return Attachment(
+        itemID=2,
+        itemKey=key,
+        contentType="application/pdf",
+        relpath=f"storage/{key}/a.pdf",
+        title="T",
+        parentItem=parent,
+    )
+
+
+class TestSyncArchive(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "archive.sqlite")
+        self.archive = SyncArchive(self.path)
+
+    def tearDown(self):
+        self.archive.close()
+        self.tmpdir.cleanup()
+
+    def test_put_get_delete(self):
+        a = make_attachment("A")
+        self.archive.put(a)
+        self.assertIn("A", self.archive)
+        self.assertEqual(self.archive.get("A"), a)
+        self.assertIsNone(self.archive.get("missing"))
+        self.archive.delete("A")
+        self.assertEqual(len(self.archive), 0)
+
+    def test_persisted_across_reopen(self):
+        self.archive.put_many([make_attachment("A"), make_attachment("B")])
+        self.archive.close()
+        self.archive = SyncArchive(self.path)
+        self.assertEqual(sorted(self.archive.keys()), ["A", "B"])
+
+    def test_keyed_lookups_and_scan(self):
+        self.archive.put_many(
+            [make_attachment(f"K{i:03d}", parent_key=f"P{i % 3}") for i in range(600)]
+        )
+        many = self.archive.get_many([f"K{i:03d}" for i in range(0, 600, 2)] + ["X"])
+        self.assertEqual(len(many), 300)
+        by_parent = self.archive.get_by_parents(["P0"])
+        self.assertEqual(len(by_parent), 200)
+        self.assertTrue(all(a.parentItem.key == "P0" for a in by_parent.values()))
+        keys = [a.itemKey for a in self.archive.scan("K100", "K110")]
+        self.assertEqual(keys, [f"K{i}" for i in range(100, 110)])
+
+    def test_parents_interned_on_load(self):
+        self.archive.put_many(
+            [make_attachment("A"), make_attachment("B"), make_attachment("C", "P2")]
+        )
+        items = self.archive.items()
+        self.assertIs(items["A"].parentItem, items["B"].parentItem)
+        self.assertIsNot(items["A"].parentItem, items["C"].parentItem)
+        many = self.archive.get_many(["A", "B"])
+        self.assertIs(many["A"].parentItem, many["B"].parentItem)
+
+    def test_replace_all(self):
+        self.archive.put_many([make_attachment("A"), make_attachment("B")])
+        self.archive.replace_all([make_attachment("C")])
+        self.assertEqual(self.archive.keys(), ["C"])
+
+    def test_migrate_json(self):
+        json_path = os.path.join(self.tmpdir.name, "zdb_attachments.json")
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump([asdict(make_attachment("A")), asdict(make_attachment("B"))], f)
+        self.assertEqual(self.archive.migrate_json(json_path), 2)
+        self.assertFalse(os.path.exists(json_path))
+        self.assertTrue(os.path.exists(json_path + ".migrated"))
+        self.assertEqual(self.archive.get("B"), make_attachment("B"))
+
+    def test_journal_marks_actions_done_with_archive_writes(self):
+        a, b, c = make_attachment("A"), make_attachment("B"), make_attachment("C")
+        self.archive.put(c)
+        run_id = self.archive.journal_begin(
+            [("upload", a), ("upload", b), ("delete", c)]
+        )
+        self.archive.put_many([a], run_id=run_id, action="upload")
+        self.archive.delete_many(["C"], run_id=run_id)
+        # interrupted here: only B is still pending
+        self.archive.close()
+        self.archive = SyncArchive(self.path)
+        self.assertEqual(self.archive.journal_pending(), [("upload", b)])
+        self.assertEqual(self.archive.keys(), ["A"])
+
+    def test_journal_failed_and_finished_runs_not_pending(self):
+        a, b = make_attachment("A"), make_attachment("B")
+        run_id = self.archive.journal_begin([("upload", a)])
+        self.archive.journal_fail(run_id, "upload", "A", "boom")
+        self.assertEqual(self.archive.journal_pending(), [])
+        run_id = self.archive.journal_begin([("update", b)])
+        self.archive.journal_finish(run_id)
+        self.assertEqual(self.archive.journal_pending(), [])
+
+    def test_journal_document_ids_and_superseded_entries(self):
+        a, b = make_attachment("A"), make_attachment("B", tags=("old",))
+        run_id = self.archive.journal_begin([("upload", a), ("update", b)])
+        self.archive.journal_document(run_id, "upload", "A", "doc-a")
+        self.assertEqual(
+            self.archive.journal_pending_documents(),
+            [("upload", a, "doc-a"), ("update", b, None)],
+        )
+        # a later sync archived B with newer tags, the old update is no longer pending
+        self.archive.put(make_attachment("B", tags=("new",)))
+        self.assertEqual(self.archive.journal_pending(), [("upload", a)])
+
+    def test_journal_without_doc_id_migrated(self):
+        self.archive.close()
+        os.remove(self.path)
+        db = sqlite3.connect(self.path)
+        db.execute(
+            "CREATE TABLE journal (id INTEGER PRIMARY KEY, runId TEXT NOT NULL, "
+            "action TEXT NOT NULL, itemKey TEXT NOT NULL, data TEXT NOT NULL, "
+            "status TEXT NOT NULL DEFAULT 'pending', error TEXT, updatedAt REAL NOT NULL)"
+        )
+        db.close()
+        self.archive = SyncArchive(self.path)
+        run_id = self.archive.journal_begin([("upload", make_attachment("A"))])
+        self.archive.journal_document(run_id, "upload", "A", "doc-a")
+        self.assertEqual(self.archive.journal_pending_documents()[0][2], "doc-a")
+
+
+if __name__ == "__main__":
+    unittest.main()
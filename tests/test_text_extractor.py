@@ -0,0 +1,81 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from src.handler.extraction_cache import ExtractionCache
+from src.handler.text_extractor import TextExtractor
+
+
+def fake_convert(path):
+    # module level so the worker processes can unpickle it
+    content = Path(path).read_text(encoding="utf-8")
+    if content.startswith("corrupt"):
+        raise ValueError("not a document")
+    return f"# {content}"
+
+
+class CountingConvert:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, path):
+        self.calls.append(path)
+        return fake_convert(path)
+
+
+class TestTextExtractor(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, name, content):
+        path = self.root / name
+        path.write_text(content, encoding="utf-8")
+        return path
+
+    def test_converted_once_per_content(self):
+        a = self.write("a.pdf", "same")
+        b = self.write("b.pdf", "same")
+        convert = CountingConvert()
+        cache = ExtractionCache(self.root / "cache", "fake", "1")
+        extractor = TextExtractor(cache, workers=1, convert=convert)
+        self.assertEqual(
+            extractor.extract_many([(a, None), (b, None)]), {a: "# same", b: "# same"}
+        )
+        self.assertEqual(len(convert.calls), 1)
+        # cached on disk, a later run converts nothing
+        again = TextExtractor(
+            ExtractionCache(self.root / "cache", "fake", "1"),
+            workers=1,
+            convert=convert,
+        )
+        self.assertEqual(again.extract_many([(b, None)]), {b: "# same"})
+        self.assertEqual(len(convert.calls), 1)
+
+    def test_process_pool_skips_failures(self):
+        paths = [self.write(f"{i}.pdf", f"doc {i}") for i in range(4)]
+        bad = self.write("bad.pdf", "corrupt")
+        cache = ExtractionCache(self.root / "cache", "fake", "1")
+        extractor = TextExtractor(cache, workers=2, convert=fake_convert)
+        texts = extractor.extract_many([(p, None) for p in paths + [bad]])
+        self.assertEqual(texts, {p: f"# doc {i}" for i, p in enumerate(paths)})
+        self.assertEqual(len(cache.entries()), 4)
+        extractor.close()
+
+    def test_pool_kept_across_batches(self):
+        paths = [self.write(f"{i}.pdf", f"doc {i}") for i in range(4)]
+        cache = ExtractionCache(self.root / "cache", "fake", "1")
+        with TextExtractor(cache, workers=2, convert=fake_convert) as extractor:
+            extractor.extract_many([(p, None) for p in paths[:2]])
+            pool = extractor._pool
+            texts = extractor.extract_many([(p, None) for p in paths[2:]])
+            self.assertIs(extractor._pool, pool)
+        self.assertEqual(texts, {p: f"# doc {i}" for i, p in enumerate(paths) if i >= 2})
+        self.assertIsNone(extractor._pool)
+
+
+if __name__ == "__main__":
+    unittest.main()
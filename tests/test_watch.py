@@ -0,0 +1,86 @@
+import unittest
+from unittest.mock import MagicMock
+
+from src.pipeline.watch import WatchConfig, ZoteroWatcher
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestZoteroWatcher(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.pipeline = MagicMock()
+        self.fingerprint = {"change_counter": 1}
+        self.pipeline.zotero_conn.fingerprint.side_effect = lambda: dict(
+            self.fingerprint
+        )
+        self.watcher = ZoteroWatcher(
+            self.pipeline,
+            WatchConfig(
+                poll_interval=1, debounce=3, max_delay=10, full_sync_interval=0
+            ),
+            clock=self.clock,
+            sleep=self.clock.sleep,
+        )
+
+    def change(self):
+        self.fingerprint["change_counter"] += 1
+
+    def tick(self, seconds=1):
+        self.clock.sleep(seconds)
+        return self.watcher.step()
+
+    def test_no_sync_without_changes(self):
+        for _ in range(20):
+            self.assertIsNone(self.tick())
+        self.pipeline.sync_modified_attachments.assert_not_called()
+
+    def test_burst_debounced_into_one_sync(self):
+        results = []
+        for _ in range(3):  # edits one second apart
+            self.change()
+            results.append(self.tick())
+        results += [self.tick() for _ in range(5)]
+        self.assertEqual(results.count("delta"), 1)
+        self.pipeline.sync_modified_attachments.assert_called_once()
+        self.pipeline.zotero_conn.refresh.assert_called_once()
+
+    def test_continuous_edits_synced_after_max_delay(self):
+        results = []
+        for _ in range(12):
+            self.change()
+            results.append(self.tick())
+        # first change seen at t=1, synced at t=11 although edits never pause
+        self.assertEqual(results.index("delta"), 10)
+
+    def test_failed_sync_retried(self):
+        self.pipeline.sync_modified_attachments.side_effect = [Exception("down"), None]
+        self.change()
+        results = [self.tick() for _ in range(10)]
+        self.assertEqual(self.pipeline.sync_modified_attachments.call_count, 2)
+        self.assertEqual(results.count("delta"), 2)
+        self.assertIsNone(self.watcher.first_change)
+
+    def test_periodic_full_sync(self):
+        self.watcher.config.full_sync_interval = 5
+        results = [self.tick() for _ in range(10)]
+        self.assertEqual(results.count("full"), 2)
+        self.pipeline.sync_zotero_attachments.assert_called()
+
+    def test_run_catches_up_first(self):
+        self.watcher.run(max_steps=2)
+        self.pipeline.sync_modified_attachments.assert_called_once()
+        self.assertEqual(self.clock.now, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
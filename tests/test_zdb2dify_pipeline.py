@@ -1,8 +1,19 @@
+import asyncio
+import json
+import tempfile
+import time
 import unittest
-from unittest.mock import MagicMock, patch, PropertyMock
+from dataclasses import asdict, replace
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock, patch, PropertyMock
 import os
+import numpy as np
+from src.config import CONFIG
+from src.handler.chunker import Chunker, byte_level_encoding
+from src.handler.extraction_cache import ExtractionCache
+from src.handler.local_index import LocalIndex
 from src.pipeline.zdb2dify import Pipeline, PipeConfig
-from src.handler.zotero_database import ParentItem, Attachment
+from src.handler.zotero_database import ParentItem, Attachment, ZoteroDelta
 
 
 class TestPipeline(unittest.TestCase):
@@ -28,6 +39,10 @@ class TestPipeline(unittest.TestCase):
         # Mock methods
         self.mock_dkb.upload_document_by_file.return_value = "docid1"
         self.mock_dkb.update_document_metadata.return_value = {"code": 200}
+        self.mock_dkb.update_documents_metadata.return_value = {
+            "success": ["docid1"],
+            "failed": {},
+        }
         self.mock_dkb.delete_document.return_value = None
         self.mock_dkb.create_metadata.return_value = {"id": 2, "name": "newmeta"}
         
@@ -35,19 +50,22 @@ class TestPipeline(unittest.TestCase):
         self.zotero_patcher = patch('src.pipeline.zdb2dify.ZoteroConn')
         self.mock_zotero_cls = self.zotero_patcher.start()
         self.mock_zotero = self.mock_zotero_cls.return_value
+        self.mark = {"clientDateModified": "2026-01-02 00:00:00", "version": 7}
+        self.mock_zotero.get_high_water_mark.return_value = self.mark
         
+        self.tmpdir = tempfile.TemporaryDirectory()
         self.config = PipeConfig(
             kb_name="TestKB",
             tag_pattern="#test/%",
-            archive_path="test_zdb_archive.json",
+            archive_path=os.path.join(self.tmpdir.name, "test_zdb_archive.sqlite"),
         )
         self.pipeline = Pipeline(self.config)
 
     def tearDown(self):
         self.dkb_patcher.stop()
         self.zotero_patcher.stop()
-        if os.path.exists(self.config.archive_path):
-            os.remove(self.config.archive_path)
+        self.pipeline.archive.close()
+        self.tmpdir.cleanup()
 
     def make_attachment(self, key, tags, title="T", parent_title="PT"):
         parent = ParentItem(
@@ -69,12 +87,213 @@ class TestPipeline(unittest.TestCase):
         b2 = self.make_attachment("C", ["t4"])
         current = {a1.itemKey: a1, a2.itemKey: a2}
         archived = {b1.itemKey: b1, b2.itemKey: b2}
-        to_upload, to_update, to_delete = self.pipeline.diff_attachments(
+        to_upload, to_update, to_delete, to_replace = self.pipeline.diff_attachments(
             current, archived
         )
         self.assertIn(a2, to_upload)
         self.assertIn(a1, to_update)
         self.assertIn(b2, to_delete)
+        self.assertEqual(to_replace, [])
+
+    def test_file_change_detection(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with patch.dict(CONFIG["zotero"], {"data_dir": tmpdir}):
+                path = Path(tmpdir, "a.pdf")
+                path.write_bytes(b"v1")
+                archived = {"A": self.make_attachment("A", ["t1"]).with_file_state()}
+                # unchanged size and mtime: the archived hash is reused without reading
+                with patch("src.handler.zotero_database.hash_file") as mock_hash:
+                    current = self.pipeline.refresh_file_states(
+                        {"A": self.make_attachment("A", ["t1"])}, archived
+                    )
+                mock_hash.assert_not_called()
+                self.assertEqual(current["A"].fileHash, archived["A"].fileHash)
+                self.assertEqual(self.pipeline.diff_attachments(current, archived)[3], [])
+
+                path.write_bytes(b"version 2")
+                current = self.pipeline.refresh_file_states(
+                    {"A": self.make_attachment("A", ["t2"])}, archived
+                )
+                _, to_update, _, to_replace = self.pipeline.diff_attachments(
+                    current, archived
+                )
+                self.assertEqual([a.itemKey for a in to_replace], ["A"])
+                self.assertEqual(to_update, [])
+
+    def test_delta_sync_replaces_file_edited_on_disk(self):
+        # editing a PDF does not touch zotero.sqlite: the delta is empty
+        self.mock_zotero.get_delta.return_value = ZoteroDelta(
+            mark=self.mark, parents={}, erased_keys=[]
+        )
+        self.pipeline.save_high_water_mark(self.mark)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self.pipeline.config.zotero_db = tmpdir
+            with patch.dict(CONFIG["zotero"], {"data_dir": tmpdir}):
+                path = Path(tmpdir, "a.pdf")
+                path.write_bytes(b"v1")
+                self.pipeline.archive.put(self.make_attachment("A", ["t1"]).with_file_state())
+                self.assertEqual(self.pipeline.get_changed_files(), {})
+
+                path.write_bytes(b"version 2")
+                with patch.object(
+                    self.pipeline,
+                    "get_current_attachments",
+                    return_value={"A": self.make_attachment("A", ["t1"])},
+                ) as mock_current:
+                    self.pipeline.sync_modified_attachments()
+        mock_current.assert_called_once_with([1])
+        self.mock_dkb.update_document_by_file.assert_called_once()
+        self.assertEqual(self.pipeline.archive.get("A").fileSize, len(b"version 2"))
+
+    def test_file_check_throttled_while_zotero_unchanged(self):
+        mark = dict(self.mark, fingerprint={"change_counter": 1})
+        self.pipeline.save_high_water_mark(mark)
+        self.mock_zotero.get_delta.return_value = ZoteroDelta(
+            mark=mark, parents={}, erased_keys=[]
+        )
+        with patch.object(self.pipeline, "get_changed_files", return_value={}) as mock_check:
+            self.pipeline.sync_modified_attachments()  # never checked yet
+            self.pipeline.archive.set_meta("zotero.filesCheckedAt", str(time.time()))
+            self.pipeline.sync_modified_attachments()
+            self.assertEqual(mock_check.call_count, 1)
+            self.pipeline.config.file_check_interval = 0
+            self.pipeline.sync_modified_attachments()
+            self.assertEqual(mock_check.call_count, 2)
+            # any change in Zotero checks the files too
+            self.pipeline.config.file_check_interval = 3600
+            self.mock_zotero.get_delta.return_value = ZoteroDelta(
+                mark=dict(mark, fingerprint={"change_counter": 2}), parents={}, erased_keys=[]
+            )
+            self.pipeline.sync_modified_attachments()
+            self.assertEqual(mock_check.call_count, 3)
+
+    def test_legacy_archive_without_hash_is_not_replaced(self):
+        a1 = replace(self.make_attachment("A", ["t1"]), fileHash="h1")
+        b1 = self.make_attachment("A", ["t1"])
+        self.assertEqual(self.pipeline.diff_attachments({"A": a1}, {"A": b1})[3], [])
+
+    def test_apply_replace(self):
+        a1 = replace(self.make_attachment("A", ["t1"]), fileHash="h2")
+        result = self.pipeline.apply_sync_actions([], [], [], [a1])
+        self.mock_dkb.update_document_by_file.assert_called_once()
+        self.assertEqual(result["replace"], ["A"])
+
+    def test_failed_update_keeps_archived_version(self):
+        old = self.make_attachment("A", ["t1"])
+        new = self.make_attachment("A", ["t2"])
+        self.pipeline.archive.put(old)
+        with patch.object(self.pipeline, "get_current_attachments", return_value={"A": new}):
+            with patch.object(
+                self.pipeline,
+                "apply_sync_actions",
+                return_value={"upload": [], "update": [], "delete": [], "replace": []},
+            ):
+                self.pipeline.sync_zotero_attachments()
+        self.assertEqual(self.pipeline.archive.get("A").parentItem.tags, ("t1",))
+
+    def test_actions_recorded_per_item(self):
+        a1 = self.make_attachment("A", ["t1"])
+        a2 = self.make_attachment("B", ["t2"])
+        self.pipeline.archive.put(a2)
+        with patch.object(
+            self.pipeline, "upload_onefile", side_effect=["docid1", Exception("boom")]
+        ):
+            with patch("pathlib.Path.exists", return_value=True):
+                self.pipeline.apply_sync_actions(
+                    [a1, self.make_attachment("C", ["t3"])], [], [a2]
+                )
+        self.assertEqual(self.pipeline.archive.keys(), ["A"])
+
+    def test_completed_run_leaves_no_journal(self):
+        a1 = self.make_attachment("A", ["t1"])
+        with patch.object(self.pipeline, "upload_onefile", return_value="docid1"):
+            with patch("pathlib.Path.exists", return_value=True):
+                self.pipeline.apply_sync_actions([a1], [], [])
+        self.assertEqual(self.pipeline.archive.journal_pending(), [])
+
+    def test_resume_skips_actions_already_in_dify(self):
+        done_upload = self.make_attachment("A", ["t1"])  # "A" is live in Dify
+        new_upload = self.make_attachment("C", ["t3"])
+        gone = self.make_attachment("X", ["t4"])  # no live document any more
+        self.pipeline.archive.put(gone)
+        self.pipeline.archive.journal_begin(
+            [("upload", done_upload), ("upload", new_upload), ("delete", gone)]
+        )
+        with patch.object(
+            self.pipeline, "upload_onefile", return_value="docid3"
+        ) as mock_upload:
+            with patch("pathlib.Path.exists", return_value=True):
+                result = self.pipeline.resume_sync()
+        mock_upload.assert_called_once()
+        self.mock_dkb.delete_document.assert_not_called()
+        self.mock_dkb.invalidate.assert_called_with("documents")
+        self.assertEqual(sorted(result["upload"]), ["A", "C"])
+        self.assertEqual(result["delete"], ["X"])
+        self.assertEqual(sorted(self.pipeline.archive.keys()), ["A", "C"])
+        self.assertEqual(self.pipeline.archive.journal_pending(), [])
+
+    def test_resume_tags_document_created_before_crash(self):
+        # uploaded, then interrupted before the metadata update: no itemKey in Dify yet
+        untagged = self.make_attachment("C", ["t3"])
+        run_id = self.pipeline.archive.journal_begin([("upload", untagged)])
+        self.pipeline.archive.journal_document(run_id, "upload", "C", "docid3")
+        self.mock_dkb.update_documents_metadata.return_value = {
+            "success": ["docid3"],
+            "failed": {},
+        }
+        with patch.object(self.pipeline, "upload_onefile") as mock_upload:
+            result = self.pipeline.resume_sync()
+        mock_upload.assert_not_called()
+        operations = self.mock_dkb.update_documents_metadata.call_args[0][1]
+        self.assertEqual([doc_id for doc_id, _ in operations], ["docid3"])
+        self.mock_dkb.remember_document.assert_called_with("C", "docid3")
+        self.assertEqual(result["upload"], ["C"])
+        self.assertIn("C", self.pipeline.archive)
+
+    def test_upload_journals_document_before_metadata(self):
+        att = self.make_attachment("C", ["t3"])
+        self.pipeline.begin_run([att], [], [], [])
+        self.mock_dkb.update_document_metadata.side_effect = Exception("crash")
+        with patch("pathlib.Path.exists", return_value=True):
+            with self.assertRaises(Exception):
+                self.pipeline.upload_onefile(att.abspath, att.to_dict())
+        self.assertEqual(
+            self.pipeline.archive.journal_pending_documents(),
+            [("upload", att, "docid1")],
+        )
+
+    def test_resume_drops_superseded_update(self):
+        stale = self.make_attachment("A", ["old"])
+        self.pipeline.archive.journal_begin([("update", stale)])
+        self.pipeline.archive.put(self.make_attachment("A", ["new"]))  # a later sync
+        with patch.object(self.pipeline, "update_metadata_batch") as mock_update:
+            self.pipeline.resume_sync()
+        self.assertEqual(mock_update.call_args[0][0], [])
+        self.assertEqual(self.pipeline.archive.get("A").parentItem.tags, ("new",))
+
+    def test_legacy_json_archive_migrated(self):
+        a1 = self.make_attachment("A", ["t1"])
+        json_path = Path(self.tmpdir.name, "legacy.json")
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump([asdict(a1)], f)
+        archive = Pipeline.open_archive(str(json_path))
+        self.assertEqual(archive.path, json_path.with_suffix(".sqlite"))
+        self.assertEqual(archive.get("A"), a1)
+        self.assertFalse(json_path.exists())
+        archive.close()
+
+    def test_only_json_next_to_archive_migrated(self):
+        legacy = Path(self.tmpdir.name, "zdb_attachments.json")
+        legacy.write_text("[]", encoding="utf-8")
+        json_path = Path(self.tmpdir.name, "other.json")
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump([asdict(self.make_attachment("A", ["t1"]))], f)
+        with patch("src.pipeline.zdb2dify.LEGACY_ARCHIVE_PATH", legacy):
+            archive = Pipeline.open_archive(str(json_path.with_suffix(".sqlite")))
+        self.assertIn("A", archive)
+        # the old default is only migrated into the default archive
+        self.assertTrue(legacy.exists())
+        archive.close()
 
     def test_apply_sync_actions(self):
         a1 = self.make_attachment("A", ["t1"])
@@ -91,7 +310,56 @@ class TestPipeline(unittest.TestCase):
                 
                 self.assertIn("B", result["upload"])
                 self.assertIn("A", result["update"])
-                self.mock_dkb.update_document_metadata.assert_called()
+                self.mock_dkb.update_documents_metadata.assert_called_once()
+                operations = self.mock_dkb.update_documents_metadata.call_args[0][1]
+                self.assertEqual([doc_id for doc_id, _ in operations], ["docid1"])
+
+    def test_update_metadata_batch_partial_failure(self):
+        a1 = self.make_attachment("A", ["t1"])
+        a2 = self.make_attachment("B", ["t2"])
+        self.mock_dkb.update_documents_metadata.return_value = {
+            "success": ["docid2"],
+            "failed": {"docid1": "Status: 400, Detail: bad value"},
+        }
+        self.assertEqual(self.pipeline.update_metadata_batch([a1, a2]), ["B"])
+
+    def test_apply_sync_actions_async(self):
+        a1 = self.make_attachment("A", ["t1"])
+        a2 = self.make_attachment("B", ["t2"])
+        a3 = self.make_attachment("C", ["t3"])
+        self.mock_dkb.kb_config = MagicMock()
+        with patch("src.pipeline.zdb2dify.AsyncDifyKnowledgeBase") as mock_async_cls:
+            kb = mock_async_cls.return_value.__aenter__.return_value
+            kb.upload_document_by_file = AsyncMock(
+                side_effect=["docid3", Exception("boom")]
+            )
+            kb.update_document_metadata = AsyncMock(return_value={"result": "success"})
+            kb.update_documents_metadata = AsyncMock(
+                return_value={"success": ["docid1"], "failed": {}}
+            )
+            kb.delete_document = AsyncMock(return_value={"result": "success"})
+            with patch("pathlib.Path.exists", return_value=True):
+                result = asyncio.run(
+                    self.pipeline.apply_sync_actions_async([a3, a2], [a1], [a2])
+                )
+        # one upload failed: reported per item, not raised
+        self.assertEqual(len(result["upload"]), 1)
+        self.assertEqual(result["update"], ["A"])
+        self.assertEqual(result["delete"], ["B"])
+        kb.delete_document.assert_awaited_once_with("ds1", "docid2")
+
+    def test_sync_uses_async_path(self):
+        self.pipeline.config.concurrency = 4
+        with patch.object(self.pipeline, "get_current_attachments", return_value={}):
+            with patch.object(self.pipeline, "get_archived_attachments", return_value={}):
+                with patch.object(
+                    self.pipeline,
+                    "apply_sync_actions_async",
+                    new=AsyncMock(return_value={"upload": [], "update": [], "delete": []}),
+                ) as mock_apply:
+                    with patch.object(self.pipeline, "save_local_archive"):
+                        self.pipeline.sync_zotero_attachments()
+        mock_apply.assert_awaited_once()
 
     def test_save_and_get_archived_attachments(self):
         a1 = self.make_attachment("A", ["t1"])
@@ -105,12 +373,212 @@ class TestPipeline(unittest.TestCase):
         
         with patch.object(self.pipeline, 'get_current_attachments', return_value={"A": a1}):
             with patch.object(self.pipeline, 'get_archived_attachments', return_value={}):
-                with patch.object(self.pipeline, 'apply_sync_actions', 
-                                  return_value={"upload": ["A"], "update": [], "delete": []}) as mock_apply:
-                    with patch.object(self.pipeline, 'save_local_archive') as mock_save:
+                with patch.object(self.pipeline, 'upload_onefile', return_value="docid1") as mock_upload:
+                    with patch('pathlib.Path.exists', return_value=True):
                         self.pipeline.sync_zotero_attachments()
-                        mock_apply.assert_called()
-                        mock_save.assert_called()
+                        mock_upload.assert_called()
+        self.assertEqual(self.pipeline.archive.get("A"), a1)
+
+    def test_sync_records_high_water_mark(self):
+        with patch.object(self.pipeline, "get_current_attachments", return_value={}):
+            self.pipeline.sync_zotero_attachments()
+        self.assertEqual(self.pipeline.load_high_water_mark(), self.mark)
+
+    def test_sync_modified_attachments_diffs_only_the_slice(self):
+        a1 = self.make_attachment("A", ["t1"])
+        other = replace(
+            self.make_attachment("Z", ["t9"]),
+            parentItem=ParentItem(itemID=9, key="OTHER", tags=["t9"], title="", itemTypeID=0),
+        )
+        erased = replace(self.make_attachment("B", ["t2"]), parentItem=other.parentItem)
+        self.pipeline.archive.put_many([a1, other, erased])
+        since = {"clientDateModified": "2026-01-01 00:00:00", "version": 5}
+        self.pipeline.save_high_water_mark(since)
+        self.mock_zotero.get_delta.return_value = ZoteroDelta(
+            mark=self.mark, parents={1: "PK"}, erased_keys=["B"]
+        )
+        a1_new = self.make_attachment("A", ["t2"])
+        with patch.object(
+            self.pipeline, "get_current_attachments", return_value={"A": a1_new}
+        ) as mock_current:
+            self.pipeline.sync_modified_attachments()
+        mock_current.assert_called_once_with([1])
+        self.mock_zotero.get_delta.assert_called_once_with(since)
+        # "Z" is outside the slice and kept, the erased "B" is deleted
+        self.mock_dkb.delete_document.assert_called_once_with("ds1", "docid2")
+        self.assertEqual(sorted(self.pipeline.archive.keys()), ["A", "Z"])
+        self.assertEqual(self.pipeline.archive.get("A").parentItem.tags, ("t2",))
+        self.assertEqual(self.pipeline.load_high_water_mark(), self.mark)
+
+    def test_sync_modified_attachments_noop(self):
+        self.pipeline.save_high_water_mark(self.mark)
+        self.mock_zotero.get_delta.return_value = ZoteroDelta(
+            mark=self.mark, parents={}, erased_keys=[]
+        )
+        with patch.object(self.pipeline, "get_current_attachments") as mock_current:
+            self.pipeline.sync_modified_attachments()
+        mock_current.assert_not_called()
+
+    def test_failed_item_retried_while_the_mark_advances(self):
+        a1 = self.make_attachment("A", ["t1"])
+        sibling = self.make_attachment("S", ["t1"])
+        self.pipeline.archive.put(sibling)
+        with patch.object(
+            self.pipeline, "get_current_attachments", return_value={"A": a1, "S": sibling}
+        ):
+            with patch.object(self.pipeline, "upload_onefile", side_effect=Exception("boom")):
+                with patch("pathlib.Path.exists", return_value=True):
+                    self.pipeline.sync_zotero_attachments()
+        self.assertEqual(self.pipeline.load_high_water_mark(), self.mark)
+        self.assertEqual(self.pipeline.load_retry_items(), {"A": 1})
+
+        # nothing changed in Zotero: the delta is empty, only "A" is synced again
+        newer = dict(self.mark, version=8)
+        self.mock_zotero.get_delta.return_value = ZoteroDelta(
+            mark=newer, parents={}, erased_keys=[]
+        )
+        with patch.object(
+            self.pipeline, "get_current_attachments", return_value={"A": a1, "S": sibling}
+        ) as mock_current:
+            with patch.object(self.pipeline, "upload_onefile", return_value="docid1") as mock_upload:
+                with patch("pathlib.Path.exists", return_value=True):
+                    self.pipeline.sync_modified_attachments()
+        self.mock_zotero.get_delta.assert_called_once_with(self.mark)
+        mock_current.assert_called_once_with([1])
+        mock_upload.assert_called_once()
+        self.assertEqual(self.pipeline.load_high_water_mark(), newer)
+        self.assertEqual(self.pipeline.load_retry_items(), {})
+        self.assertIn("A", self.pipeline.archive)
+
+    def test_attachments_without_file_are_retried(self):
+        linked = replace(self.make_attachment("U", ["t1"]), relpath=None)
+        missing = self.make_attachment("M", ["t1"])
+        with patch.object(
+            self.pipeline, "get_current_attachments", return_value={"U": linked, "M": missing}
+        ):
+            with patch.object(self.pipeline, "upload_onefile") as mock_upload:
+                with patch("pathlib.Path.exists", return_value=False):
+                    self.pipeline.sync_zotero_attachments()
+        mock_upload.assert_not_called()
+        # the file may be downloaded later without a change in Zotero, linked URLs never have one
+        self.assertEqual(self.pipeline.load_retry_items(), {"M": 1})
+        self.assertEqual(self.pipeline.load_high_water_mark(), self.mark)
+
+    def test_sync_modified_attachments_without_mark_runs_full_sync(self):
+        with patch.object(self.pipeline, "sync_zotero_attachments") as mock_full:
+            self.pipeline.sync_modified_attachments()
+        mock_full.assert_called_once()
+
+    def test_streaming_sync(self):
+        self.pipeline.config.stream_batch_size = 2
+        kept = self.make_attachment("A", ["t1"])
+        gone = self.make_attachment("B", ["t2"])
+        self.pipeline.archive.put_many([kept, gone])
+        new = [self.make_attachment(k, ["t3"]) for k in ("C", "D", "E")]
+        self.mock_zotero.iter_attachment_batches.return_value = iter(
+            [[replace(kept, parentItem=replace(kept.parentItem, tags=["t9"])), new[0]], new[1:]]
+        )
+        with patch.object(
+            self.pipeline, "upload_onefile", side_effect=["d3", "d4", "d5"]
+        ) as mock_upload:
+            with patch("pathlib.Path.exists", return_value=True):
+                self.pipeline.sync_zotero_attachments()
+        self.mock_zotero.iter_attachment_batches.assert_called_once_with(
+            "#test/%", batch_size=2
+        )
+        self.assertEqual(mock_upload.call_count, 3)
+        self.mock_dkb.delete_document.assert_called_once_with("ds1", "docid2")
+        self.assertEqual(sorted(self.pipeline.archive.keys()), ["A", "C", "D", "E"])
+        self.assertEqual(self.pipeline.archive.get("A").parentItem.tags, ("t9",))
+
+    def test_extracted_text_uploaded_instead_of_file(self):
+        a1 = self.make_attachment("A", ["t1"])
+        a2 = self.make_attachment("B", ["t2"])
+        self.mock_dkb.upload_document_by_text.return_value = {"document": {"id": "docid3"}}
+        self.mock_dkb.update_documents_metadata.return_value = {
+            "success": ["docid2"],
+            "failed": {},
+        }
+        with patch.object(self.pipeline, "extract_texts", return_value={"A": "# text"}):
+            with patch("pathlib.Path.exists", return_value=True):
+                result = self.pipeline.apply_sync_actions([a1], [], [], [a2])
+        self.assertEqual(result["upload"], ["A"])
+        self.mock_dkb.upload_document_by_text.assert_called_once_with("ds1", "a.pdf", "# text")
+        self.mock_dkb.upload_document_by_file.assert_not_called()
+        # no text for B, its file is sent as before
+        self.mock_dkb.update_document_by_file.assert_called_once()
+        self.mock_dkb.update_document_by_text.assert_not_called()
+
+    def test_extract_texts_only_for_extractable_files(self):
+        pdf = replace(self.make_attachment("A", ["t1"]), contentType="application/pdf")
+        png = replace(self.make_attachment("B", ["t1"]), contentType="image/png")
+        self.assertEqual(self.pipeline.extract_texts([pdf, png]), {})
+        self.pipeline.extractor = MagicMock()
+        self.pipeline.extractor.extract_many.return_value = {pdf.abspath: "# text"}
+        with patch("pathlib.Path.is_file", return_value=True):
+            self.assertEqual(self.pipeline.extract_texts([pdf, png]), {"A": "# text"})
+        files = list(self.pipeline.extractor.extract_many.call_args[0][0])
+        self.assertEqual(files, [(pdf.abspath, None)])
+
+    def test_local_index_follows_runs(self):
+        self.pipeline.index = LocalIndex(
+            os.path.join(self.tmpdir.name, "index.sqlite"),
+            embed=lambda texts: np.ones((len(texts), 4), dtype=np.float32),
+        )
+        a1 = self.make_attachment("A", ["t1"])
+        self.mock_dkb.upload_document_by_text.return_value = {"document": {"id": "docid3"}}
+        text = "urban heat\n\nstreet trees"
+        with patch.object(self.pipeline, "extract_texts", return_value={"A": text}):
+            with patch("pathlib.Path.exists", return_value=True):
+                self.pipeline.apply_sync_actions([a1], [], [], [])
+        self.assertEqual(self.pipeline.index.search_keys("trees"), ["A"])
+        self.pipeline.apply_sync_actions([], [], [a1], [])
+        self.assertNotIn("A", self.pipeline.index)
+        self.pipeline.index.close()
+
+    def test_backfill_index_from_extraction_cache(self):
+        self.pipeline.index = LocalIndex(
+            os.path.join(self.tmpdir.name, "index.sqlite"),
+            embed=lambda texts: np.ones((len(texts), 4), dtype=np.float32),
+        )
+        self.pipeline.index.upsert("C", ["already indexed"])
+        cache = ExtractionCache(os.path.join(self.tmpdir.name, "cache"), "docling", "1")
+        cache.put("h1", "street trees")
+        self.pipeline.extractor = MagicMock(cache=cache)
+        pdf = "application/pdf"
+        self.pipeline.archive.put_many([
+            replace(self.make_attachment("A", ["t1"]), contentType=pdf, fileHash="h1"),
+            # no cached text, indexed by its next upload
+            replace(self.make_attachment("B", ["t1"]), contentType=pdf, fileHash="h2"),
+            replace(self.make_attachment("C", ["t1"]), contentType=pdf, fileHash="h3"),
+        ])
+        self.pipeline.backfill_index()
+        self.assertEqual(self.pipeline.index.keys(), {"A", "C"})
+        rows = self.pipeline.index.db.execute("SELECT itemKey, text FROM chunks").fetchall()
+        self.assertIn(("A", "street trees"), rows)
+        self.assertTrue(self.pipeline.index.backfilled)
+        self.pipeline.index.close()
+
+    def test_backfill_runs_once(self):
+        path = os.path.join(self.tmpdir.name, "index.sqlite")
+        config = replace(self.config, local_index=True, local_index_path=path)
+        with patch.object(Pipeline, "backfill_index") as mock_backfill:
+            Pipeline(config).close()
+            mock_backfill.assert_called_once()
+            index = LocalIndex(path)
+            index.mark_backfilled()
+            index.close()
+            Pipeline(config).close()
+            mock_backfill.assert_called_once()
+        # a model change empties the index, it is filled again
+        index = LocalIndex(path, embed=lambda texts: np.ones((len(texts), 4), dtype=np.float32))
+        self.assertFalse(index.backfilled)
+        index.close()
+
+    def test_prechunk_texts(self):
+        self.pipeline.chunker = Chunker(encoding=byte_level_encoding())
+        texts = self.pipeline.prechunk_texts({"A": "one  two\n\n\n\n\nthree"})
+        self.assertEqual(texts, {"A": "one two\n\n\nthree"})
 
     def test_upload_onefile(self):
         # Test the actual upload_onefile method
@@ -0,0 +1,317 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from dataclasses import asdict, replace
+from pathlib import Path
+from unittest.mock import patch
+
+from benchmarks.synthetic_zotero import build_zotero_db
+from src.handler.extraction_cache import ExtractionCache
+from src.handler.zotero_database import Attachment, ParentItem, ZoteroConn
+
+
+def make_db(path, rows=3):
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS items (itemID INTEGER PRIMARY KEY, key TEXT)"
+    )
+    conn.executemany(
+        "INSERT INTO items (key) VALUES (?)", [(f"K{i}",) for i in range(rows)]
+    )
+    conn.commit()
+    conn.close()
+
+
+class TestModels(unittest.TestCase):
+    def make_attachment(self, tags):
+        parent = ParentItem(itemID=1, key="PK", tags=tags, title="PT", itemTypeID=22)
+        return Attachment(
+            itemID=2,
+            itemKey="A",
+            contentType="application/pdf",
+            relpath="storage/A/a.pdf",
+            title="T",
+            parentItem=parent,
+        )
+
+    def test_slotted_hashable_with_tuple_tags(self):
+        a = self.make_attachment(["#read/todo", "x"])
+        self.assertEqual(a.parentItem.tags, ("#read/todo", "x"))
+        self.assertFalse(hasattr(a, "__dict__"))
+        self.assertFalse(hasattr(a.parentItem, "__dict__"))
+        self.assertEqual(hash(a), hash(self.make_attachment(("#read/todo", "x"))))
+        self.assertEqual(len({a, self.make_attachment(["#read/todo", "x"])}), 1)
+
+    def test_tags_interned(self):
+        tag = "".join(["#read/", "todo"])  # built at runtime, not a constant
+        a = self.make_attachment([tag])
+        b = self.make_attachment(["#read/todo"])
+        self.assertIs(a.parentItem.tags[0], b.parentItem.tags[0])
+
+    def test_from_dict_interns_parents(self):
+        d = asdict(self.make_attachment(["t1"]))
+        parents = {}
+        a = Attachment.from_dict(d, parents)
+        b = Attachment.from_dict(dict(d, itemKey="B"), parents)
+        self.assertIs(a.parentItem, b.parentItem)
+        self.assertEqual(a, self.make_attachment(["t1"]))
+
+    def test_cached_text(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = ExtractionCache(tmpdir, "docling", "1")
+            a = self.make_attachment(["t1"])
+            self.assertIsNone(a.cached_text(cache))
+            a = replace(a, fileHash="ab" * 32)
+            self.assertIsNone(a.cached_text(cache))
+            cache.put(a.fileHash, "# text")
+            self.assertEqual(a.cached_text(cache), "# text")
+
+
+class TestZoteroSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.data_dir = Path(self.tmpdir.name)
+        make_db(self.data_dir / "zotero.sqlite")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def count_items(self, conn):
+        return conn.db.execute("SELECT count(*) FROM items").fetchone()[0]
+
+    def test_backup_snapshot(self):
+        conn = ZoteroConn(self.data_dir, snapshot_mode="backup")
+        self.assertTrue(conn.dest.exists())
+        self.assertTrue(conn.state_path.exists())
+        self.assertEqual(self.count_items(conn), 3)
+        self.assertGreaterEqual(conn.snapshot_seconds, 0.0)
+        conn.db.close()
+
+    def test_backup_skipped_when_unchanged(self):
+        ZoteroConn(self.data_dir).db.close()
+        mtime = os.stat(self.data_dir / "zotero.wrap.sqlite.bak").st_mtime_ns
+        conn = ZoteroConn(self.data_dir)
+        self.assertEqual(conn.dest.stat().st_mtime_ns, mtime)
+        conn.db.close()
+
+    def test_backup_refreshed_when_changed(self):
+        ZoteroConn(self.data_dir).db.close()
+        make_db(self.data_dir / "zotero.sqlite", rows=2)
+        conn = ZoteroConn(self.data_dir)
+        self.assertEqual(self.count_items(conn), 5)
+        conn.db.close()
+
+    def test_readonly_mode(self):
+        conn = ZoteroConn(self.data_dir, snapshot_mode="readonly")
+        self.assertFalse(conn.dest.exists())
+        self.assertEqual(self.count_items(conn), 3)
+        with self.assertRaises(sqlite3.OperationalError):
+            conn.db.execute("INSERT INTO items (key) VALUES ('X')")
+        conn.db.close()
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            ZoteroConn(self.data_dir, snapshot_mode="rsync")
+
+
+class TestZoteroQueries(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        build_zotero_db(
+            Path(self.tmpdir.name) / "zotero.sqlite", n_items=50, attachments_per_item=2
+        )
+        self.conn = ZoteroConn(self.tmpdir.name)
+
+    def tearDown(self):
+        self.conn.db.close()
+        self.tmpdir.cleanup()
+
+    def legacy_attachments(self, tag_pattern):
+        res = []
+        for parent in self.conn.get_parent_items_with_special_tag(tag_pattern):
+            res.extend(self.conn.get_attachments_by_parent_item(parent))
+        return res
+
+    def test_bulk_loader_matches_per_item_queries(self):
+        for tag_pattern in ("#%/%", "#read/%", "#topic/llm"):
+            legacy = {a.itemKey: a for a in self.legacy_attachments(tag_pattern)}
+            pairs = self.conn.get_parent_items_with_attachments(tag_pattern)
+            bulk = {a.itemKey: a for _, atts in pairs for a in atts}
+            self.assertTrue(legacy)
+            self.assertEqual(legacy.keys(), bulk.keys())
+            for key, att in legacy.items():
+                other = bulk[key]
+                self.assertEqual(
+                    (att.itemID, att.title, att.relpath, att.contentType),
+                    (other.itemID, other.title, other.relpath, other.contentType),
+                )
+                self.assertEqual(att.parentItem.key, other.parentItem.key)
+                self.assertEqual(att.parentItem.title, other.parentItem.title)
+                self.assertEqual(
+                    sorted(att.parentItem.tags), sorted(other.parentItem.tags)
+                )
+
+    def test_bulk_loader_parents(self):
+        parents = self.conn.get_parent_items_with_special_tag("#%/%")
+        pairs = self.conn.get_parent_items_with_attachments("#%/%")
+        self.assertEqual({p.key for p in parents}, {p.key for p, _ in pairs})
+        for parent, atts in pairs:
+            self.assertEqual(len(atts), 2)
+            self.assertTrue(all(t.startswith("#") for t in parent.tags))
+
+    def test_stream_matches_bulk_loader(self):
+        pairs = self.conn.get_parent_items_with_attachments("#%/%")
+        bulk = {a.itemKey: a for _, atts in pairs for a in atts}
+        batches = list(self.conn.iter_attachment_batches("#%/%", batch_size=7))
+        self.assertTrue(all(len(b) == 7 for b in batches[:-1]))
+        streamed = [a for batch in batches for a in batch]
+        self.assertEqual(len(streamed), len(bulk))
+        # ordered by parent: each parent is built once and shared by its attachments
+        parent_ids = [a.parentItem.itemID for a in streamed]
+        self.assertEqual(parent_ids, sorted(parent_ids))
+        self.assertEqual(
+            len({id(a.parentItem) for a in streamed}), len(set(parent_ids))
+        )
+        for att in streamed:
+            other = bulk[att.itemKey]
+            self.assertEqual(att, replace(other, parentItem=att.parentItem))
+            self.assertEqual(sorted(att.parentItem.tags), sorted(other.parentItem.tags))
+            self.assertEqual(
+                replace(att.parentItem, tags=[]), replace(other.parentItem, tags=[])
+            )
+        scoped = list(
+            self.conn.iter_attachments("#%/%", parent_ids=[pairs[0][0].itemID])
+        )
+        self.assertEqual([a.itemKey for a in scoped], [a.itemKey for a in pairs[0][1]])
+
+    def query_plans(self, func, *args, **kwargs):
+        """
+        EXPLAIN QUERY PLAN of every statement `func` runs on the connection.
+        """
+        statements = []
+        self.conn.db.set_trace_callback(statements.append)
+        try:
+            func(*args, **kwargs)
+        finally:
+            self.conn.db.set_trace_callback(None)
+        return [
+            [row[3] for row in self.conn.db.execute("EXPLAIN QUERY PLAN " + sql)]
+            for sql in dict.fromkeys(statements)
+        ]
+
+    def assert_indexed(self, plans):
+        for plan in plans:
+            for step in plan:
+                # only the small tags table and CTE / json_each results may be scanned
+                for table in ("items", "itemTags", "itemData", "itemAttachments"):
+                    self.assertFalse(step.startswith(f"SCAN {table}"), plan)
+
+    def test_query_plans_use_indexes(self):
+        index = "SEARCH itemTags USING INDEX itemTags_tagID (tagID=?)"
+        plans = self.query_plans(self.conn.get_parent_items_with_attachments, "#%/%")
+        self.assert_indexed(plans)
+        self.assertTrue(all(index in plan for plan in plans))
+        parents = self.conn.get_parent_items_with_special_tag("#read/%")
+        plans = self.query_plans(self.conn.get_parent_items_with_special_tag, "#read/%")
+        self.assert_indexed(plans)
+        self.assertIn(index, plans[0])
+        self.assert_indexed(
+            self.query_plans(self.conn.get_attachments_by_parent_item, parents[0])
+        )
+        self.assert_indexed(
+            self.query_plans(list, self.conn.iter_attachment_batches("#%/%"))
+        )
+        plans = self.query_plans(
+            self.conn.get_parent_items_with_attachments, "#%/%", parent_ids=[1, 4]
+        )
+        self.assert_indexed(plans)
+        # the requested parents drive, not the tag index
+        by_item = "SEARCH itemTags USING COVERING INDEX sqlite_autoindex_itemTags_1 (itemID=?)"
+        self.assertTrue(all(by_item in plan and index not in plan for plan in plans))
+
+    def test_quoted_tag_pattern(self):
+        parent = self.conn.get_parent_items_with_special_tag("#%/%")[0]
+        self.live_execute(
+            ("INSERT INTO tags (tagID, name) VALUES (100, ?)", ("#it's/done",)),
+            ("INSERT INTO itemTags VALUES (?, 100, 0)", (parent.itemID,)),
+        )
+        for load in (
+            self.conn.get_parent_items_with_special_tag,
+            lambda pattern: [
+                p for p, _ in self.conn.get_parent_items_with_attachments(pattern)
+            ],
+        ):
+            self.assertEqual([p.key for p in load("#it's/%")], [parent.key])
+
+    def live_execute(self, *statements):
+        live = sqlite3.connect(self.conn.src)
+        for sql, params in statements:
+            live.execute(sql, params)
+        live.commit()
+        live.close()
+        self.conn.refresh()
+
+    def test_delta(self):
+        pairs = self.conn.get_parent_items_with_attachments("#%/%")
+        (edited, _), (_, [att, _]), (trashed, _), (erased, _) = pairs[:4]
+        self.live_execute(
+            ("UPDATE items SET clientDateModified = '2026-01-01 00:00:00'", ()),
+            ("UPDATE items SET version = 3 WHERE itemID = ?", (edited.itemID,)),
+            (
+                "UPDATE items SET clientDateModified = '2026-01-02 10:00:00' WHERE itemID = ?",
+                (att.itemID,),
+            ),
+        )
+        since = self.conn.get_high_water_mark()
+        self.assertEqual(since["clientDateModified"], "2026-01-02 10:00:00")
+        self.assertEqual(since["version"], 3)
+        delta = self.conn.get_delta(
+            {"clientDateModified": "2026-01-02 00:00:00", "version": 0}
+        )
+        self.assertEqual(
+            delta.parents,
+            {edited.itemID: edited.key, att.parentItem.itemID: att.parentItem.key},
+        )
+        self.assertEqual(delta.mark, since)
+        scoped = self.conn.get_parent_items_with_attachments(
+            "#%/%", parent_ids=delta.parents
+        )
+        self.assertEqual(
+            sorted(p.key for p, _ in scoped), sorted(delta.parents.values())
+        )
+
+        self.live_execute(
+            (
+                "INSERT INTO deletedItems VALUES (?, '2026-01-03 00:00:00')",
+                (trashed.itemID,),
+            ),
+            ("DELETE FROM items WHERE itemID = ?", (erased.itemID,)),
+            (
+                "INSERT INTO syncDeleteLog VALUES (3, 1, ?, '2026-01-04 00:00:00')",
+                (erased.key,),
+            ),
+        )
+        delta = self.conn.get_delta(since)
+        # the bound is inclusive: the attachment edited at the mark itself is seen again
+        self.assertEqual(
+            sorted(delta.parents.values()), sorted([trashed.key, att.parentItem.key])
+        )
+        self.assertEqual(delta.erased_keys, [erased.key])
+        self.assertEqual(delta.mark["clientDateModified"], "2026-01-04 00:00:00")
+        # trashed items are gone from the loaders
+        scoped = self.conn.get_parent_items_with_attachments(
+            "#%/%", parent_ids=[trashed.itemID]
+        )
+        self.assertEqual(scoped, [])
+
+    def test_delta_skipped_for_unchanged_snapshot(self):
+        mark = self.conn.get_high_water_mark()
+        with patch.object(self.conn, "get_modified_parents") as mock_modified:
+            delta = self.conn.get_delta(mark)
+        mock_modified.assert_not_called()
+        self.assertEqual((delta.parents, delta.erased_keys), ({}, []))
+
+
+if __name__ == "__main__":
+    unittest.main()